@@ -0,0 +1,329 @@
+"""Reading the DHT sensor in a separate process.
+
+DHT11 is read by bit-banging its timing critical protocol. Sharing the
+process with the event loop, the MQTT thread and the LCD driver makes its
+reads fail more often (that's also why it is sampled 5 times). With
+--acquisition=process the DHT sensors are read by a dedicated worker
+process running with a higher priority. It writes the filtered readings
+into a ring in shared memory; the daemon checks the ring every second and
+passes the new readings on as if it had read them itself.
+
+The ring is a header followed by the fixed size slots:
+
+    header      records written, heartbeat of the worker, number of slots
+    slot        sequence, timestamp, value, sensor, quantity, reads, failures
+
+The sequence of a slot is zeroed while it is being written so that the
+daemon can tell if it was overwritten under its hands. The worker is
+restarted when it exits or stops updating the heartbeat, i.e. when a read
+hangs.
+"""
+
+import asyncio
+import math
+import multiprocessing
+import os
+import signal
+import struct
+import time
+from multiprocessing import shared_memory
+
+import hal
+import log
+import metrics
+import sensors
+
+logger = log.getLogger("acquisition")
+
+RESTARTS = metrics.counter(
+    "acquisition_restarts_total", "Restarts of the acquisition process.", ("reason",))
+DROPPED = metrics.counter(
+    "acquisition_dropped_total", "Readings overwritten in the ring before being read.")
+
+# devices read by the worker
+DEVICES = ("dht",)
+# stands for the devices in the daemon which only needs to know the sensors
+REMOTE = object()
+
+COUNT = struct.Struct("<Q")
+HEARTBEAT = struct.Struct("<d")
+SIZE = struct.Struct("<L")
+HEADER_SIZE = 24
+RECORD = struct.Struct("<QddBBHH")
+SEQUENCE = struct.Struct("<Q")
+
+SLOTS = 256
+NICE = -10
+CHECK_INTERVAL = 1.0
+# worker not updating the heartbeat for this long is restarted
+HANG_TIMEOUT = 30.0
+# time the worker has to import everything and update the heartbeat
+START_TIMEOUT = 60.0
+# time the worker has to exit before it is killed
+STOP_TIMEOUT = 2.0
+
+class Ring(object):
+    """Readings in the shared memory written by the worker and read by the
+    daemon; `unpack_from` reads those straight from the shared buffer."""
+
+    def __init__(self, memory):
+        self.memory = memory
+        self.buffer = memory.buf
+        self.slots = SIZE.unpack_from(self.buffer, 16)[0]
+
+    @classmethod
+    def create(cls, slots=SLOTS):
+        memory = shared_memory.SharedMemory(
+            create=True, size=HEADER_SIZE + slots * RECORD.size)
+        SIZE.pack_into(memory.buf, 16, slots)
+        return cls(memory)
+
+    @classmethod
+    def attach(cls, name):
+        return cls(shared_memory.SharedMemory(name))
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def written(self):
+        return COUNT.unpack_from(self.buffer, 0)[0]
+
+    def heartbeat(self):
+        return HEARTBEAT.unpack_from(self.buffer, 8)[0]
+
+    def beat(self):
+        # monotonic time is the same in all the processes
+        HEARTBEAT.pack_into(self.buffer, 8, time.monotonic())
+
+    def _offset(self, position):
+        return HEADER_SIZE + position % self.slots * RECORD.size
+
+    def write(self, records):
+        """Append the records (without the sequence); the daemon sees all
+        of them at once."""
+        written = self.written()
+        for record in records:
+            offset = self._offset(written)
+            RECORD.pack_into(self.buffer, offset, 0, *record)
+            written += 1
+            SEQUENCE.pack_into(self.buffer, offset, written)
+        COUNT.pack_into(self.buffer, 0, written)
+
+    def read(self, position):
+        """Return the records written after the position, the new position
+        and the number of records overwritten before those were read."""
+        written = self.written()
+        lost = max(0, written - position - self.slots)
+        position += lost
+        records = []
+        while position < written:
+            offset = self._offset(position)
+            record = RECORD.unpack_from(self.buffer, offset)
+            position += 1
+            if record[0] == position and SEQUENCE.unpack_from(self.buffer, offset)[0] == position:
+                records.append(record)
+            else:
+                lost += 1
+        return records, position, lost
+
+    def close(self, unlink=False):
+        self.buffer = None
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+def split(configured, sampling):
+    """Split the sensors configuration into the one of the sensors read by
+    the daemon and the one of the sensors read by the worker."""
+    local, isolated = {}, {}
+    for name, options in sensors.sensorsConfig(configured, sampling).items():
+        remote = options.get("device", name) in DEVICES
+        (isolated if remote else local)[name] = options
+        # removes the default sensor
+        (local if remote else isolated)[name] = None
+    return local, isolated
+
+def worker(ringName, backendName, configured, sampling, level):
+    # the daemon stops the worker when it is interrupted
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    log.setup(level)
+    try:
+        os.nice(NICE)
+    except OSError as e:
+        logger.warning("can not raise the priority: %s", e)
+
+    ring = Ring.attach(ringName)
+    ring.beat()
+    backend = hal.getBackend(backendName)
+    devices = {"dht": backend.createDHT()}
+    loop = asyncio.new_event_loop()
+    engine = sensors.PollingEngine(loop)
+    engine.configure(sensors.createSensors(configured, sampling, devices))
+    indexes = {name: i for i, name in enumerate(engine.sensors)}
+    # reads and failures since the last readings of the sensor
+    counts = {}
+
+    def count(name, values, error):
+        entry = counts.setdefault(name, [0, 0])
+        entry[0] += 1
+        entry[1] += error is not None
+
+    def write(readings):
+        records = []
+        for reading in readings:
+            sensor = engine.sensors[reading.sensor]
+            reads, failures = counts.get(reading.sensor, (0, 0))
+            value = float("nan") if reading.value is None else reading.value
+            records.append((reading.timestamp, value, indexes[reading.sensor],
+                            list(sensor.units).index(reading.quantity), reads, failures))
+        for reading in readings:
+            counts.pop(reading.sensor, None)
+        ring.write(records)
+
+    async def heartbeat(parent):
+        # a read blocking the loop stops the heartbeat
+        while os.getppid() == parent:
+            ring.beat()
+            await asyncio.sleep(1.0)
+        logger.warning("daemon is gone; exiting")
+
+    engine.addSampleListener(count)
+    engine.addConsumer(write)
+    loop.create_task(engine.run())
+    try:
+        loop.run_until_complete(heartbeat(os.getppid()))
+    finally:
+        ring.close()
+
+class AcquisitionProcess(object):
+    """Supervisor of the worker reading the DHT sensors.
+
+    :param engine: the polling engine the readings are delivered to
+    """
+
+    def __init__(self, loop, backendName, engine, level="INFO"):
+        self.loop = loop
+        self.backendName = backendName
+        self.engine = engine
+        self.level = level
+        self.context = multiprocessing.get_context("spawn")
+        self.ring = Ring.create()
+        self.position = 0
+        self.process = None
+        self.running = False
+        self.restarting = None
+        self.started = None
+        self.isolated = None
+        self.sampling = None
+        # sensor of each index in the ring
+        self.sensors = []
+
+    def configure(self, configured, sampling):
+        """Return the configuration of the sensors read by the daemon; the
+        worker is restarted if the configuration of its sensors changed."""
+        local, isolated = split(configured, sampling)
+        if (isolated, sampling) != (self.isolated, self.sampling):
+            if self.process:
+                # with the indexes of the old sensors
+                self.receive()
+            self.isolated, self.sampling = isolated, sampling
+            self.sensors = sensors.createSensors(
+                isolated, sampling, dict.fromkeys(DEVICES, REMOTE))
+            if self.running:
+                self.restarting = self.loop.create_task(self.restart("config"))
+        return local
+
+    def start(self):
+        self.running = True
+        self._spawn()
+
+    def _spawn(self):
+        self.started = time.monotonic()
+        if not self.sensors:
+            return
+        self.process = self.context.Process(
+            target=worker, name="autoplant-acquisition", daemon=True,
+            args=(self.ring.name, self.backendName, self.isolated, self.sampling, self.level))
+        self.process.start()
+        logger.info("acquisition process %s started", self.process.pid)
+
+    async def stop(self):
+        process, self.process = self.process, None
+        if process is None:
+            return
+        # never join on the loop; the pump and the tank level are
+        # handled meanwhile
+        process.terminate()
+        deadline = time.monotonic() + STOP_TIMEOUT
+        while process.is_alive() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if process.is_alive():
+            process.kill()
+            while process.is_alive():
+                await asyncio.sleep(0.1)
+        process.join()
+
+    async def restart(self, reason):
+        logger.warning("restarting acquisition process: %s", reason)
+        RESTARTS.labels(reason).inc()
+        await self.stop()
+        # the daemon could have been stopped or the worker
+        # restarted by another restart meanwhile
+        if self.running and self.process is None:
+            self._spawn()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(CHECK_INTERVAL)
+            if self.restarting and not self.restarting.done():
+                continue
+            restart = self.check()
+            if restart:
+                self.restarting = self.loop.create_task(restart)
+                await self.restarting
+
+    def check(self):
+        """Return the restart coroutine if the worker needs one."""
+        if self.process is None:
+            return None
+        self.receive()
+        now = time.monotonic()
+        if not self.process.is_alive():
+            # don't restart the one failing on start too often
+            if now - self.started > HANG_TIMEOUT:
+                return self.restart("exited")
+        elif now > max(self.ring.heartbeat() + HANG_TIMEOUT, self.started + START_TIMEOUT):
+            return self.restart("hang")
+        return None
+
+    def receive(self):
+        records, self.position, lost = self.ring.read(self.position)
+        if lost:
+            DROPPED.inc(lost)
+            logger.warning("%s readings lost", lost)
+        readings = []
+        for _, timestamp, value, index, quantity, reads, failures in records:
+            if index >= len(self.sensors):
+                continue
+            sensor = self.sensors[index]
+            name, unit = list(sensor.units.items())[quantity]
+            if quantity == 0:
+                sensors.SENSOR_READS.labels(sensor.name).inc(reads)
+                sensors.SENSOR_FAILURES.labels(sensor.name).inc(failures)
+            readings.append(sensors.Reading(sensor.name, name, None if math.isnan(value) else value,
+                                            unit, timestamp))
+        if readings:
+            self.engine.deliver(readings)
+
+    def close(self):
+        # the loop is not running anymore so it can block
+        self.running = False
+        if self.process:
+            self.process.terminate()
+            self.process.join(STOP_TIMEOUT)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join()
+            self.process = None
+        self.ring.close(unlink=True)
@@ -0,0 +1,175 @@
+"""Aggregation of the readings before publishing them.
+
+Instead of publishing every single reading, the readings of each channel
+(temp, humid, soil, ...) are summarized over tumbling windows aligned to
+the wall clock (i.e. 8:00-8:05, 8:05-8:10, ...) and only one message with
+min/max/mean/stddev/count of all the channels is published per window.
+
+When a reading gets out of the alarm limits, the recent raw readings of
+the channel are published in one burst, followed by each raw reading for
+as long as the alarm lasts. The configuration goes to the "aggregation"
+section, i.e.:
+
+    "aggregation": {
+        "windows": [300, 900],
+        "alarms": {"temp": {"min": 5, "max": 35}, "level": {"max": 0}},
+        "burst": 10
+    }
+
+Without the section every reading is published as it is.
+"""
+
+import collections
+import math
+
+import clock
+import log
+import metrics
+
+logger = log.getLogger("aggregation")
+
+DEFAULT_BURST = 10
+
+AGGREGATED = metrics.counter(
+    "aggregated_readings_total", "Readings summarized instead of published.")
+WINDOWS = metrics.counter(
+    "aggregation_windows_total", "Published window summaries.", ("window",))
+ALARMS = metrics.counter("alarms_total", "Alarms raised.", ("channel",))
+
+class Stats(object):
+    """Streaming min/max/mean/stddev (Welford's algorithm)."""
+
+    __slots__ = ("count", "mean", "m2", "min", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def summary(self):
+        stddev = math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+        return {"count": self.count, "min": self.min, "max": self.max,
+                "mean": round(self.mean, 3), "stddev": round(stddev, 3)}
+
+class Window(object):
+
+    def __init__(self, seconds, start):
+        self.seconds = seconds
+        self.start = start
+        self.channels = {}
+
+    @property
+    def end(self):
+        return self.start + self.seconds
+
+    def add(self, channel, value):
+        stats = self.channels.get(channel)
+        if stats is None:
+            stats = self.channels[channel] = Stats()
+        stats.add(value)
+
+class Aggregator(object):
+    """
+    :param publish: function publishing the key and value (i.e. Mqtt.publish)
+    """
+
+    def __init__(self, loop, publish):
+        self.loop = loop
+        self.publish = publish
+        self.windows = {}
+        self.timers = {}
+        self.alarms = {}
+        self.alarming = set()
+        self.recent = {}
+        self.burst = DEFAULT_BURST
+
+    def enabled(self):
+        return bool(self.windows)
+
+    def configure(self, settings):
+        # publish what we have so far; the new windows start right away
+        self.flush()
+        self.alarms = dict(settings.get("alarms", {}))
+        self.alarming &= set(self.alarms)
+        self.burst = settings.get("burst", DEFAULT_BURST)
+        self.recent = {}
+        now = clock.now().timestamp()
+        for seconds in settings.get("windows", []):
+            self._open(seconds, now)
+
+    def flush(self):
+        for seconds in list(self.windows):
+            self._close(seconds)
+            del self.windows[seconds]
+            self.timers.pop(seconds).cancel()
+
+    def consume(self, readings):
+        # called by the polling engine
+        for reading in readings:
+            if reading.value is None:
+                continue
+            channel = reading.quantity
+            for window in self.windows.values():
+                # the timer can be late if the loop was busy
+                if reading.timestamp >= window.end:
+                    self._roll(window.seconds)
+                self.windows[window.seconds].add(channel, reading.value)
+            AGGREGATED.inc()
+            if channel in self.alarms:
+                self._checkAlarm(channel, reading)
+
+    def _open(self, seconds, now):
+        start = now - now % seconds
+        self.windows[seconds] = Window(seconds, start)
+        self.timers[seconds] = self.loop.call_later(
+            start + seconds - now, self._roll, seconds)
+
+    def _roll(self, seconds):
+        self.timers.pop(seconds).cancel()
+        self._close(seconds)
+        self._open(seconds, clock.now().timestamp())
+
+    def _close(self, seconds):
+        window = self.windows[seconds]
+        if not window.channels:
+            return
+        summary = {channel: stats.summary() for channel, stats in window.channels.items()}
+        WINDOWS.labels(str(seconds)).inc()
+        self.publish("summary", {"start": window.start, "window": seconds, "channels": summary})
+
+    def _checkAlarm(self, channel, reading):
+        limits = self.alarms[channel]
+        recent = self.recent.get(channel)
+        if recent is None:
+            recent = self.recent[channel] = collections.deque(maxlen=self.burst)
+        recent.append((reading.timestamp, reading.value))
+
+        low = "min" in limits and reading.value < limits["min"]
+        high = "max" in limits and reading.value > limits["max"]
+        if low or high:
+            if channel not in self.alarming:
+                self.alarming.add(channel)
+                ALARMS.labels(channel).inc()
+                logger.warning("%s alarm: %s", channel, reading.value)
+                # what led to the alarm
+                self.publish("alarm", {"channel": channel, "limit": "min" if low else "max",
+                                       "samples": list(recent)})
+            else:
+                self.publish(channel, reading.value)
+        elif channel in self.alarming:
+            self.alarming.discard(channel)
+            logger.info("%s alarm cleared: %s", channel, reading.value)
+            self.publish("alarm", {"channel": channel, "cleared": True,
+                                   "samples": [(reading.timestamp, reading.value)]})
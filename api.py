@@ -0,0 +1,125 @@
+"""Local query API.
+
+Lets the LAN clients see what the daemon is doing even if the cloud is
+not reachable. All the queries are answered from the memory (see
+history.py), never touching the sensors, so any number of them can't
+delay the control loop more than serializing the answer:
+
+    GET  /readings                              latest value of each channel
+    GET  /history?channel=temp&seconds=3600     raw readings of the channel
+    GET  /history?channel=temp&window=300       the same in windows with min/max/mean/...
+    GET  /actuators?seconds=86400               relay states and their transitions
+    GET  /schedule?hours=24                     upcoming jobs
+    POST /command                               the same commands as over MQTT, i.e.
+                                                {"command": "pump_on", "duration": 30}
+
+The commands go through the same queue as the ones received over MQTT (see
+commands.py); the rejected ones are answered with 400 if invalid, 429 if
+rate limited and 503 if the queue is full.
+"""
+
+import json
+from datetime import timedelta
+
+import aggregation
+import clock
+import commands
+import log
+import schedule
+
+logger = log.getLogger("api")
+
+MAX_SECONDS = 7 * 86400
+# of the rejected commands
+REJECTED_STATUS = {"invalid": 400, "rate_limited": 429, "queue_full": 503}
+
+def _json(data, status=200):
+    return (status, "application/json", json.dumps(data) + "\n")
+
+def _error(status, message):
+    return _json({"error": message}, status)
+
+def _number(request, name, default, maximum):
+    # raises ValueError on invalid values
+    value = float(request.query.get(name, default))
+    if not 0 < value <= maximum:
+        raise ValueError("{} out of range".format(name))
+    return value
+
+def routes(history, settings, submitCommand):
+    """
+    :param submitCommand: function queuing the command dict and returning
+                          the answer (see commands.CommandQueue.submit)
+    """
+
+    def readings(request):
+        return _json({channel: {"value": r.value, "unit": r.unit, "sensor": r.sensor,
+                                "time": r.timestamp}
+                      for channel, r in history.latest.items()})
+
+    def readingsHistory(request):
+        channel = request.query.get("channel")
+        if channel not in history.readings:
+            return _error(404, "unknown channel: {}".format(channel))
+        try:
+            seconds = _number(request, "seconds", 3600, MAX_SECONDS)
+            window = _number(request, "window", MAX_SECONDS, MAX_SECONDS)
+        except ValueError as e:
+            return _error(400, str(e))
+        points = history.since(channel, clock.now().timestamp() - seconds)
+        if "window" not in request.query:
+            return _json({"channel": channel, "readings": points})
+
+        windows = {}
+        for when, value in points:
+            start = when - when % window
+            stats = windows.get(start)
+            if stats is None:
+                stats = windows[start] = aggregation.Stats()
+            stats.add(value)
+        return _json({"channel": channel, "window": window, "windows": [
+            dict(stats.summary(), start=start) for start, stats in sorted(windows.items())]})
+
+    def actuators(request):
+        try:
+            seconds = _number(request, "seconds", 86400, MAX_SECONDS)
+        except ValueError as e:
+            return _error(400, str(e))
+        since = clock.now().timestamp() - seconds
+        return _json({
+            "state": {name: {"on": on, "since": when}
+                      for name, (when, on) in history.relays.items()},
+            "transitions": [{"time": when, "relay": name, "on": on}
+                            for when, name, on in history.transitionsSince(since)],
+        })
+
+    def upcoming(request):
+        try:
+            hours = _number(request, "hours", 24, 24 * 7)
+        except ValueError as e:
+            return _error(400, str(e))
+        now = clock.now()
+        jobs = schedule.getUpcomingJobs(settings.current.schedule, now + timedelta(hours=hours), now)
+        return _json([{"time": when.isoformat(), "job": name, "attr": attr}
+                      for when, name, attr in jobs])
+
+    def command(request):
+        if request.method != "POST":
+            return _error(405, "use POST")
+        try:
+            cmd = json.loads(request.body.decode("utf-8"))
+        except ValueError as e:
+            return _error(400, "invalid command: {}".format(e))
+        logger.info("got local command: %s", cmd)
+        answer = submitCommand(cmd)
+        if answer["status"] == commands.REJECTED:
+            return _json(answer, REJECTED_STATUS[answer["reason"]])
+        return _json(answer, 202)
+
+    return {
+        "/readings": readings,
+        "/history": readingsHistory,
+        "/actuators": actuators,
+        "/schedule": upcoming,
+        "/command": command,
+    }
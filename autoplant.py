@@ -1,26 +1,67 @@
-import board
-import digitalio
-import adafruit_dht
-import busio
-
 import time
+# used to report how long it takes from the start to the first measurement
+STARTED = time.monotonic()
+
 import asyncio
-from datetime import datetime, timedelta
+from datetime import datetime
 import argparse
 import json
+import signal
 
-import character_lcd_pcf8574 as char_lcd
 import schedule
-import mqtt
-
-def parse_command_line_args():
+import config
+import clock
+import hal
+import log
+import metrics
+import webserver
+import watchdog
+import journal
+import levelsensor
+import zones
+import watering
+import sensors
+import aggregation
+import history
+import api
+import tracing
+import profiler
+import acquisition
+import dashboard
+import commands
+import tasks
+import memory
+# NOTE: mqtt is imported only when enabled as it is pulling in jwt, paho
+# and cryptography which are slow to import on the Pi
+
+logger = log.getLogger("main")
+sensorsLog = log.getLogger("sensors")
+actuatorsLog = log.getLogger("actuators")
+scheduleLog = log.getLogger("schedule")
+
+DISPATCH_LATENESS = metrics.histogram(
+    "schedule_dispatch_lateness_seconds",
+    "Job start time relative to its schedule; negative if started early.",
+    buckets=(-60, -30, -10, -1, 0, 1, 5, 10, 30, 60))
+RELAY_ON = metrics.gauge("relay_on", "1 if the relay is switched on.", ("relay",))
+RELAY_ON_TIME = metrics.counter(
+    "relay_on_seconds_total", "Time the relay was switched on.", ("relay",))
+TASKS = metrics.gauge("tasks", "Number of asyncio tasks.")
+LOG_QUEUE = metrics.gauge("log_queue_depth", "Log records waiting to be written.")
+LOG_DROPPED = metrics.gauge("log_dropped", "Log records dropped as the queue was full.")
+FIRST_MEASUREMENT = metrics.gauge(
+    "first_measurement_seconds", "Time from the start until the first measurement.")
+
+# arguments needed only when connecting to GCP IoT Core
+MQTT_REQUIRED_ARGS = ('algorithm', 'device_id', 'private_key_file', 'project_id', 'registry_id')
+
+def parse_command_line_args(argv=None):
     """Parse command line arguments."""
     parser = argparse.ArgumentParser(description=(
             'Automatic gardening IoT client.'))
     parser.add_argument(
             '--algorithm',
             choices=('RS256', 'ES256'),
-            required=True,
             help='Which encryption algorithm to use to generate the JWT.')
     parser.add_argument(
             '--ca_certs',
@@ -29,7 +70,7 @@ def parse_command_line_args():
     parser.add_argument(
             '--cloud_region', default='us-central1', help='GCP cloud region')
     parser.add_argument(
-            '--device_id', required=True, help='Cloud IoT Core device id')
+            '--device_id', help='Cloud IoT Core device id')
     parser.add_argument(
             '--mqtt_bridge_hostname',
             default='mqtt.googleapis.com',
@@ -42,242 +83,569 @@ def parse_command_line_args():
             help='MQTT bridge port.')
     parser.add_argument(
             '--private_key_file',
-            required=True,
             help='Path to private key file.')
     parser.add_argument(
             '--project_id',
             help='GCP cloud project name')
     parser.add_argument(
-            '--registry_id', required=True, help='Cloud IoT Core registry id')
+            '--registry_id', help='Cloud IoT Core registry id')
     parser.add_argument(
             '--schedule_file',
             default='cron',
             help='Cron like file containing the jobs.')
+    parser.add_argument(
+            '--config_file',
+            default='autoplant-config.json',
+            help='Where to store the configuration received from the server.')
+    parser.add_argument(
+            '--state_file',
+            default='autoplant-state.json',
+            help='Where to store the running jobs so those can be resumed after restart.')
+    parser.add_argument(
+            '--mqtt_queue',
+            type=int,
+            default=1000,
+            help='Messages kept while disconnected; the newer ones are dropped.')
+    parser.add_argument(
+            '--mqtt_inflight',
+            type=int,
+            default=20,
+            help='Messages published without waiting for their PUBACK.')
+    parser.add_argument(
+            '--mqtt_retries',
+            type=int,
+            default=2,
+            help='Times a message is published again if the session was lost before PUBACK.')
+    parser.add_argument(
+            '--mqtt_expiry',
+            type=float,
+            default=3600,
+            help='Seconds after which a message not acked is given up on.')
     parser.add_argument(
             '--do_mqtt',
             action='store_true',
             help='Enable MQTT connection to GCP IoT Core.')
+    parser.add_argument(
+            '--backend',
+            choices=('rpi', 'sim', 'replay'),
+            default='rpi',
+            help='Devices to use; sim runs on simulated hardware and virtual time, '
+                 'replay replays the --replay_file trace on virtual time.')
+    parser.add_argument(
+            '--acquisition',
+            choices=('loop', 'process'),
+            default='loop',
+            help='Read the DHT sensor on the event loop or in a separate process '
+                 'with a higher priority (rpi backend only).')
+    parser.add_argument(
+            '--replay_file',
+            help='Trace to replay with --backend=replay.')
+    parser.add_argument(
+            '--trace_file',
+            help='Record the sensor samples, commands, jobs and relay transitions '
+                 'to this file (gzipped if it ends with .gz).')
+    parser.add_argument(
+            '--run_for',
+            type=float,
+            help='Stop after given number of seconds (of virtual time for sim).')
+    parser.add_argument(
+            '--metrics_port',
+            type=int,
+            help='Serve Prometheus metrics on this port; disabled if not set.')
+    parser.add_argument(
+            '--metrics_host',
+            default='127.0.0.1',
+            help='Address to serve the metrics on; 0.0.0.0 for the whole network.')
+    parser.add_argument(
+            '--api_port',
+            type=int,
+            help='Serve the local query API on this port; disabled if not set.')
+    parser.add_argument(
+            '--api_host',
+            default='127.0.0.1',
+            help='Address to serve the local query API on; the commands posted to it '
+                 'are not authenticated so only expose it to a trusted network.')
+    parser.add_argument(
+            '--api_socket',
+            help='Serve the local query API on this Unix socket.')
+    parser.add_argument(
+            '--watchdog_threshold',
+            type=float,
+            help='Log the stack of calls blocking the event loop for longer '
+                 'than this many seconds; disabled if not set.')
+    parser.add_argument(
+            '--memory_budget',
+            type=float,
+            help='Log a warning whenever the daemon uses more than this many MB.')
+    parser.add_argument(
+            '--profile',
+            action='store_true',
+            help='Start with profiling enabled; SIGUSR1 toggles it at any time.')
+    parser.add_argument(
+            '--profile_dir',
+            default='autoplant-profile',
+            help='Where to write the profile snapshots.')
+    parser.add_argument(
+            '--profile_interval',
+            type=float,
+            default=600,
+            help='Seconds between the profile snapshots.')
+    parser.add_argument(
+            '--log_level',
+            choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+            default='INFO',
+            help='Log level of all the subsystems.')
+
+    args = parser.parse_args(argv)
+    if args.backend == 'replay' and not args.replay_file:
+        parser.error('--replay_file is required with --backend=replay')
+    if args.acquisition == 'process' and args.backend != 'rpi':
+        parser.error('--acquisition=process is supported only with --backend=rpi')
+    if args.do_mqtt:
+        missing = ['--' + arg for arg in MQTT_REQUIRED_ARGS if not getattr(args, arg)]
+        if missing:
+            parser.error('the following arguments are required with --do_mqtt: {}'.format(
+                ', '.join(missing)))
+    return args
+
+def formatReadings(engine, readings):
+    parts = []
+    for reading in readings:
+        if reading.value is None:
+            parts.append("{}: error".format(reading.quantity))
+        elif isinstance(reading.value, float):
+            parts.append("{}: {:.1f} {}".format(reading.quantity, reading.value, reading.unit))
+        else:
+            value = engine.format(reading)
+            parts.append("{}: {} {}".format(reading.quantity, value, reading.unit).rstrip())
+    return ", ".join(parts)
 
-    return parser.parse_args()
-
-def initDevices():
-    # initialize lcd
-    lcd_columns = 16
-    lcd_rows = 2
-    i2c = busio.I2C(board.SCL, board.SDA)
-    lcd = char_lcd.Character_LCD_I2C_PCF8574(i2c, lcd_columns, lcd_rows, address=0x27)
-
-    # and write a simple message
-    lcd.clear()
-    lcd.backlight = True
-    lcd.message = "initializing..."
-
-    # initialize the pump controlling relay pin
-    pump = digitalio.DigitalInOut(board.D23)
-    pump.direction = digitalio.Direction.OUTPUT
-    # low state is causing NO raly pin to activate
-    # so we need to initialize it with high state first
-    pump.value = True
-
-    # initialize water level sensor
-    level = digitalio.DigitalInOut(board.D4)
-    level.direction = digitalio.Direction.INPUT
-
-    # initialize the lump controlling relay pin
-    lamp = digitalio.DigitalInOut(board.D24)
-    lamp.direction = digitalio.Direction.OUTPUT
-    lamp.value = True
-
-    lcd.clear()
-    lcd.message = "init done"
-
-    # initialize the dht device
-    dhtDevice = adafruit_dht.DHT11(board.D18)
-
-    return {"pump": pump, "lamp": lamp, "display": lcd, "level": level, "dht": dhtDevice}
-
-async def getTempAndHumid(dht):
-    # as the single measurment is not always accurate we do a series
-    # and take the average excluding max and min values
-    temperature = []
-    humidity = []
-    for _ in range(5):
-        try:
-            temperature.append(dht.temperature)
-            humidity.append(dht.humidity)
-        except RuntimeError as error:
-            print(error.args[0])
-        await asyncio.sleep(1)
-    # remove max and min and return average
-    temperature.remove(max(temperature))
-    temperature.remove(min(temperature))
-    humidity.remove(max(humidity))
-    humidity.remove(min(humidity))
-
-    return {"temp": sum(temperature)/len(temperature), "humid": sum(humidity)/len(humidity)}
-
-async def getLevel(level):
-    # read a few times just in case there are some fluctuations
-    data = []
-    for _ in range(5):
-        data.append(level.value)
-        await asyncio.sleep(1)
-    # we have 5 results in the table so need to check if at least 3 are true
-    return sum(data)/3.0 >= 1
-
-async def getAndPublishMeasurements(loop, devices, mqttClient):
-    while True:
-        data = await getTempAndHumid(devices["dht"])
-        level = await getLevel(devices["level"])
+async def showMeasurements(loop, screen, mqttClient, engine, aggregator):
+    # the readings are coming from the polling engine
+    latest = {}
+    pending = []
+    updated = asyncio.Event()
 
-        devices["display"].clear()
-        if level:
-            devices["display"].message = "tank empty"
-        else:
-            devices["display"].message = "Temp: {:.1f} C\nHumidity: {:.1f} %".format(
-                data["temp"], data["humid"])        
-        
-        print("Temp: {:.1f} C\nHumidity: {:.1f} %\nLevel: {}".format(
-            data["temp"], data["humid"], "empty" if level else "full"))
+    def consume(readings):
+        pending.extend(readings)
+        updated.set()
 
-        if mqttClient:
-            loop.call_soon(mqttClient.publish, 'temp', data["temp"])
-            loop.call_soon(mqttClient.publish, 'humid', data["humid"])
-            loop.call_soon(mqttClient.publish, 'level', "empty" if level else "full")
-        
-        
-        # measurements will be taken always every minute
-        await asyncio.sleep(60)
+    engine.addConsumer(consume)
 
+    while True:
+        await updated.wait()
+        updated.clear()
+        readings = pending[:]
+        del pending[:]
+        for reading in readings:
+            latest[reading.quantity] = reading.value
+        screen.update(**{reading.quantity: engine.format(reading) for reading in readings})
+
+        sensorsLog.info("%s", formatReadings(engine, readings))
+
+        # otherwise only the summaries are published by the aggregator
+        if mqttClient and not aggregator.enabled():
+            for reading in readings:
+                if reading.value is not None:
+                    loop.call_soon(mqttClient.publish, reading.quantity, engine.format(reading))
+        if not FIRST_MEASUREMENT.get() and latest.get("temp") is not None:
+            FIRST_MEASUREMENT.set(time.monotonic() - STARTED)
+            logger.info("first measurement after %.3f s", FIRST_MEASUREMENT.get())
 
-async def startPump(pump, level, period=30):
-    endTime = datetime.now() + timedelta(seconds=period)
-    print("will try to start pump for {} seconds".format(period))
-    try:
-        while datetime.now() < endTime:
-            # check the level sensor first
-            if level.value == True:
-                pump.value = True
-                print("water level is too low; can not start pump")
-                return
-
-            pump.value = False
-            # switch the pump on for one second and then
-            # run the loop again to check the level sensor
-            await asyncio.sleep(1)
-    except Exception as e:
-        print("some error occured: {}".format(e))
-    finally:
-        # make sure that the pump is off at the end
-        print("stopping pump...")
-        pump.value = True
 
 async def startLamp(lamp, period=30):
-    print("will try to start lamp for {} seconds".format(period))
+    actuatorsLog.info("will try to start lamp for %s seconds", period)
+    started = clock.monotonic()
     try:
         lamp.value = False
+        RELAY_ON.labels("lamp").set(1)
         # switch the pump on for one second and then
         # run the loop again to check the level sensor
         await asyncio.sleep(period)
     except Exception as e:
-        print("some error occured while starting lamp: {}".format(e))
+        actuatorsLog.error("some error occured while starting lamp: %s", e)
     finally:
         # make sure that the lamp is off at the end
-        print("stopping lamp...")
+        actuatorsLog.info("stopping lamp...")
         lamp.value = True
+        RELAY_ON.labels("lamp").set(0)
+        RELAY_ON_TIME.labels("lamp").inc(clock.monotonic() - started)
+
+
+# the duration is always the last argument of the job
+def jobDuration(attr):
+    return int(attr[-1]) if attr else 10
 
+def withDuration(attr, seconds):
+    return (attr[:-1] if attr else []) + [seconds]
+
+def jobKey(name, attr):
+    # the job without the duration, i.e. the pump of the zone
+    return (name,) + tuple(attr[:-1] if attr else ())
 
 async def doWatering(devices, attr=None):
-    print("do watering {}".format(attr))
-    await startPump(devices["pump"], devices["level"], int(attr[0]) if attr else 10)
+    actuatorsLog.debug("do watering %s", attr)
+    # pump [zone] <seconds>
+    zone = attr[0] if attr and len(attr) > 1 else None
+    # with the closed loop watering the duration is only the upper limit
+    if devices["watering"].enabled():
+        await devices["watering"].water(zone, jobDuration(attr))
+    else:
+        await devices["zones"].water(zone, jobDuration(attr))
 
 async def doLight(devices, attr=None):
-    print("do light: {}".format(attr))
-    await startLamp(devices["lamp"], int(attr[0]) if attr else 10)
+    actuatorsLog.debug("do light: %s", attr)
+    await startLamp(devices["lamp"], jobDuration(attr))
+
+ACTIONS = {
+    "lamp": doLight,
+    "pump": doWatering
+}
 
 def getAction(entry):
-    actions = {
-        "lamp": doLight,
-        "pump": doWatering
-    }
-    action = actions.get(entry)
+    action = ACTIONS.get(entry)
     if action == None:
-        print("invalid job: {}".format(entry))
+        scheduleLog.error("invalid job: %s", entry)
     return action
 
-
-async def updateSchedule(loop, devices, cronFile):
+# runs the job keeping it in the state journal while running
+# so that it can be resumed if the daemon is restarted
+async def runJob(stateJournal, devices, name, attr):
+    action = getAction(name)
+    if action == None:
+        return
+    lease = stateJournal.startLease(name, attr, jobDuration(attr))
+    cancelled = False
+    try:
+        await action(devices, attr)
+    except asyncio.CancelledError:
+        # the daemon is stopping; keep the lease so the job is resumed
+        cancelled = True
+        raise
+    finally:
+        if not cancelled:
+            stateJournal.endLease(lease)
+
+def resumeJobs(loop, devices, stateJournal, settings):
+    running = set()
+    for lease, remaining in stateJournal.pendingLeases():
+        actuatorsLog.info("resuming %s for remaining %d seconds", lease.job, remaining)
+        attr = withDuration(lease.attr, int(remaining))
+        devices["jobs"].spawn(runJob(stateJournal, devices, lease.job, attr), lease.job)
+        running.add(jobKey(lease.job, attr))
+
+    # the jobs which should have been started while the daemon was
+    # not running and are not finished yet
+    since = stateJournal.lastDispatched()
+    if since is None:
+        return
+    now = clock.now()
+    for when, name, attr in schedule.getMissedJobs(
+            settings.current.schedule, datetime.fromtimestamp(since), now):
+        if jobKey(name, attr) in running or name not in ACTIONS:
+            continue
+        remaining = jobDuration(attr) - (now - when).total_seconds()
+        if remaining < 1:
+            continue
+        actuatorsLog.info("starting missed %s job [%s] for remaining %d seconds",
+            name, when, remaining)
+        attr = withDuration(attr, int(remaining))
+        if devices.get("trace"):
+            devices["trace"].onDispatch(name, attr)
+        devices["jobs"].spawn(runJob(stateJournal, devices, name, attr), name)
+        stateJournal.setDispatched(when)
+        running.add(jobKey(name, attr))
+
+async def updateSchedule(loop, devices, settings, stateJournal):
+    nextJobs = schedule.NextJobs()
     while True:
-        jobs = schedule.getNextJobs(cronFile)
-        print(jobs)
+        # always use the most recent schedule; it can be changed
+        # by the server at any time
+        jobs = nextJobs.get(settings.current.schedule)
+        scheduleLog.debug("next jobs: %s", jobs)
 
         # check if we need to execute something now
-        if (jobs[0][0] - datetime.now()).total_seconds() < 60:
-            print("scheduling job")
+        # and make sure those were not already started before the restart
+        dispatched = stateJournal.lastDispatched()
+        if jobs and (jobs[0][0] - clock.now()).total_seconds() < 60 and (
+                dispatched is None or jobs[0][0].timestamp() > dispatched):
+            scheduleLog.debug("scheduling job")
             for job in jobs:
                 # figure out what command to run
-                action = getAction(job[1])
-                if action == None:
+                if getAction(job[1]) == None:
                     continue
-                print("creating task for [{}][{}]".format(job[0], job[1]))
-                loop.create_task(action(devices, job[2]))
+                scheduleLog.info("creating task for [%s][%s]", job[0], job[1])
+                DISPATCH_LATENESS.observe((clock.now() - job[0]).total_seconds())
+                if devices.get("trace"):
+                    devices["trace"].onDispatch(job[1], job[2])
+                devices["jobs"].spawn(runJob(stateJournal, devices, job[1], job[2]), job[1])
+            stateJournal.setDispatched(jobs[0][0])
         
         # update the schedule every minute
         #IMPORTANT: it needs to be one minute else it won't work
         await asyncio.sleep(60)
 
+# the values shown on the display which are not pushed to it
+async def refreshScreen(screen, settings, mqttClient, period=30):
+    nextJobs = schedule.NextJobs()
+    while True:
+        jobs = nextJobs.get(settings.current.schedule)
+        if mqttClient:
+            cloud = "online" if mqttClient.connected else "offline"
+        else:
+            cloud = "off"
+        screen.update(
+            next_job=jobs[0][1] if jobs else None,
+            next_time=jobs[0][0].strftime("%a %H:%M") if jobs else None,
+            cloud=cloud,
+            address=dashboard.localAddress())
+        await asyncio.sleep(period)
+
 # helper task to only await (break the waiting loop) so that all the tasks 
 # created in 'handleMqtt()' can be executed
 async def ticker():
     while True:
         await asyncio.sleep(1)
 
-# let's use the clousure here to access devices and loop
-def handleMqtt(devices, loop):
+def reportDelivery(what):
+    # the server doesn't ask again so at least log what it never got
+    def done(future):
+        delivery = future.result()
+        if delivery.acked:
+            logger.debug("%s %s delivered in %.3f s", what, delivery.payload, delivery.latency)
+        else:
+            logger.warning("%s %s not delivered: %s", what, delivery.payload, delivery.status)
 
-    def handler(data):
-        print("got MQTT data: {}".format(data))
+    return done
 
+# commands are received on the MQTT thread so those are queued on the loop;
+# the answer is published back
+def handleMqtt(devices, loop, commandQueue, mqttClient):
+
+    def submit(data):
+        if devices.get("trace"):
+            devices["trace"].onCommand(data)
         # the command is passed in the payload of the message. In this example,
         # the server sends a serialized JSON string.
         try:
             cmd = json.loads(data)
-            if cmd["command"] == "pump_on":
-                loop.create_task(doWatering(devices, [cmd["duration"]]))
-            elif cmd["command"] == "lamp_on":
-                loop.create_task(doLight(devices, [cmd["duration"]]))
-            else:
-                print("unknown command from server: {}".format(cmd))
-        except Exception as e:
-            print("error occured while processing server data: {}".format(e))
+        except ValueError as e:
+            logger.error("error occured while processing server data: %s", e)
+            cmd = None
+        answer = commandQueue.submit(cmd)
+        if mqttClient:
+            mqttClient.publish("command", answer).add_done_callback(
+                reportDelivery("command answer"))
+
+    def handler(data):
+        logger.info("got MQTT data: %s", data)
+        loop.call_soon_threadsafe(submit, data)
+
+    return handler
+
+# configuration is received on the MQTT thread so we need to apply it
+# on the loop; the result is reported back using the state topic
+def handleConfig(settings, loop, mqttClient, recorder=None):
+
+    def apply(data):
+        if recorder:
+            recorder.onConfig(data)
+        state = settings.apply(data)
+        if mqttClient:
+            mqttClient.publish_state(state).add_done_callback(
+                reportDelivery("configuration state"))
+
+    def handler(data):
+        logger.info("got MQTT config: %s", data)
+        loop.call_soon_threadsafe(apply, data)
 
     return handler
 
 def run(args):
-    devices = initDevices()
+    backend = hal.getBackend(args.backend,
+        **({"trace": args.replay_file} if args.backend == "replay" else {}))
+    if args.acquisition == 'process':
+        # the DHT is read by the acquisition process
+        devices = backend.initDevices(dht=False)
+    else:
+        devices = backend.initDevices()
+    settings = config.ConfigManager(args.config_file, args.schedule_file, ACTIONS)
+    # per subsystem log levels can be changed by the server
+    log.setLevels(settings.current.logLevels)
+    settings.addListener(lambda new: log.setLevels(new.logLevels))
+    stateJournal = journal.StateJournal(args.state_file)
     
     # run the mian loop
-    loop = asyncio.get_event_loop()
+    loop = backend.createEventLoop()
+    asyncio.set_event_loop(loop)
+    recorder = None
+    if args.trace_file:
+        recorder = tracing.TraceRecorder(args.trace_file, settings.current.toDict())
+    devices["trace"] = recorder
+    # recent readings and relay transitions for the local queries
+    recent = history.History()
+    relayListeners = [recent.onRelay] + ([recorder.onRelay] if recorder else [])
+
+    def observe(name, relay):
+        relay = hal.ObservedRelay(name, relay)
+        relay.listeners.extend(relayListeners)
+        return relay
+
+    for name in ("pump", "lamp"):
+        devices[name] = observe(name, devices[name])
+
+    def createRelay(pin):
+        return observe(pin, backend.createRelay(pin))
+
+    # all the jobs are started through the registry
+    devices["jobs"] = tasks.TaskRegistry(loop)
+    # shared by the pump and measurement tasks
+    levelMonitor = levelsensor.LevelMonitor(loop, devices["level"])
+    levelMonitor.start()
+    devices["levelMonitor"] = levelMonitor
+    # all the watering goes through the dispatcher keeping the power budget
+    dispatcher = zones.ZoneDispatcher(loop, devices["pump"], levelMonitor, createRelay)
+    dispatcher.configure(settings.current.zones, settings.current.power)
+    settings.addListener(lambda new: dispatcher.configure(new.zones, new.power))
+    devices["zones"] = dispatcher
+    controller = watering.MoistureController(dispatcher, devices.get("soil"))
+    controller.configure(settings.current.watering)
+    settings.addListener(lambda new: controller.configure(new.watering))
+    devices["watering"] = controller
+    # all the sensors are read by the polling engine
+    engine = sensors.PollingEngine(loop)
+    acquisitionProcess = None
+    if args.acquisition == 'process':
+        acquisitionProcess = acquisition.AcquisitionProcess(
+            loop, args.backend, engine, args.log_level)
+
+    def configureSensors(current):
+        if acquisitionProcess:
+            local = acquisitionProcess.configure(current.sensors, current.sampling)
+            engine.configure(sensors.createSensors(local, current.sampling, devices),
+                             acquisitionProcess.sensors)
+        else:
+            engine.configure(sensors.createSensors(current.sensors, current.sampling, devices))
+
+    configureSensors(settings.current)
+    # the display shares the I2C bus with the sensors
+    screen = dashboard.Dashboard(loop, devices["display"], lock=engine.busLock("i2c"))
+    screen.update(pump="off", lamp="off")
+    for name in ("pump", "lamp"):
+        devices[name].addListener(screen.onRelay)
+    if devices.get("button"):
+        screen.attachButton(devices["button"])
+    settings.addListener(configureSensors)
+    # refresh as soon as the tank gets empty or refilled
+    levelMonitor.addListener(lambda _: engine.trigger("level"))
+    if recorder:
+        recorder.onLevel(levelMonitor.empty)
+        levelMonitor.addListener(recorder.onLevel)
+        engine.addSampleListener(recorder.onSample)
+    # the remote commands go through the queue
+    commandQueue = commands.CommandQueue(
+        loop, lambda name, attr: devices["jobs"].spawn(
+            runJob(stateJournal, devices, name, attr), name))
+    commandQueue.configure(settings.current.commands, settings.current.zones)
+    settings.addListener(lambda new: commandQueue.configure(new.commands, new.zones))
     mqttClient = None
+    loopWatchdog = None
+    loopProfiler = profiler.Profiler(loop, args.profile_dir, args.profile_interval)
 
     if args.do_mqtt:
-        mqttClient = mqtt.Mqtt(vars(args))
-        mqttClient.register_cb(handleMqtt(devices, loop))
+        import mqtt
+        mqttClient = mqtt.Mqtt(vars(args), loop)
+        mqttClient.register_cb(handleMqtt(devices, loop, commandQueue, mqttClient))
+        mqttClient.register_config_cb(handleConfig(settings, loop, mqttClient, recorder))
+
+    def publish(key, value):
+        if mqttClient:
+            loop.call_soon(mqttClient.publish, key, value)
+
+    aggregator = aggregation.Aggregator(loop, publish)
+    aggregator.configure(settings.current.aggregation)
+    settings.addListener(lambda new: aggregator.configure(new.aggregation))
+    engine.addConsumer(aggregator.consume)
+    engine.addConsumer(recent.consume)
 
     try:
-        loop.create_task(getAndPublishMeasurements(loop, devices, mqttClient))
-        loop.create_task(updateSchedule(loop, devices, args.schedule_file))
+        # resume first so that the jobs continue as soon as possible
+        resumeJobs(loop, devices, stateJournal, settings)
+        loop.create_task(showMeasurements(loop, screen, mqttClient, engine, aggregator))
+        loop.create_task(screen.run())
+        loop.create_task(refreshScreen(screen, settings, mqttClient))
+        if mqttClient:
+            loop.create_task(mqttClient.run())
+        loop.create_task(engine.run())
+        if acquisitionProcess:
+            acquisitionProcess.start()
+            loop.create_task(acquisitionProcess.run())
+        loop.create_task(updateSchedule(loop, devices, settings, stateJournal))
+        loop.create_task(commandQueue.run())
+        if args.memory_budget:
+            loop.create_task(memory.MemoryMonitor(args.memory_budget * 2**20).run())
         if args.do_mqtt:
             loop.create_task(ticker())
+        if args.metrics_port:
+            TASKS.setFunction(lambda: len(asyncio.all_tasks(loop)))
+            LOG_QUEUE.setFunction(log.queueDepth)
+            LOG_DROPPED.setFunction(log.dropped)
+            loop.run_until_complete(webserver.start(
+                metrics.routes(), args.metrics_host, args.metrics_port))
+        if args.api_port or args.api_socket:
+
+            def localCommand(cmd):
+                if recorder:
+                    recorder.onCommand(json.dumps(cmd))
+                return commandQueue.submit(cmd)
+
+            routes = api.routes(recent, settings, localCommand)
+            if args.api_port:
+                loop.run_until_complete(webserver.start(
+                    routes, args.api_host, args.api_port, limit=64))
+            if args.api_socket:
+                loop.run_until_complete(webserver.start(
+                    routes, path=args.api_socket, limit=64))
+        if args.watchdog_threshold:
+            loopWatchdog = watchdog.LoopWatchdog(loop, args.watchdog_threshold)
+            loopWatchdog.start()
+        # i.e. the replayed commands
+        backend.attach(loop, handleMqtt(devices, loop, commandQueue, mqttClient),
+                       handleConfig(settings, loop, mqttClient, recorder))
+        if args.run_for:
+            loop.call_later(args.run_for, loop.stop)
+        if args.profile:
+            loopProfiler.enable()
+        # systemd is stopping the service with SIGTERM
+        loop.add_signal_handler(signal.SIGTERM, loop.stop)
+        loop.add_signal_handler(signal.SIGUSR1, loopProfiler.toggle)
         loop.run_forever()
     except KeyboardInterrupt:
         pass
     finally:
-        #TODO: make sure to stop everything
+        if loopWatchdog:
+            loopWatchdog.stop()
+        loopProfiler.disable()
+        levelMonitor.stop()
+        if acquisitionProcess:
+            acquisitionProcess.close()
+        aggregator.flush()
+        # cancel all the tasks so that the relays are switched off;
+        # the running jobs are kept in the journal to be resumed
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
         loop.close()
-        mqtt.deinit()
+        backend.close()
+        if recorder:
+            recorder.close()
+        if mqttClient:
+            mqttClient.deinit()
+        log.shutdown()
 
 if __name__ == "__main__":
     args = parse_command_line_args()
+    log.setup(args.log_level)
     run(args)
 
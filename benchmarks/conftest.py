@@ -0,0 +1,195 @@
+"""Benchmarks of the daemon's hot paths running on fake hardware.
+
+The hardware modules (board, busio, digitalio, adafruit_dht, ...) are
+replaced by the stubs in benchmarks/stubs so the suite runs on any Linux
+box:
+
+    python3 -m pytest benchmarks -q
+
+The results are stored in benchmarks/results/<commit>.json (see
+--bench-save) and can be compared with the results of another commit:
+
+    python3 -m pytest benchmarks -q --bench-compare=benchmarks/results/1a2b3c4.json
+
+With --bench-max-regression=0.2 the run fails if any benchmark got more
+than 20 % slower or does more bus transactions than before.
+"""
+
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+sys.path.insert(0, os.path.join(HERE, "stubs"))
+sys.path.insert(0, ROOT)
+
+def pytest_addoption(parser):
+    group = parser.getgroup("bench", "benchmarks")
+    group.addoption("--bench-rounds", type=int, default=7,
+        help="Rounds of each benchmark; the median is reported.")
+    group.addoption("--bench-save", default=os.path.join(HERE, "results"),
+        help="Directory to store the results in; empty to not store.")
+    group.addoption("--bench-compare",
+        help="Results file to compare with.")
+    group.addoption("--bench-max-regression", type=float,
+        help="Fail if the median time got worse by more than this fraction.")
+    group.addoption("--soak", action="store_true",
+        help="Run also the soak test (takes minutes).")
+    group.addoption("--soak-days", type=int, default=90,
+        help="Days of the virtual time the soak test runs for.")
+
+def commitId():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("-dirty" if dirty else "")
+
+class Bench(object):
+    """Times the given function; each round calls it as many times as
+    needed to run for at least `minTime` seconds."""
+
+    def __init__(self, rounds, minTime=0.005):
+        self.rounds = rounds
+        self.minTime = minTime
+        self.stats = None
+        # counts of the bus transactions and alike; compared as well
+        self.extra = {}
+
+    def __call__(self, fn, *args, **kwargs):
+        started = time.perf_counter()
+        result = fn(*args, **kwargs)
+        once = time.perf_counter() - started
+        iterations = max(1, min(100000, int(self.minTime / max(once, 1e-9))))
+
+        times = []
+        for _ in range(self.rounds):
+            started = time.perf_counter()
+            for _ in range(iterations):
+                result = fn(*args, **kwargs)
+            times.append((time.perf_counter() - started) / iterations)
+        self.stats = {
+            "min": min(times),
+            "median": statistics.median(times),
+            "mean": statistics.mean(times),
+            "rounds": self.rounds,
+            "iterations": iterations,
+        }
+        return result
+
+@pytest.fixture
+def bench(request):
+    b = Bench(request.config.getoption("bench_rounds"))
+    yield b
+    if b.stats is not None:
+        name = "{}::{}".format(os.path.basename(request.node.fspath), request.node.name)
+        request.config._benchResults[name] = dict(b.stats, extra=b.extra)
+
+class SleepRecorder(object):
+    """Replaces the `time` module of the drivers so that the delays are
+    only summed up instead of slept."""
+
+    def __init__(self):
+        self.slept = 0.0
+
+    def sleep(self, seconds):
+        self.slept += seconds
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+@pytest.fixture
+def fakeSleep(monkeypatch):
+    import character_lcd_pcf8574
+    import pcf8574
+    recorder = SleepRecorder()
+    monkeypatch.setattr(character_lcd_pcf8574, "time", recorder)
+    monkeypatch.setattr(pcf8574, "time", recorder)
+    return recorder
+
+def pytest_configure(config):
+    config._benchResults = {}
+
+def loadResults(path):
+    with open(path) as f:
+        return json.load(f)
+
+def regressions(config, previous):
+    limit = config.getoption("bench_max_regression")
+    found = []
+    for name, stats in config._benchResults.items():
+        old = previous["benchmarks"].get(name)
+        if old is None:
+            continue
+        if limit is not None and stats["median"] > old["median"] * (1 + limit):
+            found.append(name)
+        for key, value in stats["extra"].items():
+            if isinstance(value, int) and value > old["extra"].get(key, value):
+                found.append("{} ({})".format(name, key))
+    return found
+
+def pytest_terminal_summary(terminalreporter, config):
+    results = config._benchResults
+    if not results:
+        return
+    compare = config.getoption("bench_compare")
+    previous = loadResults(compare)["benchmarks"] if compare else {}
+
+    terminalreporter.section("benchmarks")
+    for name in sorted(results):
+        stats = results[name]
+        line = "{:<60} {:>10.1f} us".format(name, stats["median"] * 1e6)
+        old = previous.get(name)
+        if old:
+            line += " {:>+7.1f} %".format((stats["median"] / old["median"] - 1) * 100)
+        terminalreporter.write_line(line)
+        for key, value in sorted(stats["extra"].items()):
+            line = "    {:<56} {:>10}".format(key, value)
+            if old and key in old["extra"] and old["extra"][key] != value:
+                line += " (was {})".format(old["extra"][key])
+            terminalreporter.write_line(line)
+
+def pytest_sessionfinish(session, exitstatus):
+    config = session.config
+    results = config._benchResults
+    if not results:
+        return
+    compare = config.getoption("bench_compare")
+    if compare:
+        found = regressions(config, loadResults(compare))
+        if found:
+            sys.stderr.write("regressions: {}\n".format(", ".join(found)))
+            session.exitstatus = 1
+
+    directory = config.getoption("bench_save")
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    commit = commitId()
+    data = {
+        "commit": commit,
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "machine": platform.machine(),
+        "benchmarks": results,
+    }
+    path = os.path.join(directory, commit + ".json")
+    # keep the results of the benchmarks not run this time
+    if os.path.exists(path):
+        data["benchmarks"] = dict(loadResults(path)["benchmarks"], **results)
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
@@ -0,0 +1,92 @@
+"""Startup benchmark of the daemon.
+
+Measures, each in a fresh interpreter, how long it takes to import the
+daemon, which slow modules are imported in the standalone mode and how
+long it takes from the start until the first measurement is done (using
+the simulated backend so it can run anywhere):
+
+    python3 benchmarks/startup.py --runs=5 --output=startup.json
+
+Run it on the Pi to get the real numbers; the output can be stored and
+compared between the builds.
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# these should only be imported once MQTT is enabled
+CLOUD_MODULES = ('jwt', 'paho', 'cryptography')
+
+def importTime():
+    # cumulative import time (in seconds) of autoplant reported by -X importtime
+    out = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import autoplant'],
+        cwd=ROOT, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL,
+        universal_newlines=True, check=True).stderr
+    for line in out.splitlines():
+        fields = [f.strip() for f in line.split('|')]
+        if len(fields) == 3 and fields[2] == 'autoplant':
+            return int(fields[1]) / 1e6
+    raise RuntimeError('autoplant not found in the import time report')
+
+def cloudModules():
+    code = 'import sys, autoplant; print(" ".join(sorted(sys.modules)))'
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT,
+        stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+    modules = out.split()
+    return sorted(m for m in modules if m.split('.')[0] in CLOUD_MODULES)
+
+def firstMeasurement(cronFile):
+    # the whole process is timed as well so that the interpreter start
+    # is included
+    started = time.monotonic()
+    out = subprocess.run(
+        [sys.executable, 'autoplant.py', '--backend=sim', '--run_for=30',
+         '--schedule_file=' + cronFile, '--config_file='],
+        cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        universal_newlines=True, check=True).stdout
+    total = time.monotonic() - started
+    match = re.search(r'first measurement after ([0-9.]+) s', out)
+    if not match:
+        raise RuntimeError('first measurement not reported:\n' + out)
+    return float(match.group(1)), total
+
+def summary(values):
+    return {"min": min(values), "median": statistics.median(values), "max": max(values)}
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup benchmark.')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', help='Store the results in the JSON file.')
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile('w', suffix='.cron') as cron:
+        cron.write('0 8 * * * pump 30\n')
+        cron.flush()
+
+        imports = [importTime() for _ in range(args.runs)]
+        runs = [firstMeasurement(cron.name) for _ in range(args.runs)]
+
+    results = {
+        "python": sys.version.split()[0],
+        "import_seconds": summary(imports),
+        "first_measurement_seconds": summary([r[0] for r in runs]),
+        "process_seconds": summary([r[1] for r in runs]),
+        "cloud_modules_in_standalone": cloudModules(),
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""Fake I2CDevice counting the bus traffic."""
+
+class I2CDevice(object):
+
+    def __init__(self, i2c, device_address, probe=True):
+        self.i2c = i2c
+        self.device_address = device_address
+        self.reset()
+
+    def reset(self):
+        self.transactions = 0
+        self.writes = 0
+        self.bytesWritten = 0
+        self.bytesRead = 0
+
+    def __enter__(self):
+        while not self.i2c.try_lock():
+            pass
+        self.transactions += 1
+        return self
+
+    def __exit__(self, *exc):
+        self.i2c.unlock()
+        return False
+
+    def write(self, buf, *, start=0, end=None):
+        end = len(buf) if end is None else end
+        self.writes += 1
+        self.bytesWritten += end - start
+
+    def readinto(self, buf, *, start=0, end=None):
+        end = len(buf) if end is None else end
+        for i in range(start, end):
+            buf[i] = 0
+        self.bytesRead += end - start
+
+    def write_then_readinto(self, out_buffer, in_buffer, *, out_start=0, out_end=None,
+                            in_start=0, in_end=None):
+        self.write(out_buffer, start=out_start, end=out_end)
+        self.readinto(in_buffer, start=in_start, end=in_end)
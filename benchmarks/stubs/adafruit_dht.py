@@ -0,0 +1,25 @@
+"""Fake DHT sensors returning repeatable readings."""
+
+class DHTBase(object):
+
+    def __init__(self, pin, use_pulseio=True):
+        self.pin = pin
+        self.reads = 0
+
+    @property
+    def temperature(self):
+        self.reads += 1
+        return 21 + self.reads % 3
+
+    @property
+    def humidity(self):
+        return 48 + self.reads % 5
+
+    def exit(self):
+        pass
+
+class DHT11(DHTBase):
+    pass
+
+class DHT22(DHTBase):
+    pass
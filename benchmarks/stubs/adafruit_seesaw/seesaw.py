@@ -0,0 +1,17 @@
+"""Fake STEMMA soil sensor doing the same bus transactions as the real one."""
+
+from adafruit_bus_device.i2c_device import I2CDevice
+
+class Seesaw(object):
+
+    def __init__(self, i2c_bus, addr=0x49):
+        self.i2c_device = I2CDevice(i2c_bus, addr)
+        self.moisture = 500
+
+    def moisture_read(self):
+        buf = bytearray(2)
+        with self.i2c_device as i2c:
+            # touch channel 0 register, then the reading
+            i2c.write(bytes((0x0F, 0x10)))
+            i2c.readinto(buf)
+        return self.moisture
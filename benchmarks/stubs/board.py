@@ -0,0 +1,15 @@
+"""Fake `board` pin definitions."""
+
+class Pin(object):
+
+    def __init__(self, id):
+        self.id = id
+
+    def __repr__(self):
+        return "board.D{}".format(self.id)
+
+for _id in range(28):
+    globals()["D{}".format(_id)] = Pin(_id)
+
+SDA = D2
+SCL = D3
@@ -0,0 +1,20 @@
+"""Fake `digitalio` pins keeping the last written value."""
+
+class Direction(object):
+    INPUT = "input"
+    OUTPUT = "output"
+
+class Pull(object):
+    UP = "up"
+    DOWN = "down"
+
+class DigitalInOut(object):
+
+    def __init__(self, pin):
+        self.pin = pin
+        self.direction = Direction.INPUT
+        self.pull = None
+        self.value = False
+
+    def deinit(self):
+        pass
@@ -0,0 +1,4 @@
+"""Fake `micropython` module."""
+
+def const(value):
+    return value
@@ -0,0 +1,76 @@
+"""The LCD driver; each character is two PCF8574 transactions."""
+
+import pytest
+
+import board
+import busio
+
+MESSAGE = "Temp: 22.5 C\nHumidity: 50.1 %"
+
+@pytest.fixture
+def i2c():
+    return busio.I2C(board.SCL, board.SDA)
+
+@pytest.fixture
+def lcd(i2c, fakeSleep):
+    import character_lcd_pcf8574 as char_lcd
+    return char_lcd.Character_LCD_I2C_PCF8574(i2c, 16, 2, address=0x27)
+
+def test_lcd_message(bench, lcd, fakeSleep):
+    device = lcd.interface.i2c_device
+    device.reset()
+    fakeSleep.slept = 0.0
+    lcd.message = MESSAGE
+    bench.extra.update({
+        "characters": len(MESSAGE) - 1,
+        "bytes": device.bytesWritten,
+        "transactions": device.transactions,
+        # the delays of the driver; not included in the measured time
+        "sleep_us": int(fakeSleep.slept * 1e6),
+    })
+    bench(setattr, lcd, "message", MESSAGE)
+
+def test_lcd_clear(bench, lcd, fakeSleep):
+    device = lcd.interface.i2c_device
+    device.reset()
+    lcd.clear()
+    bench.extra.update({"bytes": device.bytesWritten, "transactions": device.transactions})
+    bench(lcd.clear)
+
+def test_pcf8574_send(bench, i2c, fakeSleep):
+    from pcf8574 import PCF8574
+    pcf = PCF8574(i2c, 0x27)
+    device = pcf.i2c_device
+    pcf.send(0x41, 0x01)
+    bench.extra.update({
+        "bytes": device.bytesWritten,
+        "writes": device.writes,
+        "transactions": device.transactions,
+    })
+    bench(pcf.send, 0x41, 0x01)
+
+def test_dashboard_rotation(bench, lcd, fakeSleep):
+    import dashboard
+    import simulation
+    # only the characters differing between the pages are written
+    loop = simulation.VirtualTimeEventLoop(simulation.VirtualClock())
+    screen = dashboard.Dashboard(loop, lcd)
+    screen.update(temp=22.5, humid=50.1, soil=512, level="full", pump="off", lamp="off",
+                  next_job="pump", next_time="Mon 08:00", cloud="online", address="192.168.1.20")
+    screen.draw()
+    device = lcd.interface.i2c_device
+    device.reset()
+
+    def rotate():
+        screen.next()
+        screen.draw()
+
+    for _ in screen.pages:
+        rotate()
+    bench.extra.update({
+        "pages": len(screen.pages),
+        "bytes_per_page": device.bytesWritten // len(screen.pages),
+        "transactions_per_page": device.transactions // len(screen.pages),
+    })
+    bench(rotate)
+    loop.close()
@@ -0,0 +1,44 @@
+"""Whole measurement cycle on the Raspberry Pi backend with fake hardware:
+reading all the sensors and redrawing the LCD page."""
+
+import pytest
+
+import config
+import dashboard
+import hal
+import levelsensor
+import sensors
+import simulation
+
+@pytest.fixture
+def setup(fakeSleep):
+    devices = hal.getBackend("rpi").initDevices()
+    virtualClock = simulation.VirtualClock()
+    # the sleeps between the samples are not measured
+    loop = simulation.VirtualTimeEventLoop(virtualClock)
+    devices["levelMonitor"] = levelsensor.LevelMonitor(loop, devices["level"])
+    engine = sensors.PollingEngine(loop)
+    engine.configure(sensors.createSensors({}, config.DEFAULT_SAMPLING, devices))
+    yield loop, engine, devices
+    loop.close()
+
+def test_measurement_cycle(bench, setup):
+    loop, engine, devices = setup
+    bus = devices["display"].interface.i2c_device
+    screen = dashboard.Dashboard(loop, devices["display"])
+
+    def cycle():
+        readings = loop.run_until_complete(engine.poll(list(engine.sensors.values())))
+        screen.update(**{r.quantity: r.value for r in readings})
+        screen.draw()
+        return readings
+
+    bus.reset()
+    readings = cycle()
+    assert {r.quantity for r in readings} == {"temp", "humid", "soil", "level"}
+    bench.extra.update({
+        "lcd_bytes": bus.bytesWritten,
+        "lcd_transactions": bus.transactions,
+        "soil_transactions": devices["soil"].i2c_device.transactions,
+    })
+    bench(cycle)
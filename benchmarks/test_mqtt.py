@@ -0,0 +1,69 @@
+"""Publishing of the measurements to the MQTT bridge."""
+
+import pytest
+
+class FakeInfo(object):
+
+    def __init__(self, mid):
+        self.mid = mid
+        self.rc = 0
+
+class FakeClient(object):
+    """paho client acknowledging each message with the next publish."""
+
+    def __init__(self, client_id=None):
+        self.mid = 0
+        self.payloadBytes = 0
+
+    def username_pw_set(self, username, password=None):
+        pass
+
+    def tls_set(self, **kwargs):
+        pass
+
+    def connect(self, host, port):
+        self.on_connect(self, None, None, 0)
+
+    def max_queued_messages_set(self, queue_size):
+        pass
+
+    def max_inflight_messages_set(self, inflight):
+        pass
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def subscribe(self, topic, qos=0):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def publish(self, topic, payload, qos=0):
+        if self.mid:
+            self.on_publish(self, None, self.mid)
+        self.mid += 1
+        self.payloadBytes += len(payload)
+        return FakeInfo(self.mid)
+
+@pytest.fixture
+def client(monkeypatch):
+    mqtt = pytest.importorskip("mqtt")
+    monkeypatch.setattr(mqtt.mqtt, "Client", FakeClient)
+    monkeypatch.setattr(mqtt, "create_jwt", lambda *args: "token")
+    config = {
+        "device_id": "bench", "project_id": "p", "registry_id": "r",
+        "cloud_region": "us-central1", "private_key_file": None, "algorithm": "RS256",
+        "ca_certs": None, "mqtt_bridge_hostname": "localhost", "mqtt_bridge_port": 8883,
+    }
+    return mqtt.Mqtt(config)
+
+def test_mqtt_publish(bench, client):
+    bench(client.publish, "temp", 22.5)
+    bench.extra["pending"] = len(client.pending)
+
+def test_mqtt_publish_state(bench, client):
+    bench(client.publish_state, {"config_version": 3, "status": "applied"})
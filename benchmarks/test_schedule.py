@@ -0,0 +1,28 @@
+"""Parsing of the schedule; done every minute by the scheduler task."""
+
+from datetime import datetime
+
+import pytest
+
+import schedule
+
+BASE = datetime(2020, 3, 1, 7, 59, 30)
+
+def cronLines(count):
+    lines = ["# watering and lighting"]
+    for i in range(count):
+        lines.append("{} {} * * * {} {}".format(i % 60, i % 24, "pump" if i % 2 else "lamp", 30 + i))
+    return lines
+
+@pytest.mark.parametrize("entries", [2, 20, 200])
+def test_readCron(bench, tmp_path, entries):
+    cronFile = tmp_path / "cron"
+    cronFile.write_text("\n".join(cronLines(entries)) + "\n")
+    jobs = bench(schedule.readCron, str(cronFile), BASE)
+    assert len(jobs) == entries
+
+@pytest.mark.parametrize("entries", [2, 20, 200])
+def test_getNextJobs(bench, entries):
+    lines = cronLines(entries)
+    jobs = bench(schedule.getNextJobs, lines, BASE)
+    assert jobs
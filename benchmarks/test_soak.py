@@ -0,0 +1,73 @@
+"""Soak test: the daemon running on the simulated hardware for 90 days of
+virtual time has to keep its memory flat. It takes a few minutes so it is
+only run with --soak:
+
+    python3 -m pytest benchmarks -q --soak
+"""
+
+import gc
+import json
+import os
+
+import pytest
+
+import autoplant
+import hal
+import log
+import memory
+import simulation
+
+DAY = 86400
+# the history, windows and caches are filled by then
+WARMUP = 7
+MAX_GROWTH = 2 * 2**20
+
+SCHEDULE = """\
+0 8 * * * pump 30
+0 20 * * * pump 30
+0 9 * * * lamp 28800
+"""
+
+class SoakBackend(simulation.SimulatedBackend):
+    """Samples the RSS and sends a few commands every day."""
+
+    def __init__(self):
+        super().__init__()
+        self.samples = []
+
+    def attach(self, loop, commandHandler, configHandler=None):
+
+        def daily():
+            gc.collect()
+            self.samples.append(memory.rss())
+            for duration in (60, 60, 120):
+                commandHandler(json.dumps({"command": "lamp_on", "duration": duration}))
+            commandHandler("not a command")
+            loop.call_later(DAY, daily)
+
+        loop.call_later(DAY, daily)
+
+def test_soak_rss(request, tmp_path, monkeypatch):
+    if not request.config.getoption("--soak"):
+        pytest.skip("run with --soak")
+    if memory.rss() is None:
+        pytest.skip("RSS is not known on this system")
+    days = request.config.getoption("--soak-days")
+    backend = SoakBackend()
+    monkeypatch.setattr(hal, "getBackend", lambda name, **kwargs: backend)
+    cron = tmp_path / "cron"
+    cron.write_text(SCHEDULE)
+
+    with open(os.devnull, "w") as devnull:
+        log.setup("WARNING", stream=devnull)
+        autoplant.run(autoplant.parse_command_line_args([
+            "--backend=sim", "--run_for={}".format(days * DAY),
+            "--schedule_file=" + str(cron), "--config_file=",
+            "--state_file=" + str(tmp_path / "state.json")]))
+
+    samples = backend.samples[WARMUP:]
+    assert len(samples) >= days - WARMUP - 1
+    growth = max(samples) - samples[0]
+    print("RSS {:.1f} MB after warmup, grew by {:.0f} kB".format(
+        samples[0] / 2**20, growth / 1024))
+    assert growth < MAX_GROWTH
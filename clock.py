@@ -0,0 +1,44 @@
+"""Time source of the daemon.
+
+Everything that needs the current time should ask this module instead of
+calling `datetime.now()` directly so that the daemon can be run on the
+virtual clock of the simulated backend.
+"""
+
+import time
+from datetime import datetime
+
+class WallClock(object):
+    """Real time clock; the default one."""
+
+    def now(self):
+        return datetime.now()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def bootId(self):
+        # monotonic time can only be compared within the same boot
+        try:
+            with open("/proc/sys/kernel/random/boot_id") as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+_clock = WallClock()
+
+def install(clock):
+    global _clock
+    _clock = clock
+
+def get():
+    return _clock
+
+def now():
+    return _clock.now()
+
+def monotonic():
+    return _clock.monotonic()
+
+def bootId():
+    return _clock.bootId()
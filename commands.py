@@ -0,0 +1,189 @@
+"""Queue of the remote commands.
+
+The commands received over MQTT or posted to the local API are not run
+straight away but go through a single bounded queue, so a flood of them
+(i.e. from a retrying cloud function) can't pile up the jobs nor keep
+toggling the relays:
+
+    - a command with an "id" which was already seen is not run again
+    - the same command (job and zone) arriving within `coalesce` seconds
+      after the previous one is merged into it, the longer duration wins
+    - each actuator has a token bucket of `burst` commands getting one
+      token back every `refill` seconds; without a token it is rejected
+    - once `queue` commands are waiting the new ones are rejected
+    - the duration has to be positive and is capped at `max_pump` or
+      `max_lamp` seconds
+
+Each command is answered with its status: accepted, coalesced, duplicate
+or rejected with the reason (invalid, rate_limited or queue_full). The
+limits can be changed in the "commands" section of the configuration,
+i.e. `"commands": {"burst": 2, "refill": 300}`.
+"""
+
+import asyncio
+import collections
+
+import log
+import metrics
+
+logger = log.getLogger("commands")
+
+COMMANDS = metrics.counter("commands_total", "Received commands.", ("status",))
+QUEUE_DEPTH = metrics.gauge("command_queue_depth", "Commands waiting to be started.")
+
+DEFAULT_COMMANDS = {
+    "queue": 16,
+    "coalesce": 1.0,
+    "burst": 3,
+    "refill": 60,
+    "max_pump": 300,
+    "max_lamp": 43200,
+}
+
+ACCEPTED = "accepted"
+COALESCED = "coalesced"
+DUPLICATE = "duplicate"
+REJECTED = "rejected"
+
+# number of the command ids remembered
+IDS = 256
+
+def parseDuration(cmd, limit):
+    duration = int(cmd["duration"])
+    if duration <= 0:
+        raise ValueError("invalid duration: {}".format(cmd["duration"]))
+    if duration > limit:
+        logger.warning("duration %s capped at %s seconds", duration, limit)
+        return int(limit)
+    return duration
+
+def parseCommand(cmd, zones=(), limits=DEFAULT_COMMANDS):
+    """Return the job and its attributes; raises KeyError, TypeError or
+    ValueError if the command is not valid."""
+    if cmd["command"] == "pump_on":
+        duration = parseDuration(cmd, limits["max_pump"])
+        if not cmd.get("zone"):
+            return "pump", [duration]
+        if cmd["zone"] not in zones:
+            raise ValueError("unknown zone: {}".format(cmd["zone"]))
+        return "pump", [cmd["zone"], duration]
+    if cmd["command"] == "lamp_on":
+        return "lamp", [parseDuration(cmd, limits["max_lamp"])]
+    raise ValueError("unknown command: {}".format(cmd["command"]))
+
+class TokenBucket(object):
+
+    __slots__ = ("burst", "refill", "tokens", "updated")
+
+    def __init__(self, burst, refill, now):
+        self.burst = burst
+        self.refill = refill
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) / self.refill)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+class CommandQueue(object):
+    """
+    :param start: function starting the job, called with its name and
+                  attributes
+    """
+
+    def __init__(self, loop, start):
+        self.loop = loop
+        self.start = start
+        self.config = dict(DEFAULT_COMMANDS)
+        self.zones = ()
+        self.queue = collections.deque()
+        self.ready = asyncio.Event()
+        # actuator -> [time, job name, attributes] of the last accepted command
+        self.last = {}
+        self.buckets = {}
+        # command id -> status
+        self.ids = collections.OrderedDict()
+
+    def configure(self, config, zones=()):
+        config = dict(DEFAULT_COMMANDS, **config)
+        # only with the new limits; otherwise any configuration
+        # push would refill the buckets
+        if (config["burst"], config["refill"]) != (self.config["burst"], self.config["refill"]):
+            self.buckets.clear()
+        self.config = config
+        self.zones = tuple(zones)
+
+    def _answer(self, cmd, status, reason=None):
+        COMMANDS.labels(status).inc()
+        response = {"status": status}
+        if isinstance(cmd, dict) and "id" in cmd:
+            response["id"] = cmd["id"]
+        if reason:
+            response["reason"] = reason
+        return response
+
+    def submit(self, cmd):
+        """Queue the command and return the answer."""
+        try:
+            name, attr = parseCommand(cmd, self.zones, self.config)
+            commandId = cmd.get("id")
+            # the id must be usable as a key
+            hash(commandId)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning("invalid command %s: %s", cmd, e)
+            return self._answer(cmd, REJECTED, "invalid")
+
+        if commandId is not None and commandId in self.ids:
+            return self._answer(cmd, DUPLICATE)
+        status, reason = self._enqueue(name, attr)
+        # the rejected one can be retried
+        if commandId is not None and status != REJECTED:
+            self.ids[commandId] = status
+            if len(self.ids) > IDS:
+                self.ids.popitem(last=False)
+        if status == REJECTED:
+            logger.warning("command %s rejected: %s", cmd, reason)
+        return self._answer(cmd, status, reason)
+
+    def _enqueue(self, name, attr):
+        now = self.loop.time()
+        # the job and zone
+        actuator = " ".join([name] + [str(a) for a in attr[:-1]])
+        last = self.last.get(actuator)
+        if last and now - last[0] <= self.config["coalesce"]:
+            last[0] = now
+            # the longer one wins if it wasn't started yet
+            if any(entry is last for entry in self.queue) and attr[-1] > last[2][-1]:
+                last[2] = attr
+            return COALESCED, None
+
+        if len(self.queue) >= self.config["queue"]:
+            return REJECTED, "queue_full"
+        bucket = self.buckets.get(actuator)
+        if bucket is None:
+            bucket = self.buckets[actuator] = TokenBucket(
+                self.config["burst"], self.config["refill"], now)
+        if not bucket.take(now):
+            return REJECTED, "rate_limited"
+
+        entry = self.last[actuator] = [now, name, attr]
+        self.queue.append(entry)
+        QUEUE_DEPTH.set(len(self.queue))
+        self.ready.set()
+        return ACCEPTED, None
+
+    async def run(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            while self.queue:
+                _, name, attr = self.queue.popleft()
+                QUEUE_DEPTH.set(len(self.queue))
+                logger.info("starting %s %s", name, attr)
+                self.start(name, attr)
+                # let the queue fill in between
+                await asyncio.sleep(0)
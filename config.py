@@ -0,0 +1,358 @@
+"""Device configuration delivered over the MQTT /config topic.
+
+The configuration is a JSON document carrying a version number, the job
+schedule (the same cron-like entries as the schedule file) and the sampling
+settings of the measurement task, i.e.:
+
+    {
+        "version": 3,
+        "schedule": ["0 8 * * * pump 30", "0 9 * * * lamp 28800"],
+        "sampling": {"interval": 60, "samples": 5},
+        "logging": {"mqtt": "DEBUG", "sensors": "WARNING"},
+        "zones": {"zone1": {"pin": "D17", "load": 0.3}},
+        "power": {"budget": 2.0, "pump": 1.2},
+        "watering": {"mode": "hysteresis", "target": 600, "hysteresis": 30},
+        "sensors": {"soil": {"type": "soil", "interval": 300}},
+        "aggregation": {"windows": [300], "alarms": {"temp": {"min": 5, "max": 35}}},
+        "commands": {"burst": 2, "refill": 300}
+    }
+
+The optional "logging" section sets the log level of the given subsystems.
+The optional "zones" and "power" sections declare the watering zones
+(see zones.py) which can be used in the schedule as `pump <zone> <seconds>`.
+The optional "watering" section enables the closed loop watering driven by
+the soil moisture (see watering.py) and the optional "sensors" section
+declares the sensors to read (see sensors.py). With the optional
+"aggregation" section only the summaries of the readings are published
+(see aggregation.py). The optional "commands" section sets the limits of
+the remote commands (see commands.py).
+"""
+
+import copy
+import json
+import logging
+import os
+
+import clock
+import commands
+import hal
+import log
+import schedule
+import sensors
+import watering
+
+logger = log.getLogger("config")
+
+DEFAULT_SAMPLING = {"interval": 60, "samples": 5}
+# shortest interval of reading a sensor, in seconds
+MIN_INTERVAL = 1
+
+class ConfigError(Exception):
+    """Raised when the received configuration is not valid."""
+
+class DeviceConfig(object):
+    """Immutable snapshot of the device configuration."""
+
+    def __init__(self, version, scheduleLines, sampling, logLevels=None,
+                 zones=None, power=None, watering=None, sensors=None, aggregation=None,
+                 commands=None):
+        self.version = version
+        self.schedule = tuple(scheduleLines)
+        self.sampling = dict(sampling)
+        self.logLevels = dict(logLevels or {})
+        self.zones = copy.deepcopy(zones or {})
+        self.power = dict(power or {})
+        self.watering = dict(watering or {})
+        self.sensors = copy.deepcopy(sensors or {})
+        self.aggregation = copy.deepcopy(aggregation or {})
+        self.commands = dict(commands or {})
+
+    def toDict(self):
+        return {
+            "version": self.version,
+            "schedule": list(self.schedule),
+            "sampling": dict(self.sampling),
+            "logging": dict(self.logLevels),
+            "zones": copy.deepcopy(self.zones),
+            "power": dict(self.power),
+            "watering": dict(self.watering),
+            "sensors": copy.deepcopy(self.sensors),
+            "aggregation": copy.deepcopy(self.aggregation),
+            "commands": dict(self.commands),
+        }
+
+def _isNumber(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def parseZones(data):
+    zones = data.get("zones", {})
+    if not isinstance(zones, dict):
+        raise ConfigError("zones must be a JSON object")
+    used = {}
+    for name, zone in zones.items():
+        # the name can not be a number as it would be taken for the duration
+        if name.isdigit():
+            raise ConfigError("invalid zone name: {}".format(name))
+        if not isinstance(zone, dict) or not isinstance(zone.get("pin"), str):
+            raise ConfigError("zone {} needs a pin".format(name))
+        pin = zone["pin"]
+        if not hal.isPin(pin):
+            raise ConfigError("invalid pin of zone {}: {}".format(name, pin))
+        if pin in hal.PINS:
+            raise ConfigError("pin {} of zone {} is used by the {}".format(
+                pin, name, hal.PINS[pin]))
+        if pin in used:
+            raise ConfigError("pin {} of zone {} is used by zone {}".format(pin, name, used[pin]))
+        used[pin] = name
+        if not _isNumber(zone.get("load", 0)) or zone.get("load", 0) < 0:
+            raise ConfigError("invalid load of zone {}".format(name))
+
+    power = data.get("power", {})
+    if not isinstance(power, dict):
+        raise ConfigError("power must be a JSON object")
+    budget = power.get("budget")
+    if budget is not None and (not _isNumber(budget) or budget <= 0):
+        raise ConfigError("invalid power budget: {}".format(budget))
+    if not _isNumber(power.get("pump", 0)) or power.get("pump", 0) < 0:
+        raise ConfigError("invalid pump load: {}".format(power.get("pump")))
+    return zones, power
+
+def parseWatering(data):
+    settings = data.get("watering", {})
+    if not isinstance(settings, dict):
+        raise ConfigError("watering must be a JSON object")
+    for key, value in settings.items():
+        if key not in watering.DEFAULT_WATERING:
+            raise ConfigError("unknown watering setting: {}".format(key))
+        if key == "mode":
+            if value not in watering.MODES:
+                raise ConfigError("invalid watering mode: {}".format(value))
+        elif key == "daily_budget" and value is None:
+            continue
+        elif not _isNumber(value) or value < 0:
+            raise ConfigError("invalid watering {}: {}".format(key, value))
+    merged = dict(watering.DEFAULT_WATERING, **settings)
+    if merged["min_pulse"] <= 0 or merged["min_pulse"] > merged["max_pulse"]:
+        raise ConfigError("invalid watering pulse limits")
+    return settings
+
+def parseSensors(data):
+    configured = data.get("sensors", {})
+    if not isinstance(configured, dict):
+        raise ConfigError("sensors must be a JSON object")
+    for name, options in configured.items():
+        if options is None:
+            continue
+        if not isinstance(options, dict):
+            raise ConfigError("sensor {} must be a JSON object".format(name))
+        kind = options.get("type", name)
+        if kind not in sensors.PLUGINS:
+            raise ConfigError("unknown type of sensor {}: {}".format(name, kind))
+        for key, value in options.items():
+            if key in ("type", "device"):
+                valid = isinstance(value, str)
+            elif key == "filter":
+                valid = value in sensors.FILTERS
+            elif key == "samples":
+                valid = isinstance(value, int) and not isinstance(value, bool) and value > 0
+            elif key == "interval":
+                valid = _isNumber(value) and value >= MIN_INTERVAL
+            elif key == "spacing":
+                valid = _isNumber(value) and value >= 0
+            else:
+                raise ConfigError("unknown setting of sensor {}: {}".format(name, key))
+            if not valid:
+                raise ConfigError("invalid {} of sensor {}: {}".format(key, name, value))
+    return configured
+
+def parseAggregation(data):
+    settings = data.get("aggregation", {})
+    if not isinstance(settings, dict):
+        raise ConfigError("aggregation must be a JSON object")
+    for key in settings:
+        if key not in ("windows", "alarms", "burst"):
+            raise ConfigError("unknown aggregation setting: {}".format(key))
+    windows = settings.get("windows", [])
+    if not isinstance(windows, list) or not all(
+            isinstance(w, int) and not isinstance(w, bool) and w >= 60 for w in windows):
+        raise ConfigError("aggregation windows must be a list of at least 60 seconds")
+    if len(set(windows)) != len(windows):
+        raise ConfigError("duplicate aggregation windows")
+    alarms = settings.get("alarms", {})
+    if not isinstance(alarms, dict):
+        raise ConfigError("alarms must be a JSON object")
+    for channel, limits in alarms.items():
+        if not isinstance(limits, dict) or not limits or any(
+                key not in ("min", "max") or not _isNumber(value)
+                for key, value in limits.items()):
+            raise ConfigError("invalid alarm limits of {}".format(channel))
+    burst = settings.get("burst", 1)
+    if not isinstance(burst, int) or isinstance(burst, bool) or burst < 1:
+        raise ConfigError("invalid alarm burst: {}".format(burst))
+    return settings
+
+def parseCommands(data):
+    settings = data.get("commands", {})
+    if not isinstance(settings, dict):
+        raise ConfigError("commands must be a JSON object")
+    for key, value in settings.items():
+        if key not in commands.DEFAULT_COMMANDS:
+            raise ConfigError("unknown commands setting: {}".format(key))
+        if key in ("queue", "burst"):
+            if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+                raise ConfigError("invalid commands {}: {}".format(key, value))
+        elif not _isNumber(value) or value < 0 or (key != "coalesce" and value == 0):
+            raise ConfigError("invalid commands {}: {}".format(key, value))
+    return settings
+
+def checkJob(line, name, attr, actions, zones):
+    if name not in actions:
+        raise ConfigError("[{}]: unknown job {}".format(line, name))
+    # pump [<zone>] [<seconds>], lamp [<seconds>]
+    if len(attr) > (2 if name == "pump" else 1):
+        raise ConfigError("[{}]: too many arguments".format(line))
+    if len(attr) == 2 and attr[0] not in zones:
+        raise ConfigError("[{}]: unknown zone {}".format(line, attr[0]))
+    if attr and (not attr[-1].isdigit() or int(attr[-1]) == 0):
+        raise ConfigError("[{}]: invalid duration {}".format(line, attr[-1]))
+
+def parse(data, actions):
+    """Validate the configuration dict and return DeviceConfig.
+    :param data: the decoded JSON document
+    :param actions: names of the jobs the device knows how to run
+    """
+    if not isinstance(data, dict):
+        raise ConfigError("configuration must be a JSON object")
+
+    version = data.get("version")
+    if not isinstance(version, int) or isinstance(version, bool) or version < 0:
+        raise ConfigError("missing or invalid version: {}".format(version))
+
+    zones, power = parseZones(data)
+    wateringSettings = parseWatering(data)
+    sensorsSettings = parseSensors(data)
+    aggregationSettings = parseAggregation(data)
+    commandsSettings = parseCommands(data)
+
+    lines = data.get("schedule", [])
+    if not isinstance(lines, list):
+        raise ConfigError("schedule must be a list of cron entries")
+    base = clock.now()
+    for line in lines:
+        if not isinstance(line, str):
+            raise ConfigError("invalid schedule entry: {}".format(line))
+        try:
+            entry = schedule.parseEntry(line, base)
+        except ValueError as e:
+            raise ConfigError("[{}]: {}".format(line, e))
+        if entry:
+            checkJob(line, entry[1], entry[2], actions, zones)
+
+    sampling = copy.deepcopy(DEFAULT_SAMPLING)
+    if not isinstance(data.get("sampling", {}), dict):
+        raise ConfigError("sampling must be a JSON object")
+    for key in data.get("sampling", {}):
+        if key not in DEFAULT_SAMPLING:
+            raise ConfigError("unknown sampling setting: {}".format(key))
+    sampling.update(data.get("sampling", {}))
+    for key in DEFAULT_SAMPLING:
+        if not isinstance(sampling[key], int) or isinstance(sampling[key], bool):
+            raise ConfigError("sampling {} must be an integer".format(key))
+    # we are dropping min and max samples so need at least 3
+    if sampling["samples"] < 3:
+        raise ConfigError("at least 3 samples are needed")
+    # one sample takes a second
+    if sampling["interval"] <= sampling["samples"]:
+        raise ConfigError("sampling interval too short")
+
+    logLevels = data.get("logging", {})
+    if not isinstance(logLevels, dict):
+        raise ConfigError("logging must be a JSON object")
+    for subsystem, level in logLevels.items():
+        if not isinstance(level, str) or not isinstance(
+                logging.getLevelName(level.upper()), int):
+            raise ConfigError("invalid log level of {}: {}".format(subsystem, level))
+
+    return DeviceConfig(version, lines, sampling, logLevels, zones, power,
+                        wateringSettings, sensorsSettings, aggregationSettings,
+                        commandsSettings)
+
+def load(path):
+    # returns None if there is no stored configuration
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save(config, path):
+    # write to the temporary file first and rename so that
+    # we never end up with a half written configuration
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(config.toDict(), f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+class ConfigManager(object):
+    """Holds the active configuration and applies the updates.
+
+    All the tasks are reading `current` each time they need it so swapping
+    the reference is enough to apply new configuration atomically.
+    """
+
+    def __init__(self, path, cronFile, actions):
+        self.path = path
+        self.actions = actions
+        self.listeners = []
+
+        stored = load(path) if path else None
+        if stored is not None:
+            try:
+                self.current = parse(stored, actions)
+                logger.info("using stored configuration version %s",
+                    self.current.version)
+                return
+            except ConfigError as e:
+                logger.error("stored configuration is invalid: %s", e)
+
+        # no configuration received yet; fall back to the schedule file
+        with open(cronFile) as f:
+            lines = [line.rstrip() for line in f]
+        self.current = DeviceConfig(0, lines, DEFAULT_SAMPLING)
+
+    def addListener(self, listener):
+        # listener is called with the new configuration once applied
+        self.listeners.append(listener)
+
+    def apply(self, payload):
+        """Apply the configuration received from the server.
+        Returns the state that should be reported back to the server.
+        """
+        try:
+            data = json.loads(payload)
+            new = parse(data, self.actions)
+        except (ValueError, ConfigError) as e:
+            logger.error("rejecting configuration: %s", e)
+            return {"config_version": self.current.version,
+                    "status": "rejected", "error": str(e)}
+
+        # the server is sending the configuration on each (re)connect
+        # so we can ignore the one that is already applied
+        if new.version <= self.current.version:
+            return {"config_version": self.current.version, "status": "unchanged"}
+
+        if self.path:
+            try:
+                save(new, self.path)
+            except OSError as e:
+                logger.error("can not store configuration: %s", e)
+                return {"config_version": self.current.version,
+                        "status": "rejected", "error": str(e)}
+
+        self.current = new
+        logger.info("applied configuration version %s", new.version)
+        for listener in self.listeners:
+            listener(new)
+        return {"config_version": new.version, "status": "applied"}
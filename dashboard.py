@@ -0,0 +1,198 @@
+"""Pages of the LCD.
+
+The 2x16 display can't show everything at once so it rotates through the
+pages, every few seconds or when the button is pressed. A page is a
+template of each row bound to the values in the live state, i.e.:
+
+    Page("climate", "Temp: {temp:.1f} C", "Humidity: {humid:.1f} %")
+
+Each page keeps its frame rendered into fixed 16 byte rows and renders it
+again only once the values it is bound to change. Alerts are pages shown
+instead of the rotation while their condition holds; the first one wins.
+Only the characters differing from what is on the display are written so
+switching between similar pages costs just a few bytes of I2C traffic.
+"""
+
+import asyncio
+import socket
+import string
+import time
+
+import log
+import metrics
+
+logger = log.getLogger("display")
+
+DISPLAY_TIME = metrics.histogram("display_redraw_seconds", "Time of the LCD redraw.")
+CHARACTERS = metrics.counter(
+    "display_characters_total", "Characters written to the LCD.")
+
+FORMATTER = string.Formatter()
+# presses closer than this are the button bouncing
+DEBOUNCE = 0.3
+# unchanged characters between the changed ones written anyway
+# as moving the cursor costs about the same
+GAP = 2
+
+def renderRow(template, state, width):
+    parts = []
+    for literal, field, spec, _ in FORMATTER.parse(template):
+        parts.append(literal)
+        if field:
+            value = state.get(field)
+            parts.append("--" if value is None else format(value, spec))
+    return "".join(parts)[:width].ljust(width).encode("ascii", "replace")
+
+def changedSpans(old, new, gap=GAP):
+    """Return [start, end) of the parts of the row to write."""
+    spans = []
+    for i, (a, b) in enumerate(zip(old, new)):
+        if a == b:
+            continue
+        if spans and i - spans[-1][1] <= gap:
+            spans[-1][1] = i + 1
+        else:
+            spans.append([i, i + 1])
+    return spans
+
+class Page(object):
+    """
+    :param rows: template of each row
+    :param when: function of the state telling if the alert is on
+    """
+
+    def __init__(self, name, *rows, when=None):
+        self.name = name
+        self.rows = rows
+        self.when = when
+        self.keys = tuple(field for row in rows
+                          for _, field, _, _ in FORMATTER.parse(row) if field)
+        self.values = None
+        self.frame = None
+
+    def empty(self, state):
+        # nothing to show, i.e. the sensor is not connected
+        return bool(self.keys) and all(state.get(key) is None for key in self.keys)
+
+    def render(self, state, width):
+        values = tuple(state.get(key) for key in self.keys)
+        if values != self.values:
+            self.values = values
+            self.frame = tuple(renderRow(row, state, width) for row in self.rows)
+        return self.frame
+
+PAGES = (
+    Page("climate", "Temp: {temp:.1f} C", "Humidity: {humid:.1f} %"),
+    Page("water", "Soil: {soil}", "Tank: {level}"),
+    Page("relays", "Pump: {pump}", "Lamp: {lamp}"),
+    Page("schedule", "Next: {next_job}", "{next_time}"),
+    Page("network", "Cloud: {cloud}", "{address}"),
+)
+
+ALERTS = (
+    Page("tank", "tank empty", "refill the tank", when=lambda state: state.get("level") == "empty"),
+)
+
+def localAddress():
+    # nothing is sent; only the route is looked up
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(("8.8.8.8", 80))
+            return s.getsockname()[0]
+    except OSError:
+        return None
+
+class Dashboard(object):
+    """
+    :param rotate: seconds each page is shown
+    :param lock: lock of the bus held while writing to the display
+    """
+
+    def __init__(self, loop, display, pages=PAGES, alerts=ALERTS, rotate=10.0, lock=None):
+        self.loop = loop
+        self.display = display
+        self.pages = pages
+        self.alerts = alerts
+        self.rotate = rotate
+        self.lock = lock
+        self.columns = getattr(display, "columns", 16)
+        self.lines = getattr(display, "lines", 2)
+        self.state = {}
+        self.index = 0
+        # rows on the display
+        self.shown = None
+        self.changed = asyncio.Event()
+        self.rotateAt = None
+        self.pressed = None
+
+    def update(self, **values):
+        if any(self.state.get(key) != value for key, value in values.items()):
+            self.state.update(values)
+            self.changed.set()
+
+    def onRelay(self, name, on):
+        self.update(**{name: "on" if on else "off"})
+
+    def page(self):
+        for alert in self.alerts:
+            if alert.when(self.state):
+                return alert
+        return self.pages[self.index]
+
+    def next(self):
+        for _ in self.pages:
+            self.index = (self.index + 1) % len(self.pages)
+            if not self.pages[self.index].empty(self.state):
+                break
+        self.rotateAt = self.loop.time() + self.rotate
+        self.changed.set()
+
+    def press(self):
+        now = self.loop.time()
+        if self.pressed is None or now - self.pressed > DEBOUNCE:
+            self.next()
+        self.pressed = now
+
+    def attachButton(self, button):
+        # active low; the edges are coming from the gpiod thread
+        def onEdge():
+            if not button.value:
+                self.loop.call_soon_threadsafe(self.press)
+
+        button.addEdgeCallback(onEdge)
+
+    def draw(self):
+        started = time.perf_counter()
+        frame = self.page().render(self.state, self.columns)
+        if self.shown is None:
+            self.display.clear()
+            self.shown = (b" " * self.columns,) * self.lines
+        written = 0
+        for row, (old, new) in enumerate(zip(self.shown, frame)):
+            for start, end in changedSpans(old, new):
+                self.display.cursor_position(start, row)
+                self.display.message = new[start:end].decode("ascii")
+                written += end - start
+        self.shown = frame
+        if written:
+            CHARACTERS.inc(written)
+            DISPLAY_TIME.observe(time.perf_counter() - started)
+
+    async def run(self):
+        self.rotateAt = self.loop.time() + self.rotate
+        while True:
+            if self.lock:
+                async with self.lock:
+                    self.draw()
+            else:
+                self.draw()
+            # everything changed till now is drawn
+            self.changed.clear()
+            timeout = self.rotateAt - self.loop.time()
+            if timeout > 0:
+                try:
+                    await asyncio.wait_for(self.changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            if self.loop.time() >= self.rotateAt:
+                self.next()
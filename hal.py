@@ -0,0 +1,217 @@
+"""Hardware abstraction layer.
+
+The daemon is talking to the devices through the backend so that the same
+code can run either on the Raspberry Pi, on the simulated hardware (see
+simulation.py) or replay the recorded trace (see replay.py). The hardware
+libraries are imported only once the Raspberry Pi backend is used so that
+the daemon can be imported on any machine.
+
+Each backend creates the same set of devices:
+    pump, lamp  - relays; active low so `False` switches them on
+    level       - water level switch; `True` when the tank is empty, can
+                  provide `addEdgeCallback()` to notify about the changes
+    dht         - temperature and humidity sensor; None if read by the
+                  acquisition process (see acquisition.py)
+    soil        - soil moisture sensor providing `moisture_read()`; None if
+                  not connected
+    display     - character LCD
+    button      - push button switching the pages of the display (active
+                  low, see dashboard.py); None if not available
+"""
+
+import asyncio
+import re
+import threading
+
+# GPIOs of the built-in devices; not available for the zone valves
+PINS = {"D2": "i2c", "D3": "i2c", "D4": "level", "D18": "dht", "D22": "button",
+        "D23": "pump", "D24": "lamp"}
+
+def isPin(name):
+    """Tell if the name is a GPIO of the board, i.e. D17."""
+    match = re.fullmatch(r"D(\d+)", name)
+    return bool(match) and int(match.group(1)) <= 27
+
+class Backend(object):
+    """Interface of the device backends."""
+
+    name = None
+
+    def initDevices(self):
+        """Initialize the devices and return them as a dict."""
+        raise NotImplementedError()
+
+    def createDHT(self):
+        """Create only the DHT sensor; used by the acquisition process
+        (see acquisition.py)."""
+        raise NotImplementedError()
+
+    def createEventLoop(self):
+        """Return the event loop the daemon should run on."""
+        return asyncio.new_event_loop()
+
+    def createRelay(self, pin):
+        """Create additional relay (i.e. zone valve) on the pin with
+        the given name; the relay is switched off."""
+        raise NotImplementedError()
+
+    def attach(self, loop, commandHandler, configHandler=None):
+        """Called once the daemon is running with the handlers of the
+        commands and of the configuration (the JSON payloads normally
+        received over MQTT)."""
+
+    def close(self):
+        """Called once the daemon is stopped."""
+
+class ObservedRelay(object):
+    """Relay notifying the listeners about switching it on and off."""
+
+    def __init__(self, name, relay):
+        self.name = name
+        self.relay = relay
+        self.listeners = []
+
+    def addListener(self, listener):
+        # listener is called with the name and True when switched on
+        self.listeners.append(listener)
+
+    @property
+    def value(self):
+        return self.relay.value
+
+    @value.setter
+    def value(self, value):
+        changed = value != self.relay.value
+        self.relay.value = value
+        if changed:
+            for listener in self.listeners:
+                listener(self.name, not value)
+
+class GpiodInput(object):
+    """Input pin delivering the edge events using libgpiod."""
+
+    def __init__(self, offset, chip="gpiochip0", consumer="autoplant", pullUp=False):
+        import gpiod
+        self.chip = gpiod.Chip(chip)
+        self.line = self.chip.get_line(offset)
+        # an open button would be floating without the pull-up
+        flags = gpiod.LINE_REQ_FLAG_BIAS_PULL_UP if pullUp else 0
+        self.line.request(consumer=consumer, type=gpiod.LINE_REQ_EV_BOTH_EDGES, flags=flags)
+        self.callbacks = []
+        self.thread = None
+
+    @property
+    def value(self):
+        return bool(self.line.get_value())
+
+    def addEdgeCallback(self, callback):
+        self.callbacks.append(callback)
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._wait, name="gpiod", daemon=True)
+            self.thread.start()
+
+    def _wait(self):
+        while True:
+            if not self.line.event_wait(sec=1):
+                continue
+            self.line.event_read()
+            for callback in self.callbacks:
+                callback()
+
+class RaspberryPiBackend(Backend):
+    """Real devices connected to the Raspberry Pi GPIOs."""
+
+    name = "rpi"
+
+    def initDevices(self, dht=True):
+        """
+        :param dht: False if the DHT sensor is read by the acquisition process
+        """
+        import board
+        import busio
+        import digitalio
+        import character_lcd_pcf8574 as char_lcd
+
+        # initialize lcd
+        lcd_columns = 16
+        lcd_rows = 2
+        i2c = busio.I2C(board.SCL, board.SDA)
+        lcd = char_lcd.Character_LCD_I2C_PCF8574(i2c, lcd_columns, lcd_rows, address=0x27)
+
+        # and write a simple message
+        lcd.clear()
+        lcd.backlight = True
+        lcd.message = "initializing..."
+
+        # initialize the pump controlling relay pin
+        pump = digitalio.DigitalInOut(board.D23)
+        pump.direction = digitalio.Direction.OUTPUT
+        # low state is causing NO raly pin to activate
+        # so we need to initialize it with high state first
+        pump.value = True
+
+        # initialize water level sensor; use libgpiod edge events if
+        # available so we don't need to poll it
+        try:
+            level = GpiodInput(board.D4.id)
+        except (ImportError, OSError):
+            level = digitalio.DigitalInOut(board.D4)
+            level.direction = digitalio.Direction.INPUT
+
+        # the button switching the display pages is optional and only
+        # used with libgpiod
+        try:
+            button = GpiodInput(board.D22.id, pullUp=True)
+        except (ImportError, OSError):
+            button = None
+
+        # initialize the lump controlling relay pin
+        lamp = digitalio.DigitalInOut(board.D24)
+        lamp.direction = digitalio.Direction.OUTPUT
+        lamp.value = True
+
+        lcd.clear()
+        lcd.message = "init done"
+
+        # initialize the dht device
+        dhtDevice = self.createDHT() if dht else None
+
+        # the soil moisture sensor is optional and shares the bus with lcd
+        try:
+            from adafruit_seesaw.seesaw import Seesaw
+            soil = Seesaw(i2c, addr=0x36)
+        except (ImportError, OSError, ValueError):
+            soil = None
+
+        return {"pump": pump, "lamp": lamp, "display": lcd, "level": level,
+                "dht": dhtDevice, "soil": soil, "button": button}
+
+    def createDHT(self):
+        import board
+        import adafruit_dht
+
+        return adafruit_dht.DHT11(board.D18)
+
+    def createEventLoop(self):
+        return asyncio.get_event_loop()
+
+    def createRelay(self, pin):
+        import board
+        import digitalio
+
+        relay = digitalio.DigitalInOut(getattr(board, pin))
+        relay.direction = digitalio.Direction.OUTPUT
+        relay.value = True
+        return relay
+
+def getBackend(name, **kwargs):
+    if name == RaspberryPiBackend.name:
+        return RaspberryPiBackend(**kwargs)
+    if name == "sim":
+        # imported here as the simulation is not needed on the device
+        import simulation
+        return simulation.SimulatedBackend(**kwargs)
+    if name == "replay":
+        import replay
+        return replay.ReplayBackend(**kwargs)
+    raise ValueError("unknown backend: {}".format(name))
@@ -0,0 +1,75 @@
+"""Recent readings and relay transitions kept in memory.
+
+Used to answer the local queries (see api.py) without touching the
+sensors. Everything is bounded; by default a day of one per minute
+readings per channel and the last 1000 relay transitions are kept. The
+readings are stored in preallocated arrays so that keeping them doesn't
+allocate anything.
+"""
+
+import array
+import collections
+
+import clock
+
+class Series(object):
+    """Ring of the (timestamp, value) pairs with a fixed capacity."""
+
+    __slots__ = ("times", "values", "start", "size")
+
+    def __init__(self, capacity):
+        self.times = array.array("d", bytes(8 * capacity))
+        self.values = array.array("d", bytes(8 * capacity))
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, when, value):
+        capacity = len(self.times)
+        index = (self.start + self.size) % capacity
+        self.times[index] = when
+        self.values[index] = value
+        if self.size < capacity:
+            self.size += 1
+        else:
+            self.start = (self.start + 1) % capacity
+
+    def __iter__(self):
+        capacity = len(self.times)
+        for i in range(self.size):
+            index = (self.start + i) % capacity
+            yield self.times[index], self.values[index]
+
+class History(object):
+
+    def __init__(self, readings=1440, transitions=1000):
+        self.maxReadings = readings
+        self.latest = {}
+        self.readings = {}
+        self.transitions = collections.deque(maxlen=transitions)
+        self.relays = {}
+
+    def consume(self, readings):
+        # called by the polling engine
+        for reading in readings:
+            if reading.value is None:
+                continue
+            self.latest[reading.quantity] = reading
+            channel = self.readings.get(reading.quantity)
+            if channel is None:
+                channel = self.readings[reading.quantity] = Series(self.maxReadings)
+            channel.append(reading.timestamp, reading.value)
+
+    def onRelay(self, name, on):
+        now = clock.now().timestamp()
+        self.relays[name] = (now, on)
+        self.transitions.append((now, name, on))
+
+    def since(self, channel, since):
+        return [(when, value) for when, value in self.readings.get(channel, ())
+                if when >= since]
+
+    def transitionsSince(self, since):
+        return [t for t in self.transitions if t[0] >= since]
@@ -0,0 +1,126 @@
+"""State journal used to resume the jobs after the restart.
+
+The jobs (i.e. the lamp switched on for 8 hours) live only in memory so
+without the journal the rest of the job is lost when the daemon is
+restarted in the middle of it (crash, update, ...). Each running job is
+stored as a lease with its end time and removed once the job is done.
+When the daemon starts again the leases which are not expired yet are
+resumed for the remaining time.
+
+The end time is stored both as monotonic time, which is used when the
+daemon is restarted within the same boot as it is not affected by the wall
+clock adjustments, and as the wall clock time used after the reboot.
+
+The journal also keeps the scheduler cursor; the time of the last
+dispatched job so that the same job is never run twice.
+"""
+
+import itertools
+import json
+import os
+
+import clock
+import log
+
+logger = log.getLogger("journal")
+
+class Lease(object):
+
+    __slots__ = ("id", "job", "attr", "endMono", "endWall", "bootId")
+
+    def __init__(self, id, job, attr, endMono, endWall, bootId):
+        self.id = id
+        self.job = job
+        self.attr = attr
+        self.endMono = endMono
+        self.endWall = endWall
+        self.bootId = bootId
+
+    def remaining(self):
+        if self.bootId is not None and self.bootId == clock.bootId():
+            return self.endMono - clock.monotonic()
+        return self.endWall - clock.now().timestamp()
+
+    def toDict(self):
+        return {"job": self.job, "attr": self.attr, "end_mono": self.endMono,
+                "end_wall": self.endWall, "boot_id": self.bootId}
+
+class StateJournal(object):
+    """
+    :param path: file to store the journal in; if empty nothing is stored
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.leases = {}
+        self.cursor = None
+        self.ids = itertools.count(1)
+        self.recovered = self._load()
+
+    def _load(self):
+        # returns the leases stored by the previous run
+        if not self.path:
+            return []
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            leases = [Lease(None, l["job"], l["attr"], l["end_mono"], l["end_wall"], l["boot_id"])
+                      for l in data.get("leases", [])]
+            cursor = data.get("cursor")
+        except FileNotFoundError:
+            return []
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            # not a valid JSON or some of the fields are missing
+            logger.error("state journal is corrupted: %r", e)
+            return []
+
+        self.cursor = cursor
+        return leases
+
+    def _save(self):
+        if not self.path:
+            return
+        data = {
+            "cursor": self.cursor,
+            "leases": [lease.toDict() for lease in self.leases.values()],
+        }
+        # write to the temporary file first and rename so that
+        # we never end up with a half written journal
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.error("can not store state journal: %s", e)
+
+    def startLease(self, job, attr, seconds):
+        """Record the job running for the given number of seconds."""
+        lease = Lease(next(self.ids), job, attr,
+                      clock.monotonic() + seconds,
+                      clock.now().timestamp() + seconds,
+                      clock.bootId())
+        self.leases[lease.id] = lease
+        self._save()
+        return lease.id
+
+    def endLease(self, id):
+        if self.leases.pop(id, None):
+            self._save()
+
+    def pendingLeases(self):
+        """Return the leases of the previous run that are not expired yet
+        together with the remaining number of seconds."""
+        pending = [(lease, lease.remaining()) for lease in self.recovered]
+        self.recovered = []
+        return [(lease, remaining) for lease, remaining in pending if remaining >= 1]
+
+    def lastDispatched(self):
+        # timestamp of the last job started by the scheduler
+        return self.cursor
+
+    def setDispatched(self, when):
+        self.cursor = when.timestamp()
+        self._save()
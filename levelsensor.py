@@ -0,0 +1,107 @@
+"""Debounced state of the water level switch.
+
+Instead of polling the switch from the tasks it is turned into the event
+source shared by the pump (which needs to stop as soon as the tank is
+empty) and the measurement task. The changes are coming either from the
+pin itself if it supports edge callbacks (`addEdgeCallback()`, i.e. libgpiod
+edge events or the simulated tank), or from the thread polling the pin
+every few milliseconds. Each edge is confirmed by reading the pin again
+once the debounce time is over so the switch bouncing is filtered out.
+"""
+
+import asyncio
+import threading
+import time
+
+import log
+import metrics
+
+logger = log.getLogger("sensors")
+
+EDGES = metrics.counter("level_edges_total", "Edges seen on the level switch.")
+TANK_EMPTY = metrics.gauge("tank_empty", "1 if the tank is empty.")
+
+class LevelMonitor(object):
+    """
+    :param pin: the level switch; its value is `True` when the tank is empty
+    :param debounce: seconds the new value needs to hold to be accepted
+    :param pollInterval: how often the pin is read if it has no edge events
+    """
+
+    def __init__(self, loop, pin, debounce=0.02, pollInterval=0.005):
+        self.loop = loop
+        self.pin = pin
+        self.debounce = debounce
+        self.pollInterval = pollInterval
+        self.empty = bool(pin.value)
+        self.emptyEvent = asyncio.Event()
+        if self.empty:
+            self.emptyEvent.set()
+        self.listeners = []
+        self.confirming = None
+        self.running = False
+        self.thread = None
+        TANK_EMPTY.set(1 if self.empty else 0)
+
+    def start(self):
+        self.running = True
+        if hasattr(self.pin, "addEdgeCallback"):
+            self.pin.addEdgeCallback(self._onEdge)
+        else:
+            self.thread = threading.Thread(target=self._poll, name="level", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def addListener(self, listener):
+        # listener is called on the loop with the new state
+        self.listeners.append(listener)
+
+    async def waitEmpty(self, timeout=None):
+        """Return True once the tank is empty or False on timeout."""
+        try:
+            await asyncio.wait_for(self.emptyEvent.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _poll(self):
+        last = self.empty
+        while self.running:
+            value = bool(self.pin.value)
+            if value != last:
+                last = value
+                self._onEdge()
+            time.sleep(self.pollInterval)
+
+    def _onEdge(self):
+        # can be called from any thread
+        EDGES.inc()
+        try:
+            self.loop.call_soon_threadsafe(self._edge)
+        except RuntimeError:
+            # the loop is already closed
+            pass
+
+    def _edge(self):
+        # confirm the first edge after the debounce time; the following
+        # edges are ignored till then so the reaction is never delayed
+        # for longer than debounce
+        if self.confirming is None:
+            self.confirming = self.loop.call_later(self.debounce, self._confirm)
+
+    def _confirm(self):
+        self.confirming = None
+        value = bool(self.pin.value)
+        if value == self.empty:
+            return
+        self.empty = value
+        TANK_EMPTY.set(1 if value else 0)
+        logger.info("tank is %s", "empty" if value else "full")
+        if value:
+            self.emptyEvent.set()
+        else:
+            self.emptyEvent.clear()
+        for listener in self.listeners:
+            listener(value)
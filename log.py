@@ -0,0 +1,119 @@
+"""Logging of the daemon.
+
+Each subsystem is using its own logger (`autoplant.<subsystem>`) so that
+the verbosity can be tuned separately, also at runtime (see `setLevels()`).
+
+Records are only put on the queue by the caller; writing them out (to the
+journal when running under systemd) is done by the separate thread so that
+logging never blocks the event loop nor the MQTT thread. If the writer can
+not keep up the records are dropped instead of blocking.
+"""
+
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+
+import clock
+
+ROOT = "autoplant"
+FORMAT = "%(levelname)s %(name)s: %(message)s"
+
+_listener = None
+_handler = None
+
+def getLogger(subsystem):
+    return logging.getLogger("{}.{}".format(ROOT, subsystem))
+
+class RateLimitFilter(logging.Filter):
+    """Limits repeating messages, i.e. DHT read errors.
+
+    At most `burst` records with the same formatted message are let through
+    every `period` seconds; the number of suppressed ones is appended to
+    the first record passed once the period is over. Only the same message
+    is limited so the distinct events sharing the template all get through.
+    """
+
+    def __init__(self, burst=5, period=60.0):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        # (logger, message) -> [period start, count]
+        self.seen = {}
+        # the records are coming from the MQTT, gpiod and executor threads
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.getMessage())
+        now = clock.monotonic()
+        with self.lock:
+            entry = self.seen.get(key)
+            if entry is None or now - entry[0] >= self.period:
+                suppressed = entry[1] - self.burst if entry else 0
+                if suppressed > 0:
+                    record.msg = "{} ({} similar messages suppressed)".format(
+                        record.msg, suppressed)
+                if len(self.seen) > 1000:
+                    # don't let it grow with all the distinct messages
+                    self.seen.clear()
+                self.seen[key] = [now, 1]
+                return True
+            entry[1] += 1
+            return entry[1] <= self.burst
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler dropping the records if the queue is full."""
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def setup(level="INFO", queueSize=1000, stream=None, burst=5, period=60.0):
+    global _listener, _handler
+
+    q = queue.Queue(queueSize)
+    handler = NonBlockingQueueHandler(q)
+    handler.addFilter(RateLimitFilter(burst, period))
+
+    target = logging.StreamHandler(stream or sys.stdout)
+    target.setFormatter(logging.Formatter(FORMAT))
+
+    root = logging.getLogger(ROOT)
+    root.setLevel(level)
+    root.handlers = [handler]
+    root.propagate = False
+
+    if _listener:
+        _listener.stop()
+    _listener = logging.handlers.QueueListener(q, target)
+    _listener.start()
+    _handler = handler
+    return handler
+
+def shutdown():
+    # flush all the pending records
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
+
+def queueDepth():
+    return _handler.queue.qsize() if _handler else 0
+
+def dropped():
+    return _handler.dropped if _handler else 0
+
+def setLevels(levels):
+    """Change the levels at runtime.
+    :param levels: dict of subsystem name (or "root") and level name
+    """
+    for subsystem, level in levels.items():
+        logger = logging.getLogger(ROOT) if subsystem == "root" else getLogger(subsystem)
+        logger.setLevel(level.upper())
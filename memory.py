@@ -0,0 +1,49 @@
+"""Memory use of the daemon.
+
+The daemon runs for months on a Pi with 1 GB of memory so everything
+growing with the uptime is bounded: the history, the queues of the log
+records, MQTT messages and commands, and the running jobs. To catch what
+was missed the resident set size is exported in the metrics and, with
+--memory_budget, a warning is logged whenever it is over the budget.
+"""
+
+import asyncio
+import os
+
+import log
+import metrics
+
+logger = log.getLogger("memory")
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+def rss():
+    """Return the resident set size in bytes or None if not known."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+RSS = metrics.gauge("rss_bytes", "Resident set size of the daemon.")
+RSS.setFunction(lambda: rss() or 0)
+OVER_BUDGET = metrics.counter(
+    "memory_over_budget_total", "Checks finding the daemon over the memory budget.")
+
+class MemoryMonitor(object):
+    """
+    :param budget: bytes the daemon should fit in
+    """
+
+    def __init__(self, budget, interval=60):
+        self.budget = budget
+        self.interval = interval
+
+    async def run(self):
+        while True:
+            used = rss()
+            if used is not None and used > self.budget:
+                OVER_BUDGET.inc()
+                logger.warning("using %.1f MB, over the budget of %.1f MB",
+                               used / 2**20, self.budget / 2**20)
+            await asyncio.sleep(self.interval)
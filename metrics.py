@@ -0,0 +1,176 @@
+"""Metrics of the daemon exposed in the Prometheus text format.
+
+The metrics are defined once at the module level of the code using them
+and updated in place, i.e.:
+
+    READS = metrics.counter("sensor_reads_total", "Sensor reads.", ("sensor",))
+    READS.labels("dht").inc()
+
+Updating a metric is cheap and thread safe as some of them are updated
+from the MQTT thread.
+"""
+
+import bisect
+import threading
+
+PREFIX = "autoplant_"
+
+# latency buckets (in seconds) good enough for most of what we measure
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _formatLabels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace('"', '\\"'))
+                          for k, v in pairs) + "}"
+
+def _formatValue(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+class _Metric(object):
+    type = None
+
+    def __init__(self, name, help, labelNames=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelNames = tuple(labelNames)
+        self.children = {}
+        self.lock = threading.Lock()
+        if not self.labelNames:
+            self.children[()] = self._newChild()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self._newChild())
+        return child
+
+    def _newChild(self):
+        raise NotImplementedError()
+
+    def __getattr__(self, attr):
+        # metrics without labels can be updated directly
+        if attr != "children" and () in self.children:
+            return getattr(self.children[()], attr)
+        raise AttributeError(attr)
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.help),
+                 "# TYPE {} {}".format(self.name, self.type)]
+        for values, child in list(self.children.items()):
+            lines.extend(child.render(self.name, self.labelNames, values))
+        return lines
+
+class _Value(object):
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        self.value = value
+
+    def setFunction(self, function):
+        # the value will be computed while rendering
+        self.function = function
+
+    def get(self):
+        return self.function() if self.function else self.value
+
+    def render(self, name, labelNames, values):
+        return ["{}{} {}".format(name, _formatLabels(labelNames, values),
+                                 _formatValue(self.get()))]
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _newChild(self):
+        return _Value()
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def _newChild(self):
+        return _Value()
+
+class _HistogramValue(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def render(self, name, labelNames, values):
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            lines.append("{}_bucket{} {}".format(
+                name, _formatLabels(labelNames, values, ("le", _formatValue(bound))), total))
+        labels = _formatLabels(labelNames, values)
+        lines.append("{}_sum{} {}".format(name, labels, _formatValue(self.sum)))
+        lines.append("{}_count{} {}".format(name, labels, total))
+        return lines
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelNames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelNames)
+
+    def _newChild(self):
+        return _HistogramValue(self.buckets)
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        # the same metric can be defined in a few places
+        return self.metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+def counter(name, help, labelNames=()):
+    return REGISTRY.register(Counter(name, help, labelNames))
+
+def gauge(name, help, labelNames=()):
+    return REGISTRY.register(Gauge(name, help, labelNames))
+
+def histogram(name, help, labelNames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, labelNames, buckets))
+
+def handleMetrics(request):
+    return (200, "text/plain; version=0.0.4", REGISTRY.render())
+
+def routes():
+    return {"/metrics": handleMetrics}
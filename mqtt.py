@@ -22,16 +22,42 @@ for this sample.
 """
 
 import argparse
+import asyncio
+import concurrent.futures
 import datetime
 import os
 import random
 import ssl
+import threading
 import time
 import json
 
 import jwt
 import paho.mqtt.client as mqtt
 
+import log
+import metrics
+
+logger = log.getLogger("mqtt")
+
+PUBLISHED = metrics.counter("mqtt_published_total", "Messages published.")
+ACKED = metrics.counter("mqtt_acked_total", "Messages acknowledged by the bridge.")
+INFLIGHT = metrics.gauge("mqtt_inflight", "Messages waiting for PUBACK.")
+DROPPED = metrics.counter(
+    "mqtt_dropped_total", "Messages dropped as too many were queued while disconnected.")
+PUBLISH_LATENCY = metrics.histogram(
+    "mqtt_publish_seconds", "Time from publishing the message until PUBACK.")
+RETRIED = metrics.counter(
+    "mqtt_retried_total", "Messages published again after the session was lost.")
+FAILED = metrics.counter(
+    "mqtt_failed_total", "Messages given up on without PUBACK.", ("reason",))
+
+# status of the delivery
+ACKED_STATUS = "acked"
+DROPPED_STATUS = "dropped"
+EXPIRED_STATUS = "expired"
+RETRIES_EXHAUSTED_STATUS = "retries_exhausted"
+
 # The maximum backoff time before giving up, in seconds.
 MAXIMUM_BACKOFF_TIME = 128
 
@@ -63,8 +89,8 @@ def create_jwt(project_id, private_key_file, algorithm):
     with open(private_key_file, 'r') as f:
         private_key = f.read()
 
-    print('Creating JWT using {} from private key file {}'.format(
-            algorithm, private_key_file))
+    logger.info('Creating JWT using %s from private key file %s',
+            algorithm, private_key_file)
 
     return jwt.encode(token, private_key, algorithm=algorithm)
 
@@ -72,13 +98,63 @@ def error_str(rc):
     """Convert a Paho error to a human readable string."""
     return '{}: {}'.format(rc, mqtt.error_string(rc))
 
+class Delivery(object):
+    """A QoS 1 message until it is acked or given up on.
+
+    The future is resolved with the delivery itself once the status is
+    known: acked (with the latency from the first publish), dropped as the
+    queue was full, expired as no PUBACK came in time or retries_exhausted
+    as the session was lost too many times before PUBACK.
+    """
+
+    __slots__ = ("topic", "payload", "started", "attempts", "mid",
+                 "status", "latency", "future")
+
+    def __init__(self, topic, payload, started, future):
+        self.topic = topic
+        self.payload = payload
+        self.started = started
+        self.attempts = 0
+        self.mid = None
+        self.status = None
+        self.latency = None
+        self.future = future
+
+    @property
+    def acked(self):
+        return self.status == ACKED_STATUS
+
 class Mqtt(object):
-    """Represents the state of a device."""
+    """Represents the state of a device.
 
-    def __init__(self, config):
+    Each publish returns the future of its Delivery; awaitable when the
+    event loop is given. At most `mqtt_inflight` messages wait for PUBACK,
+    the rest are queued by paho. The messages not acked when the client is
+    recreated (i.e. to refresh the JWT) are published again up to
+    `mqtt_retries` times and those not acked within `mqtt_expiry` seconds
+    are given up on.
+    """
+
+    def __init__(self, config, loop=None):
         # Configuration parameters
         self.config = config
         self.publishing_default_topic = '/devices/{}/{}'.format(self.config['device_id'], 'events')
+        self.state_topic = '/devices/{}/{}'.format(self.config['device_id'], 'state')
+        self.config_topic = '/devices/{}/{}'.format(self.config['device_id'], 'config')
+
+        self.loop = loop
+        self.retries = self.config.get('mqtt_retries') or 0
+        self.expiry = self.config.get('mqtt_expiry') or None
+        # deliveries waiting for PUBACK by message id, the oldest first
+        self.pending = {}
+        # PUBACKs received before publish() has recorded the message
+        self.early_acks = {}
+        self.pending_lock = threading.Lock()
+        INFLIGHT.setFunction(lambda: len(self.pending))
+
+        self.message_cb = None
+        self.config_cb = None
+        self.pending_config = None
 
         self.connected = False
         self.should_backoff = True
@@ -94,16 +170,16 @@ class Mqtt(object):
         self.__init_and_connect()
 
         while self.should_backoff:
-            print('will do the backoff')
+            logger.debug('will do the backoff')
 
             # If backoff time is too large, give up.
             if self.minimum_backoff_time > MAXIMUM_BACKOFF_TIME:
-                print('Exceeded maximum backoff time. Giving up.')
+                logger.error('Exceeded maximum backoff time. Giving up.')
                 return
 
             # Otherwise, wait and connect again.
             delay = self.minimum_backoff_time + random.randint(0, 1000) / 1000.0
-            print('Waiting for {} before reconnecting.'.format(delay))
+            logger.info('Waiting for %s before reconnecting.', delay)
             time.sleep(delay)
 
             # Check if something changed after the sleep
@@ -122,8 +198,8 @@ class Mqtt(object):
             # The topic that the device will receive commands on.
             mqtt_command_topic = '/devices/{}/commands/#'.format(self.config['device_id'])
 
-            print('Subscribing to {} and {}'.format(
-                mqtt_config_topic, mqtt_command_topic))
+            logger.info('Subscribing to %s and %s',
+                mqtt_config_topic, mqtt_command_topic)
             self.client.subscribe(mqtt_config_topic, qos=1)
             self.client.subscribe(mqtt_command_topic, qos=0)
 
@@ -133,9 +209,14 @@ class Mqtt(object):
             self.config['cloud_region'], 
             self.config['registry_id'], 
             self.config['device_id'])
-        print('Device client_id is \'{}\''.format(client_id))
+        logger.info('Device client_id is \'%s\'', client_id)
 
         self.client = mqtt.Client(client_id=client_id)
+        # the messages are queued while disconnected; don't let those
+        # take all the memory if the connection is down for days
+        self.client.max_queued_messages_set(self.config.get('mqtt_queue') or 0)
+        if self.config.get('mqtt_inflight'):
+            self.client.max_inflight_messages_set(self.config['mqtt_inflight'])
 
         self.jwt_iat = datetime.datetime.utcnow()
         
@@ -154,14 +235,14 @@ class Mqtt(object):
 
         # Register message callbacks. https://eclipse.org/paho/clients/python/docs/
         # describes additional callbacks that Paho supports. In this example, the
-        # callbacks just print to standard out.
+        # callbacks just log the events.
         self.client.on_connect = self.on_connect
         self.client.on_publish = self.on_publish
         self.client.on_disconnect = self.on_disconnect
         self.client.on_message = self.on_message
 
         # Connect to the Google MQTT bridge.
-        print('Connecting client')
+        logger.info('Connecting client')
         self.client.connect(
             self.config['mqtt_bridge_hostname'], 
             self.config['mqtt_bridge_port'])
@@ -172,15 +253,18 @@ class Mqtt(object):
         # The topic that the device will receive commands on.
         mqtt_command_topic = '/devices/{}/commands/#'.format(self.config['device_id'])
 
-        print('Subscribing to {} and {}'.format(
-            mqtt_config_topic, mqtt_command_topic))
+        logger.info('Subscribing to %s and %s',
+            mqtt_config_topic, mqtt_command_topic)
         self.client.subscribe(mqtt_config_topic, qos=1)
         self.client.subscribe(mqtt_command_topic, qos=0)
 
+        # the new client doesn't know about the messages of the old one
+        self.__resend()
+
     def __check_and_refresh_jwt(self):
         seconds_since_issue = (datetime.datetime.utcnow() - self.jwt_iat).seconds
         if seconds_since_issue > 60 * self.jwt_exp_mins:
-            print('Refreshing token after {}s'.format(seconds_since_issue))
+            logger.info('Refreshing token after %ss', seconds_since_issue)
             self.jwt_iat = datetime.datetime.utcnow()
 
             self.client.disconnect()
@@ -190,51 +274,170 @@ class Mqtt(object):
         # Check if JWT expired
         self.__check_and_refresh_jwt()
         payload = json.dumps({key: value})
-        print('Publishing payload', payload)
+        logger.debug('Publishing payload %s', payload)
         if topic == '':
             topic = self.publishing_default_topic
-        self.client.publish(topic, payload, qos=1)
+        return self.__publish(topic, payload)
+
+    def __future(self):
+        if self.loop:
+            return self.loop.create_future()
+        return concurrent.futures.Future()
+
+    def __publish(self, topic, payload, delivery=None):
+        if delivery is None:
+            delivery = Delivery(topic, payload, time.monotonic(), self.__future())
+        delivery.attempts += 1
+        info = self.client.publish(topic, payload, qos=1)
+        if info.rc == mqtt.MQTT_ERR_QUEUE_SIZE:
+            DROPPED.inc()
+            logger.warning('Too many messages queued; dropping %s', payload)
+            self.__finish(delivery, DROPPED_STATUS)
+            return delivery.future
+        PUBLISHED.inc()
+        delivery.mid = info.mid
+        # PUBACK can be handled on the network thread even before
+        # the publish returns; never hold the lock while calling paho
+        # as it is calling on_publish holding its own lock
+        with self.pending_lock:
+            acked = self.early_acks.pop(info.mid, None)
+            if acked is None:
+                self.pending[info.mid] = delivery
+        if acked is not None:
+            self.__finish(delivery, ACKED_STATUS, acked)
+        return delivery.future
+
+    def __finish(self, delivery, status, now=None):
+        delivery.status = status
+        if status == ACKED_STATUS:
+            delivery.latency = now - delivery.started
+            PUBLISH_LATENCY.observe(delivery.latency)
+        else:
+            FAILED.labels(status).inc()
+        future = delivery.future
+        if isinstance(future, concurrent.futures.Future):
+            future.set_result(delivery)
+        elif self.loop.is_closed():
+            return
+        else:
+            # PUBACKs come from the network thread
+            self.loop.call_soon_threadsafe(
+                lambda: future.done() or future.set_result(delivery))
+
+    def __resend(self):
+        with self.pending_lock:
+            deliveries = list(self.pending.values())
+            self.pending.clear()
+            self.early_acks.clear()
+        for delivery in deliveries:
+            if delivery.attempts > self.retries:
+                logger.warning('Giving up on message %s after %s attempts: %s',
+                               delivery.mid, delivery.attempts, delivery.payload)
+                self.__finish(delivery, RETRIES_EXHAUSTED_STATUS)
+                continue
+            RETRIED.inc()
+            self.__publish(delivery.topic, delivery.payload, delivery)
+
+    def expire(self, now=None):
+        """Give up on the messages not acked in time."""
+        if not self.expiry:
+            return
+        now = time.monotonic() if now is None else now
+        expired = []
+        with self.pending_lock:
+            # in the order of publishing
+            for mid, delivery in self.pending.items():
+                if now - delivery.started < self.expiry:
+                    break
+                expired.append(mid)
+            expired = [self.pending.pop(mid) for mid in expired]
+            # PUBACKs of the messages given up on
+            for mid, acked in list(self.early_acks.items()):
+                if now - acked >= self.expiry:
+                    del self.early_acks[mid]
+        for delivery in expired:
+            logger.warning('No PUBACK for message %s in %ss: %s',
+                           delivery.mid, self.expiry, delivery.payload)
+            self.__finish(delivery, EXPIRED_STATUS)
+
+    async def run(self, interval=10):
+        while True:
+            self.expire()
+            await asyncio.sleep(interval)
+
+    def publish_state(self, state):
+        """Report the device state (i.e. applied configuration version)."""
+        self.__check_and_refresh_jwt()
+        payload = json.dumps(state)
+        logger.info('Publishing state %s', payload)
+        return self.__publish(self.state_topic, payload)
 
     def deinit(self):
         self.client.disconnect()
         self.client.loop_stop()
-        print('Finished loop successfully.')
+        logger.info('Finished loop successfully.')
 
     def on_connect(self, unused_client, unused_userdata, unused_flags, rc):
         """Callback for when a device connects."""
-        print('Connection Result:', error_str(rc))
+        logger.info('Connection Result: %s', error_str(rc))
         self.connected = True
         self.should_backoff = False
         self.minimum_backoff_time = 1
 
     def on_disconnect(self, unused_client, unused_userdata, rc):
         """Callback for when a device disconnects."""
-        print('Disconnected:', error_str(rc))
+        logger.warning('Disconnected: %s', error_str(rc))
         self.connected = False
         self.should_backoff = True
         
         #TODO: check if needed
         # self.client.loop_stop()
 
-    def on_publish(self, unused_client, unused_userdata, unused_mid):
+    def on_publish(self, unused_client, unused_userdata, mid):
         """Callback when the device receives a PUBACK from the MQTT bridge."""
-        print('Published message acked.')
+        now = time.monotonic()
+        ACKED.inc()
+        with self.pending_lock:
+            delivery = self.pending.pop(mid, None)
+            if delivery is None:
+                self.early_acks[mid] = now
+        if delivery is not None:
+            self.__finish(delivery, ACKED_STATUS, now)
+            logger.debug('Published message %s acked after %.3fs: %s',
+                         mid, delivery.latency, delivery.payload)
 
     def on_subscribe(self, unused_client, unused_userdata, unused_mid,
                      granted_qos):
         """Callback when the device receives a SUBACK from the MQTT bridge."""
-        print('Subscribed: ', granted_qos)
+        logger.info('Subscribed: %s', granted_qos)
         if granted_qos[0] == 128:
-            print('Subscription failed.')
+            logger.error('Subscription failed.')
 
     def on_message(self, unused_client, unused_userdata, message):
         """Callback when the device receives a message on a subscription."""
         payload = message.payload.decode('utf-8')
-        print('Received message \'{}\' on topic \'{}\' with Qos {}'.format(
-            payload, message.topic, str(message.qos)))
+        logger.info('Received message \'%s\' on topic \'%s\' with Qos %s',
+            payload, message.topic, message.qos)
 
-        if self.message_cb and payload:
+        if message.topic == self.config_topic:
+            # empty configuration is sent when none is set on the server
+            if not payload:
+                return
+            # the configuration is sent right after subscribing so it
+            # can arrive before the callback is registered
+            if self.config_cb:
+                self.config_cb(payload)
+            else:
+                self.pending_config = payload
+        elif self.message_cb and payload:
             self.message_cb(payload)
 
     def register_cb(self, callback_fn):
         self.message_cb = callback_fn
+
+    def register_config_cb(self, callback_fn):
+        self.config_cb = callback_fn
+        if self.pending_config:
+            payload, self.pending_config = self.pending_config, None
+            callback_fn(payload)
+
@@ -0,0 +1,159 @@
+"""Opt-in profiling of the running daemon.
+
+Enabled from the start with --profile or toggled at any time with SIGUSR1
+(`systemctl kill -s USR1 autoplant`). While enabled, every interval a
+snapshot directory is written to the profile directory with:
+
+    profile.pstats      cProfile of the event loop thread since the last snapshot
+    tracemalloc.txt     allocations that grew the most since the last snapshot
+    coroutines.json     CPU time spent in each coroutine (and loop callback)
+
+Only the last `keep` snapshots are kept. While disabled nothing is hooked
+so there is no overhead.
+"""
+
+import asyncio
+import cProfile
+import json
+import os
+import shutil
+import time
+import tracemalloc
+
+import clock
+import log
+import metrics
+
+logger = log.getLogger("profiler")
+
+PROFILING = metrics.gauge("profiling", "1 if the profiling is enabled.")
+SNAPSHOTS = metrics.counter("profile_snapshots_total", "Profile snapshots written.")
+
+TOP_ALLOCATIONS = 25
+# the allocations of the profiling itself
+IGNORED = (tracemalloc.__file__, cProfile.__file__, "<frozen importlib._bootstrap>")
+
+class Profiler(object):
+    """
+    :param interval: seconds between the snapshots
+    :param keep: number of snapshots to keep in the directory
+    """
+
+    def __init__(self, loop, directory, interval=600, keep=24, frames=5):
+        self.loop = loop
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+        self.frames = frames
+        self.enabled = False
+        self.profile = None
+        self.allocations = None
+        self.cpu = {}
+        self.timer = None
+        self.originalRun = None
+
+    def toggle(self):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        PROFILING.set(1)
+        logger.info("profiling into %s every %s seconds", self.directory, self.interval)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self.allocations = tracemalloc.take_snapshot()
+        self._hookCallbacks()
+        self._startProfile()
+        self.timer = self.loop.call_later(self.interval, self._rotate)
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.timer.cancel()
+        # keep what was collected till now
+        self.snapshot()
+        self.profile.disable()
+        self._unhookCallbacks()
+        tracemalloc.stop()
+        self.profile = self.allocations = None
+        self.enabled = False
+        PROFILING.set(0)
+        logger.info("profiling disabled")
+
+    def _startProfile(self):
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def _hookCallbacks(self):
+        # each task step and callback is run by Handle._run so measuring
+        # it gives the CPU time per coroutine
+        cpu = self.cpu
+        originalRun = self.originalRun = asyncio.Handle._run
+
+        def run(handle):
+            started = time.thread_time()
+            try:
+                originalRun(handle)
+            finally:
+                callback = handle._callback
+                task = getattr(callback, "__self__", None)
+                if isinstance(task, asyncio.Task):
+                    name = task.get_coro().__qualname__
+                else:
+                    name = getattr(callback, "__qualname__", repr(callback))
+                entry = cpu.get(name)
+                if entry is None:
+                    entry = cpu[name] = [0.0, 0]
+                entry[0] += time.thread_time() - started
+                entry[1] += 1
+
+        asyncio.Handle._run = run
+
+    def _unhookCallbacks(self):
+        asyncio.Handle._run = self.originalRun
+        self.originalRun = None
+
+    def _rotate(self):
+        self.snapshot()
+        self.timer = self.loop.call_later(self.interval, self._rotate)
+
+    def snapshot(self):
+        """Write the data collected since the last snapshot."""
+        path = os.path.join(self.directory, clock.now().strftime("%Y%m%d-%H%M%S"))
+        try:
+            os.makedirs(path, exist_ok=True)
+            self.profile.disable()
+            self.profile.dump_stats(os.path.join(path, "profile.pstats"))
+            self._startProfile()
+
+            allocations = tracemalloc.take_snapshot()
+            with open(os.path.join(path, "tracemalloc.txt"), "w") as f:
+                current, peak = tracemalloc.get_traced_memory()
+                f.write("traced: {} B, peak: {} B\n".format(current, peak))
+                # filtering the stats is much cheaper than filtering the traces
+                stats = [stat for stat in allocations.compare_to(self.allocations, "lineno")
+                         if stat.traceback[0].filename not in IGNORED]
+                for stat in stats[:TOP_ALLOCATIONS]:
+                    f.write("{}\n".format(stat))
+            self.allocations = allocations
+
+            with open(os.path.join(path, "coroutines.json"), "w") as f:
+                json.dump({name: {"cpu_seconds": round(seconds, 6), "steps": steps}
+                           for name, (seconds, steps) in sorted(
+                               self.cpu.items(), key=lambda item: -item[1][0])}, f, indent=1)
+            self.cpu.clear()
+        except OSError as e:
+            logger.error("can not write profile snapshot: %s", e)
+            return
+        SNAPSHOTS.inc()
+        self._prune()
+
+    def _prune(self):
+        snapshots = sorted(os.listdir(self.directory))
+        for name in snapshots[:-self.keep]:
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
@@ -0,0 +1,173 @@
+"""Replay of the recorded traces (see tracing.py).
+
+The daemon is run on the virtual clock starting at the time the trace was
+recorded, with its configuration, while the sensors return the recorded
+samples (failing where those failed), the level switch changes when it
+did and the recorded commands and configuration pushes are handled as if
+received over MQTT. The jobs and relay transitions of the replay are
+recorded again and compared with the original ones:
+
+    python3 replay.py autoplant-trace.jsonl.gz
+
+As it runs faster than real time and always the same way, a recorded day
+can be used as a regression test or to profile the control logic, i.e.:
+
+    python3 -m cProfile -s cumtime replay.py autoplant-trace.jsonl.gz
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+import log
+import sensors
+import simulation
+import tracing
+
+logger = log.getLogger("replay")
+
+# the jobs and relays are compared with this tolerance
+TOLERANCE = 1.0
+
+class ReplayDevice(object):
+    """Sensor returning the recorded samples one by one; the same object
+    serves as DHT (`temperature`, `humidity`) and soil sensor."""
+
+    def __init__(self, samples):
+        self.samples = samples
+        self.current = {}
+        self.reads = 0
+        self.failures = 0
+
+    def _next(self):
+        self.reads += 1
+        if self.samples:
+            values, error = self.samples.pop(0)
+            if values is None:
+                self.failures += 1
+                raise RuntimeError(error)
+            self.current = values
+        return self.current
+
+    @property
+    def temperature(self):
+        return self._next()["temp"]
+
+    @property
+    def humidity(self):
+        # read together with the temperature
+        return self.current["humid"]
+
+    def moisture_read(self):
+        return self._next()["soil"]
+
+class ReplayLevel(object):
+    """Level switch changing at the recorded times."""
+
+    def __init__(self, loop, changes):
+        self.loop = loop
+        self.value = changes[0][1] if changes else False
+        self.callbacks = []
+        for when, value in changes[1:]:
+            loop.call_at(when, self._change, value)
+
+    def _change(self, value):
+        self.value = value
+        for callback in self.callbacks:
+            callback()
+
+    def addEdgeCallback(self, callback):
+        self.callbacks.append(callback)
+
+class ReplayBackend(simulation.SimulatedBackend):
+
+    name = "replay"
+
+    def __init__(self, trace):
+        self.header, self.records = tracing.read(trace)
+        super().__init__(start=datetime.fromtimestamp(self.header["start"]))
+
+    def initDevices(self):
+        devices = super().initDevices()
+        config = self.header["config"]
+        samples = {}
+        for record in self.records:
+            if record[1] == tracing.SAMPLE:
+                samples.setdefault(record[2], []).append(
+                    (record[3], record[4] if len(record) > 4 else None))
+
+        # the samples are recorded by the sensor name
+        for name, options in sensors.sensorsConfig(
+                config.get("sensors", {}), config["sampling"]).items():
+            device = options.get("device", name)
+            if name in samples and device in ("dht", "soil"):
+                devices[device] = self.devices[device] = ReplayDevice(samples[name])
+        if "soil" not in samples:
+            devices["soil"] = None
+
+        changes = [(record[0], bool(record[2])) for record in self.records
+                   if record[1] == tracing.LEVEL]
+        devices["level"] = self.devices["level"] = ReplayLevel(self.loop, changes)
+        return devices
+
+    def attach(self, loop, commandHandler, configHandler=None):
+        for record in self.records:
+            if record[1] == tracing.COMMAND:
+                loop.call_at(record[0], commandHandler, record[2])
+            elif record[1] == tracing.CONFIG and configHandler:
+                loop.call_at(record[0], configHandler, record[2])
+        end = self.records[-1][0] if self.records else 0
+        loop.call_at(end + TOLERANCE, loop.stop)
+
+def events(records):
+    # what the daemon did
+    return [record for record in records if record[1] in (tracing.DISPATCH, tracing.RELAY)]
+
+def compare(expected, actual):
+    """Return None if the replay did the same as the original or the
+    description of the first difference."""
+    for i, (old, new) in enumerate(zip(expected, actual)):
+        if old[1:] != new[1:] or abs(old[0] - new[0]) > TOLERANCE:
+            return "event {}: recorded {}, replayed {}".format(i, old, new)
+    if len(expected) != len(actual):
+        return "recorded {} events, replayed {}".format(len(expected), len(actual))
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay the recorded trace.')
+    parser.add_argument('trace', help='Trace recorded with --trace_file.')
+    parser.add_argument('--output', help='Where to record the replay.')
+    parser.add_argument('--log_level', default='WARNING',
+        choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'))
+    args = parser.parse_args()
+
+    # imported here so that replay can be imported by the daemon
+    import autoplant
+
+    header, records = tracing.read(args.trace)
+    with tempfile.TemporaryDirectory() as tmp:
+        configFile = os.path.join(tmp, "config.json")
+        with open(configFile, "w") as f:
+            json.dump(header["config"], f)
+        output = args.output or os.path.join(tmp, "replay.jsonl")
+
+        log.setup(args.log_level)
+        autoplant.run(autoplant.parse_command_line_args([
+            '--backend=replay', '--replay_file=' + args.trace,
+            '--config_file=' + configFile, '--state_file=',
+            '--trace_file=' + output]))
+        _, replayed = tracing.read(output)
+
+    expected, actual = events(records), events(replayed)
+    difference = compare(expected, actual)
+    if difference:
+        print("replay differs: " + difference)
+        sys.exit(1)
+    print("replayed {} jobs and relay transitions over {:.0f} s".format(
+        len(actual), records[-1][0] if records else 0))
+
+if __name__ == '__main__':
+    main()
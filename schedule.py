@@ -4,48 +4,73 @@ import os
 from croniter import croniter
 from datetime import datetime
 
-def readCron(cronFile):
+import clock
+import log
+
+logger = log.getLogger("schedule")
+
+def parseEntry(line, base, previous=False):
+    # returns None for comments and empty lines and raises
+    # ValueError if the entry is not a valid job
+    # if previous is set the last fire time before base is returned
+    # instead of the next one
+    line = line.rstrip()
+    if line.startswith('#') or not line.strip():
+        return None
+
+    # split the line so that we have a command
+    # and the actual schedule separated
+    #
+    # IMPORTANT: we support cron entries
+    # without seconds field only with additional
+    # one or more command fields
+    data = line.split(' ')
+    if len(data) < 6:
+        raise ValueError('invalid lenght of cron entry')
+    sched = ' '.join(data[:5])
+    cmd = data[5:]
+
+    # check if the entry is valid
+    if not croniter.is_valid(sched):
+        raise ValueError('invalid cron schedule [{}]'.format(sched))
+
+    # next will return the next entry
+    # that we will need to fire as the datetime object
+    it = croniter(sched, base)
+    next = it.get_prev(datetime) if previous else it.get_next(datetime)
+    return (next, cmd[0], cmd[1:])
+
+def parseCron(lines, base=None):
+    # lines can be an open file or a list of entries (i.e. from the
+    # configuration pushed over MQTT)
     # we can skip time zones for now
-    base = datetime.now()
+    if base is None:
+        base = clock.now()
     entries = []
-    with open(cronFile) as f:
-         for line in f:
-            print("line content: {}".format(line.rstrip()))
-            # skip comments
-            if line.startswith('#'):
-                continue
-
-            # split the line so that we have a command 
-            # and the actual schedule separated
-            #
-            # IMPORTANT: we support cron entries 
-            # without seconds field only with additional
-            # one or more command fields
-            try:
-                data = line.rstrip().split(' ')
-                if len(data) < 6:
-                    raise Exception('invalid lenght of cron entry')
-                sched = ' '.join(data[:5])
-                cmd = data[5:]
-            except Exception as e:
-                print("[{}]: invalid entry: {}".format(line.rstrip(), e))
-                continue
-
-            # check if the entry is valid
-            if croniter.is_valid(sched):
-                print("have valid cron entry [{}]".format(sched))
-                # next will return the next entry  
-                # that we will need to fire as the datetime object
-                next = croniter(sched, base).get_next(datetime)
-                entries.append((next, cmd[0], cmd[1:]))
+    for line in lines:
+        logger.debug("line content: %s", line.rstrip())
+        try:
+            entry = parseEntry(line, base)
+        except ValueError as e:
+            logger.warning("[%s]: invalid entry: %s", line.rstrip(), e)
+            continue
+        if entry:
+            logger.debug("have valid cron entry [%s]", line.rstrip())
+            entries.append(entry)
     return entries
 
-def getNextJobs(cronFile):
-    data = readCron(cronFile)
+def readCron(cronFile, base=None):
+    with open(cronFile) as f:
+        return parseCron(f, base)
+
+def getNextJobs(lines, base=None):
+    data = parseCron(lines, base)
+    if not data:
+        return []
     data.sort()
 
-    # if we have multiple jobs scheduled to 
-    # happen the same time we should return all 
+    # if we have multiple jobs scheduled to
+    # happen the same time we should return all
     jobs = [data[0]]
     for job in data[1:]:
         if job[0] == jobs[0][0]:
@@ -54,8 +79,66 @@ def getNextJobs(cronFile):
             break
     return jobs
 
+class NextJobs(object):
+    """getNextJobs() remembered until the schedule changes or the jobs are
+    getting close so that the schedule is not parsed every minute."""
+
+    def __init__(self, margin=120):
+        self.margin = margin
+        self.lines = None
+        self.base = None
+        self.jobs = []
+
+    def get(self, lines, now=None):
+        if now is None:
+            now = clock.now()
+        # also if the clock was moved back
+        if (lines != self.lines or not self.jobs or now < self.base
+                or (self.jobs[0][0] - now).total_seconds() < self.margin):
+            self.lines, self.base = lines, now
+            self.jobs = getNextJobs(lines, now)
+        return self.jobs
+
+def getUpcomingJobs(lines, until, base=None, limit=100):
+    # all the jobs starting before `until`, in order
+    if base is None:
+        base = clock.now()
+    upcoming = []
+    for line in lines:
+        try:
+            entry = parseEntry(line, base)
+        except ValueError:
+            continue
+        if not entry:
+            continue
+        # the entry is valid so we can iterate over its schedule
+        it = croniter(' '.join(line.split(' ')[:5]), base)
+        for _ in range(limit):
+            when = it.get_next(datetime)
+            if when >= until:
+                break
+            upcoming.append((when, entry[1], entry[2]))
+    upcoming.sort()
+    return upcoming[:limit]
+
+def getMissedJobs(lines, since, base=None):
+    # jobs that should have been started after `since` but were not,
+    # i.e. as the daemon was not running
+    if base is None:
+        base = clock.now()
+    missed = []
+    for line in lines:
+        try:
+            entry = parseEntry(line, base, previous=True)
+        except ValueError:
+            continue
+        if entry and since < entry[0] <= base:
+            missed.append(entry)
+    missed.sort()
+    return missed
+
 # for testing
 if __name__ == '__main__':
    data = readCron(sys.argv[1])
    data.sort()
-   print(data)
\ No newline at end of file
+   print(data)
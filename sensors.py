@@ -0,0 +1,337 @@
+"""Sensor plugins and the polling engine reading them.
+
+Each kind of sensor is a plugin (a `Sensor` subclass registered with
+`@plugin`) knowing how to read the device and what quantities and units it
+provides. The sensors are created from the "sensors" section of the
+configuration, i.e.:
+
+    "sensors": {
+        "dht": {"type": "dht", "interval": 60, "samples": 5, "filter": "trimmed_mean"},
+        "soil": {"type": "soil", "interval": 300},
+        "level": null
+    }
+
+The name is also the name of the device (unless given with "device") and
+`null` removes the sensor. Without the section the DHT, soil and level
+sensors are read with the "sampling" settings.
+
+All the sensors are read by a single `PollingEngine` task. The sensors due
+at about the same time are read together; the ones sharing a bus (i.e. the
+soil sensor sitting on the same I2C bus as the LCD) one after another while
+holding the bus lock once per sample. The readings of each round are passed
+to the consumers as a list of `Reading`s.
+"""
+
+import asyncio
+import time
+
+import clock
+import log
+import metrics
+
+logger = log.getLogger("sensors")
+
+SENSOR_READ_TIME = metrics.histogram(
+    "sensor_read_seconds", "Time spent in a single sensor read.", ("sensor",))
+SENSOR_READS = metrics.counter("sensor_reads_total", "Sensor reads.", ("sensor",))
+SENSOR_FAILURES = metrics.counter(
+    "sensor_read_failures_total", "Failed sensor reads.", ("sensor",))
+MEASUREMENT_TIME = metrics.histogram(
+    "measurement_cycle_seconds", "Duration of the whole measurement cycle.")
+
+def mean(values):
+    return sum(values) / len(values)
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+def trimmedMean(values):
+    # as the single measurment is not always accurate
+    # take the average excluding max and min values
+    if len(values) >= 3:
+        values = sorted(values)[1:-1]
+    return mean(values)
+
+def last(values):
+    return values[-1]
+
+FILTERS = {
+    "mean": mean,
+    "median": median,
+    "trimmed_mean": trimmedMean,
+    "last": last,
+}
+
+class Reading(object):
+
+    # there are several of those every minute
+    __slots__ = ("sensor", "quantity", "value", "unit", "timestamp")
+
+    def __init__(self, sensor, quantity, value, unit, timestamp):
+        self.sensor = sensor
+        self.quantity = quantity
+        # None if all the reads failed
+        self.value = value
+        self.unit = unit
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return "Reading({}.{}={}{})".format(self.sensor, self.quantity, self.value, self.unit)
+
+class Sensor(object):
+    """Base of the sensor plugins.
+    :param interval: seconds between the measurements
+    :param samples: reads combined by the filter into one measurement
+    :param spacing: seconds between the samples
+    """
+
+    kind = None
+    # quantity: unit
+    units = {}
+    # sensors on the same bus are never read concurrently
+    bus = None
+    # errors meaning the read failed and should be retried with the next sample
+    errors = (RuntimeError, OSError)
+    defaults = {"samples": 1, "spacing": 1.0, "filter": "last"}
+
+    def __init__(self, name, device, interval=60, samples=None, spacing=None, filter=None):
+        self.name = name
+        self.device = device
+        self.interval = interval
+        self.samples = samples or self.defaults["samples"]
+        self.spacing = self.defaults["spacing"] if spacing is None else spacing
+        self.filter = FILTERS[filter or self.defaults["filter"]]
+
+    def read(self):
+        """Read the device once; return dict of the quantities."""
+        raise NotImplementedError()
+
+    def format(self, quantity, value):
+        # value as published
+        return value
+
+PLUGINS = {}
+
+def plugin(cls):
+    PLUGINS[cls.kind] = cls
+    return cls
+
+@plugin
+class DHTSensor(Sensor):
+
+    kind = "dht"
+    units = {"temp": "C", "humid": "%"}
+    defaults = {"samples": 5, "spacing": 1.0, "filter": "trimmed_mean"}
+
+    def read(self):
+        # read both first so that the samples are always complete
+        temp, humid = self.device.temperature, self.device.humidity
+        return {"temp": temp, "humid": humid}
+
+@plugin
+class SoilSensor(Sensor):
+    """STEMMA soil sensor (adafruit_seesaw)."""
+
+    kind = "soil"
+    units = {"soil": ""}
+    bus = "i2c"
+
+    def read(self):
+        return {"soil": self.device.moisture_read()}
+
+@plugin
+class LevelSensor(Sensor):
+    """State of the debounced level switch (levelsensor.LevelMonitor)."""
+
+    kind = "level"
+    units = {"level": ""}
+    errors = ()
+
+    def read(self):
+        return {"level": 1 if self.device.empty else 0}
+
+    def format(self, quantity, value):
+        return "empty" if value else "full"
+
+def defaultConfig(sampling):
+    return {
+        "dht": {"type": "dht", "interval": sampling["interval"],
+                "samples": sampling["samples"]},
+        "soil": {"type": "soil", "interval": sampling["interval"]},
+        "level": {"type": "level", "device": "levelMonitor",
+                  "interval": sampling["interval"]},
+    }
+
+def sensorsConfig(configured, sampling):
+    # the defaults updated with the configured sensors
+    merged = defaultConfig(sampling)
+    for name, options in configured.items():
+        if options is None:
+            merged.pop(name, None)
+        else:
+            merged[name] = dict(merged.get(name, {}), **options)
+    return merged
+
+def createSensors(configured, sampling, devices):
+    """Create the sensors for the configuration; the ones without the
+    device (i.e. soil sensor not connected) are left out."""
+    created = []
+    for name, options in sensorsConfig(configured, sampling).items():
+        options = dict(options)
+        cls = PLUGINS[options.pop("type", name)]
+        device = devices.get(options.pop("device", name))
+        if device is None:
+            logger.info("no device for sensor %s", name)
+            continue
+        created.append(cls(name, device, **options))
+    return created
+
+class PollingEngine(object):
+    """
+    :param coalesce: sensors due within this many seconds are read together
+    """
+
+    def __init__(self, loop, coalesce=1.0):
+        self.loop = loop
+        self.coalesce = coalesce
+        self.sensors = {}
+        self.due = {}
+        self.consumers = []
+        self.sampleListeners = []
+        self.busLocks = {}
+        self.wakeup = asyncio.Event()
+
+    def configure(self, sensors, external=()):
+        """
+        :param external: sensors read elsewhere (see acquisition.py) whose
+                         readings are passed in with `deliver()`
+        """
+        # all the sensors are read straight away with the new settings
+        self.sensors = {sensor.name: sensor for sensor in list(sensors) + list(external)}
+        self.due = {sensor.name: self.loop.time() for sensor in sensors}
+        self.wakeup.set()
+        logger.info("sensors: %s", ", ".join(sorted(self.sensors)))
+
+    def addConsumer(self, consumer):
+        # consumer is called with the list of readings of each round
+        self.consumers.append(consumer)
+
+    def addSampleListener(self, listener):
+        # listener is called with the sensor name, each raw sample
+        # and the error (sample is None) if the read failed
+        self.sampleListeners.append(listener)
+
+    def busLock(self, bus):
+        """Lock to hold while using the bus; i.e. while writing to the LCD."""
+        lock = self.busLocks.get(bus)
+        if lock is None:
+            lock = self.busLocks[bus] = asyncio.Lock()
+        return lock
+
+    def format(self, reading):
+        """Return the value of the reading as published."""
+        sensor = self.sensors.get(reading.sensor)
+        if sensor is None or reading.value is None:
+            # removed since the reading was delivered
+            return reading.value
+        return sensor.format(reading.quantity, reading.value)
+
+    def trigger(self, name):
+        """Read the sensor now, i.e. when it has changed."""
+        if name in self.due:
+            self.due[name] = self.loop.time()
+            self.wakeup.set()
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            now = self.loop.time()
+            due = [self.sensors[name] for name, when in self.due.items()
+                   if when <= now + self.coalesce]
+            if not due:
+                timeout = min(self.due.values()) - now if self.due else None
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            for sensor in due:
+                self.due[sensor.name] = now + sensor.interval
+            await self.poll(due)
+
+    async def poll(self, due):
+        """Read the given sensors once and pass the readings to the consumers."""
+        started = clock.monotonic()
+        # the sensors on the same bus are read as a group,
+        # the rest concurrently
+        groups = {}
+        for sensor in due:
+            groups.setdefault(sensor.bus or "sensor:" + sensor.name, []).append(sensor)
+        results = await asyncio.gather(*(self._readGroup(group) for group in groups.values()))
+        readings = [reading for result in results for reading in result]
+        MEASUREMENT_TIME.observe(clock.monotonic() - started)
+        self.deliver(readings)
+        return readings
+
+    def deliver(self, readings):
+        """Pass the readings to the consumers."""
+        # the sensors removed by the configuration while being read
+        readings = [reading for reading in readings if reading.sensor in self.sensors]
+        if not readings:
+            return
+        for consumer in self.consumers:
+            try:
+                consumer(readings)
+            except Exception as e:
+                logger.exception("readings consumer failed: %s", e)
+
+    async def _readGroup(self, group):
+        bus = group[0].bus
+        samples = {sensor.name: [] for sensor in group}
+        for i in range(max(sensor.samples for sensor in group)):
+            if i:
+                await asyncio.sleep(max(sensor.spacing for sensor in group))
+            reading = [sensor for sensor in group if i < sensor.samples]
+            if bus:
+                async with self.busLock(bus):
+                    self._sample(reading, samples)
+            else:
+                self._sample(reading, samples)
+
+        timestamp = clock.now().timestamp()
+        readings = []
+        for sensor in group:
+            for quantity, unit in sensor.units.items():
+                values = [sample[quantity] for sample in samples[sensor.name]]
+                value = sensor.filter(values) if values else None
+                readings.append(Reading(sensor.name, quantity, value, unit, timestamp))
+        return readings
+
+    def _sample(self, group, samples):
+        for sensor in group:
+            SENSOR_READS.labels(sensor.name).inc()
+            started = time.perf_counter()
+            try:
+                values, error = sensor.read(), None
+            except sensor.errors as e:
+                values, error = None, e
+                logger.warning("%s read failed: %s", sensor.name, error)
+            except Exception as e:
+                # a bug in one driver must not stop all the sensors
+                values, error = None, e
+                logger.exception("%s read failed: %s", sensor.name, error)
+            SENSOR_READ_TIME.labels(sensor.name).observe(time.perf_counter() - started)
+            if error is None:
+                samples[sensor.name].append(values)
+            else:
+                SENSOR_FAILURES.labels(sensor.name).inc()
+            for listener in self.sampleListeners:
+                try:
+                    listener(sensor.name, values, error)
+                except Exception as e:
+                    logger.exception("sample listener failed: %s", e)
@@ -0,0 +1,357 @@
+"""Simulated hardware running on a virtual clock.
+
+The event loop of the simulated backend never sleeps; whenever it would
+wait for the next timer it moves the virtual clock forward instead. Thanks
+to that a week of the daemon runtime takes only seconds, i.e.:
+
+    python3 autoplant.py --backend=sim --run_for=604800
+"""
+
+import asyncio
+import collections
+import math
+import random
+import selectors
+import uuid
+from datetime import datetime, timedelta
+
+import clock
+import hal
+import log
+
+logger = log.getLogger("sim")
+
+class VirtualClock(object):
+    """Clock that is only moving forward when told to."""
+
+    def __init__(self, start=None):
+        self.start = start or datetime.now().replace(microsecond=0)
+        self.elapsed = 0.0
+        # each virtual clock is a new "boot"
+        self.boot = str(uuid.uuid4())
+
+    def now(self):
+        return self.start + timedelta(seconds=self.elapsed)
+
+    def monotonic(self):
+        return self.elapsed
+
+    def bootId(self):
+        return self.boot
+
+    def advance(self, seconds):
+        self.elapsed += seconds
+
+class _VirtualSelector(selectors.DefaultSelector):
+    # instead of blocking until the timeout expires advance the clock
+
+    def __init__(self, virtualClock):
+        super().__init__()
+        self.clock = virtualClock
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if events or timeout == 0:
+            return events
+        if timeout is None:
+            # nothing is scheduled; we can only wait for other threads
+            return super().select(None)
+        self.clock.advance(timeout)
+        return []
+
+class VirtualTimeEventLoop(asyncio.SelectorEventLoop):
+    """Event loop whose time is driven by VirtualClock."""
+
+    def __init__(self, virtualClock):
+        self.clock = virtualClock
+        super().__init__(_VirtualSelector(virtualClock))
+
+    def time(self):
+        return self.clock.monotonic()
+
+class SimulatedRelay(object):
+    """Active low relay recording all its transitions."""
+
+    def __init__(self, name, virtualClock, onChange=None):
+        self.name = name
+        self.clock = virtualClock
+        # called just before the state changes
+        self.listeners = [onChange] if onChange else []
+        self._value = True
+        self.timeline = []
+
+    def addListener(self, listener):
+        self.listeners.append(listener)
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        if value == self._value:
+            return
+        for listener in self.listeners:
+            listener(self, value)
+        self._value = value
+        self.timeline.append((self.clock.now(), value))
+
+    def onTime(self):
+        # total number of seconds the relay was switched on
+        total = 0.0
+        since = None
+        for when, value in self.timeline:
+            if not value:
+                since = when
+            elif since is not None:
+                total += (when - since).total_seconds()
+                since = None
+        if since is not None:
+            total += (self.clock.now() - since).total_seconds()
+        return total
+
+class SimulatedTank(object):
+    """Water tank drained while the pump is running.
+
+    The level switch edges are delivered exactly when the tank runs dry
+    or is refilled using the timers of the virtual loop.
+    """
+
+    def __init__(self, loop, virtualClock, capacity=20.0, flow=0.05, refillEvery=None):
+        self.loop = loop
+        self.clock = virtualClock
+        self.capacity = capacity
+        # liters per second pumped out
+        self.flow = flow
+        self.refillEvery = refillEvery
+        self.liters = capacity
+        self.pumping = False
+        self.updated = virtualClock.monotonic()
+        self.drained = None
+        self.callbacks = []
+        if refillEvery:
+            loop.call_later(refillEvery, self.refill)
+
+    def update(self):
+        now = self.clock.monotonic()
+        if self.pumping:
+            self.liters = max(0.0, self.liters - (now - self.updated) * self.flow)
+        self.updated = now
+
+    def _schedule(self):
+        if self.drained:
+            self.drained.cancel()
+            self.drained = None
+        if self.pumping and self.liters > 0:
+            self.drained = self.loop.call_later(self.liters / self.flow, self._drain)
+
+    def _drain(self):
+        self.drained = None
+        self.update()
+        self.liters = 0.0
+        self._notify()
+
+    def _notify(self):
+        for callback in self.callbacks:
+            callback()
+
+    def refill(self):
+        self.update()
+        wasEmpty = self.empty
+        self.liters = self.capacity
+        self._schedule()
+        if wasEmpty:
+            self._notify()
+        self.loop.call_later(self.refillEvery, self.refill)
+
+    def onPump(self, relay, value):
+        # called just before the pump relay changes its state
+        self.update()
+        self.pumping = not value
+        self._schedule()
+
+    @property
+    def empty(self):
+        self.update()
+        return self.liters <= 0.0
+
+class SimulatedLevel(object):
+    """Level switch of the tank; `True` means empty."""
+
+    def __init__(self, tank):
+        self.tank = tank
+
+    @property
+    def value(self):
+        return self.tank.empty
+
+    def addEdgeCallback(self, callback):
+        self.tank.callbacks.append(callback)
+
+class SimulatedDHT(object):
+    """DHT11 following daily temperature and humidity cycle.
+
+    :param failureRate: probability of single read failing with RuntimeError
+        the same way the real sensor does
+    """
+
+    def __init__(self, virtualClock, failureRate=0.1, seed=0):
+        self.clock = virtualClock
+        self.failureRate = failureRate
+        self.random = random.Random(seed)
+        self.reads = 0
+        self.failures = 0
+
+    def _read(self, mean, amplitude):
+        self.reads += 1
+        if self.random.random() < self.failureRate:
+            self.failures += 1
+            raise RuntimeError("A full buffer was not returned. Try again.")
+        now = self.clock.now()
+        hour = now.hour + now.minute / 60.0
+        # warmest at 15:00
+        value = mean + amplitude * math.cos((hour - 15) / 24.0 * 2 * math.pi)
+        # DHT11 resolution is one unit
+        return float(round(value + self.random.uniform(-1, 1)))
+
+    @property
+    def temperature(self):
+        return self._read(22.0, 4.0)
+
+    @property
+    def humidity(self):
+        return self._read(50.0, -10.0)
+
+class SimulatedSoil(object):
+    """STEMMA soil sensor in the pot watered by the pump.
+
+    The soil is drying out towards `dry` with the given half-life. The
+    pumped water is not reaching the sensor immediately; it is soaking in
+    with the `soak` time constant.
+    """
+
+    def __init__(self, virtualClock, moisture=500.0, dry=300.0, halfLife=12 * 3600,
+                 perSecond=3.0, soak=30.0):
+        self.clock = virtualClock
+        self.moisture = moisture
+        self.dry = dry
+        self.decay = math.log(2) / halfLife
+        # moisture units added per second of pumping
+        self.perSecond = perSecond
+        self.soak = soak
+        self.soaking = 0.0
+        self.pumping = False
+        self.updated = virtualClock.monotonic()
+
+    def update(self):
+        now = self.clock.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        if elapsed <= 0:
+            return
+        if self.pumping:
+            self.soaking += elapsed * self.perSecond
+        absorbed = self.soaking * (1 - math.exp(-elapsed / self.soak))
+        self.soaking -= absorbed
+        self.moisture = self.dry + (self.moisture - self.dry) * math.exp(-self.decay * elapsed)
+        self.moisture += absorbed
+
+    def onPump(self, relay, value):
+        self.update()
+        self.pumping = not value
+
+    def moisture_read(self):
+        # the same interface as adafruit_seesaw
+        self.update()
+        return int(self.moisture)
+
+class SimulatedLCD(object):
+    """Character LCD capturing the displayed frames."""
+
+    def __init__(self, virtualClock, columns=16, lines=2):
+        self.clock = virtualClock
+        self.columns = columns
+        self.lines = lines
+        self.backlight = True
+        self._message = ""
+        self.rows = [" " * columns] * lines
+        self.column = self.row = 0
+        # only the recent ones so that the long simulations don't run out of memory
+        self.frames = collections.deque(maxlen=1000)
+        self.frameCount = 0
+
+    def clear(self):
+        self._message = ""
+        self.rows = [" " * self.columns] * self.lines
+
+    def cursor_position(self, column, row):
+        self.column, self.row = column, row
+
+    @property
+    def message(self):
+        return self._message
+
+    @message.setter
+    def message(self, message):
+        # written from the cursor position as on the real LCD
+        self._message = message
+        column = self.column
+        for row, text in enumerate(message.split("\n"), self.row):
+            if row < self.lines:
+                line = self.rows[row]
+                self.rows[row] = (line[:column] + text + line[column + len(text):])[:self.columns]
+        self.column = self.row = 0
+        self.frames.append((self.clock.now(), "\n".join(self.rows)))
+        self.frameCount += 1
+
+class SimulatedBackend(hal.Backend):
+    """Simulated devices on the virtual clock."""
+
+    name = "sim"
+
+    def __init__(self, start=None, failureRate=0.1, refillEvery=86400, seed=0):
+        self.clock = VirtualClock(start)
+        # the loop is needed by the simulated devices
+        self.loop = VirtualTimeEventLoop(self.clock)
+        self.failureRate = failureRate
+        self.refillEvery = refillEvery
+        self.seed = seed
+        self.devices = None
+        clock.install(self.clock)
+
+    def initDevices(self):
+        tank = SimulatedTank(self.loop, self.clock, refillEvery=self.refillEvery)
+        soil = SimulatedSoil(self.clock)
+        pump = SimulatedRelay("pump", self.clock, tank.onPump)
+        pump.addListener(soil.onPump)
+        self.devices = {
+            "pump": pump,
+            "soil": soil,
+            "lamp": SimulatedRelay("lamp", self.clock),
+            "display": SimulatedLCD(self.clock),
+            "level": SimulatedLevel(tank),
+            "dht": SimulatedDHT(self.clock, self.failureRate, self.seed),
+            "tank": tank,
+        }
+        # the daemon can wrap the devices in its copy
+        return dict(self.devices)
+
+    def createEventLoop(self):
+        return self.loop
+
+    def createRelay(self, pin):
+        relay = SimulatedRelay(pin, self.clock)
+        self.devices[pin] = relay
+        return relay
+
+    def close(self):
+        if not self.devices:
+            return
+        dht = self.devices["dht"]
+        logger.info("simulated %s seconds", self.clock.monotonic())
+        logger.info("relays on for: %s", ", ".join(
+            "{} {:.0f} s".format(name, device.onTime())
+            for name, device in sorted(self.devices.items())
+            if isinstance(device, SimulatedRelay)))
+        logger.info("dht reads: %s, failures: %s", dht.reads, dht.failures)
+        logger.info("display frames: %s", self.devices["display"].frameCount)
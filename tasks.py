@@ -0,0 +1,47 @@
+"""Registry of the running jobs.
+
+asyncio keeps only weak references to the tasks, and the failure of a
+task nobody awaits is reported only once it is garbage collected, if ever.
+The jobs (scheduled, resumed or started by a command) are therefore
+started through the registry which holds them until they are done, logs
+how they failed and limits how many of them can run at once.
+"""
+
+import log
+import metrics
+
+logger = log.getLogger("tasks")
+
+JOBS = metrics.gauge("jobs_running", "Jobs running.")
+REJECTED = metrics.counter("jobs_rejected_total", "Jobs not started as too many were running.")
+
+class TaskRegistry(object):
+    """
+    :param limit: jobs which can run at once
+    """
+
+    def __init__(self, loop, limit=64):
+        self.loop = loop
+        self.limit = limit
+        self.tasks = set()
+        JOBS.setFunction(lambda: len(self.tasks))
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def spawn(self, coro, name=None):
+        """Start the coroutine; return the task or None if too many are running."""
+        if len(self.tasks) >= self.limit:
+            logger.error("%s jobs running; not starting %s", len(self.tasks), name)
+            REJECTED.inc()
+            coro.close()
+            return None
+        task = self.loop.create_task(coro, name=name)
+        self.tasks.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error("job %s failed: %r", task.get_name(), task.exception())
@@ -0,0 +1,37 @@
+"""Unit tests of the control logic running on the virtual clock.
+
+No hardware nor network is needed:
+
+    python3 -m pytest tests -q
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import clock
+import simulation
+
+START = datetime(2024, 5, 1, 7, 30)
+
+@pytest.fixture
+def virtualClock():
+    previous = clock.get()
+    virtual = simulation.VirtualClock(START)
+    clock.install(virtual)
+    yield virtual
+    clock.install(previous)
+
+@pytest.fixture
+def loop(virtualClock):
+    loop = simulation.VirtualTimeEventLoop(virtualClock)
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(None)
@@ -0,0 +1,54 @@
+"""Ring of the readings shared with the acquisition process."""
+
+import pytest
+
+import acquisition
+
+def record(i):
+    # timestamp, value, sensor, quantity, reads, failures
+    return (1000.0 + i, 20.0 + i, 0, i % 2, 1, 0)
+
+@pytest.fixture
+def ring():
+    ring = acquisition.Ring.create(slots=4)
+    yield ring
+    ring.close(unlink=True)
+
+def test_read_written(ring):
+    ring.write([record(0), record(1)])
+    records, position, lost = ring.read(0)
+    assert [r[1:] for r in records] == [record(0), record(1)]
+    assert (position, lost) == (2, 0)
+    assert ring.read(position) == ([], 2, 0)
+
+def test_overwritten(ring):
+    ring.write([record(i) for i in range(10)])
+    records, position, lost = ring.read(0)
+    # only the last slots are left
+    assert [r[1:] for r in records] == [record(i) for i in range(6, 10)]
+    assert (position, lost) == (10, 6)
+
+def test_torn_record(ring):
+    ring.write([record(0), record(1)])
+    # the writer was interrupted while writing the second one
+    acquisition.SEQUENCE.pack_into(ring.buffer, ring._offset(1), 0)
+    records, position, lost = ring.read(0)
+    assert [r[1:] for r in records] == [record(0)]
+    assert (position, lost) == (2, 1)
+
+def test_attach(ring):
+    other = acquisition.Ring.attach(ring.name)
+    try:
+        other.write([record(0)])
+        other.beat()
+        assert ring.read(0)[0][0][1:] == record(0)
+        assert ring.heartbeat() > 0
+    finally:
+        other.close()
+
+def test_split():
+    local, isolated = acquisition.split(
+        {"soil": {"type": "soil", "interval": 300}}, {"interval": 60, "samples": 5})
+    # the DHT goes to the worker; None removes the default sensor
+    assert local["dht"] is None and isolated["dht"]["type"] == "dht"
+    assert isolated["soil"] is None and local["soil"]["interval"] == 300
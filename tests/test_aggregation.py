@@ -0,0 +1,78 @@
+"""Window summaries and alarms of the readings."""
+
+import asyncio
+import statistics
+
+import pytest
+
+import aggregation
+import sensors
+
+def test_stats():
+    values = [21.5, 22.0, 19.75, 23.25, 22.5]
+    stats = aggregation.Stats()
+    for value in values:
+        stats.add(value)
+    assert stats.summary() == {
+        "count": 5, "min": 19.75, "max": 23.25,
+        "mean": round(statistics.mean(values), 3),
+        "stddev": round(statistics.stdev(values), 3),
+    }
+
+def test_stats_large_offset():
+    # the naive sum of squares would lose the variance
+    values = [1e9 + x for x in (4, 7, 13, 16)]
+    stats = aggregation.Stats()
+    for value in values:
+        stats.add(value)
+    assert stats.m2 / (stats.count - 1) == pytest.approx(30.0)
+
+def test_stats_single():
+    stats = aggregation.Stats()
+    stats.add(5)
+    assert stats.summary()["stddev"] == 0.0
+
+def reading(quantity, value, timestamp):
+    return sensors.Reading("dht", quantity, value, "C", timestamp)
+
+@pytest.fixture
+def published():
+    return []
+
+@pytest.fixture
+def aggregator(loop, published):
+    a = aggregation.Aggregator(loop, lambda key, value: published.append((key, value)))
+    yield a
+    a.flush()
+
+def test_window(loop, virtualClock, aggregator, published):
+    # 7:30:00 so the window is aligned
+    aggregator.configure({"windows": [300]})
+    assert aggregator.enabled()
+    now = virtualClock.now().timestamp()
+    aggregator.consume([reading("temp", 20, now), reading("humid", None, now)])
+    aggregator.consume([reading("temp", 22, now + 60)])
+    loop.run_until_complete(asyncio.sleep(301))
+    [(key, summary)] = published
+    assert key == "summary"
+    assert summary["start"] == now
+    assert summary["channels"] == {"temp": {"count": 2, "min": 20, "max": 22, "mean": 21.0,
+                                            "stddev": 1.414}}
+
+def test_empty_window_not_published(loop, aggregator, published):
+    aggregator.configure({"windows": [300]})
+    loop.run_until_complete(asyncio.sleep(301))
+    assert published == []
+
+def test_alarm(loop, virtualClock, aggregator, published):
+    aggregator.configure({"windows": [300], "alarms": {"temp": {"max": 30}}, "burst": 2})
+    now = virtualClock.now().timestamp()
+    for i, value in enumerate([20, 25, 31, 32, 28]):
+        aggregator.consume([reading("temp", value, now + i)])
+    assert published == [
+        # what led to it
+        ("alarm", {"channel": "temp", "limit": "max", "samples": [(now + 1, 25), (now + 2, 31)]}),
+        # then each reading while it lasts
+        ("temp", 32),
+        ("alarm", {"channel": "temp", "cleared": True, "samples": [(now + 4, 28)]}),
+    ]
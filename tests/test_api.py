@@ -0,0 +1,114 @@
+"""Local query API answered from the memory."""
+
+import json
+import types
+
+import pytest
+
+import api
+import commands
+import history
+import sensors
+import webserver
+
+@pytest.fixture
+def recent(virtualClock):
+    h = history.History()
+    now = virtualClock.now().timestamp()
+    h.consume([sensors.Reading("dht", "temp", 20.0 + i, "C", now - 600 + 60 * i)
+               for i in range(10)])
+    h.consume([sensors.Reading("dht", "humid", None, "%", now)])
+    h.onRelay("pump", True)
+    return h
+
+@pytest.fixture
+def submitted():
+    return []
+
+@pytest.fixture
+def routes(loop, recent, submitted):
+    queue = commands.CommandQueue(loop, lambda name, attr: None)
+    queue.configure({"burst": 1}, ())
+    settings = types.SimpleNamespace(current=types.SimpleNamespace(
+        schedule=("0 8 * * * pump 30", "0 9 * * * lamp 28800")))
+
+    def submit(cmd):
+        submitted.append(cmd)
+        return queue.submit(cmd)
+
+    return api.routes(recent, settings, submit)
+
+def get(routes, target, method="GET", body=b""):
+    request = webserver.Request(method, target, {}, body)
+    status, ctype, payload = routes[request.path](request)
+    assert ctype == "application/json"
+    return status, json.loads(payload)
+
+def test_readings(routes, virtualClock):
+    status, data = get(routes, "/readings")
+    assert status == 200
+    # the failed readings are not kept
+    assert data == {"temp": {"value": 29.0, "unit": "C", "sensor": "dht",
+                             "time": virtualClock.now().timestamp() - 60}}
+
+def test_history(routes):
+    status, data = get(routes, "/history?channel=temp&seconds=180")
+    assert status == 200
+    assert [value for _, value in data["readings"]] == [27.0, 28.0, 29.0]
+
+def test_history_windows(routes):
+    status, data = get(routes, "/history?channel=temp&window=300")
+    # 7:20-7:25 and 7:25-7:30
+    assert [(w["count"], w["min"], w["max"]) for w in data["windows"]] == [
+        (5, 20.0, 24.0), (5, 25.0, 29.0)]
+
+@pytest.mark.parametrize("target, status", [
+    ("/history?channel=soil", 404),
+    ("/history?channel=temp&seconds=0", 400),
+    ("/history?channel=temp&window=abc", 400),
+    ("/history?channel=temp&seconds=99999999", 400),
+    ("/actuators?seconds=-1", 400),
+    ("/schedule?hours=1000", 400),
+])
+def test_invalid_query(routes, target, status):
+    assert get(routes, target)[0] == status
+
+def test_actuators(routes, virtualClock):
+    status, data = get(routes, "/actuators")
+    now = virtualClock.now().timestamp()
+    assert data == {"state": {"pump": {"on": True, "since": now}},
+                    "transitions": [{"time": now, "relay": "pump", "on": True}]}
+
+def test_schedule(routes):
+    status, data = get(routes, "/schedule?hours=2")
+    assert data == [{"time": "2024-05-01T08:00:00", "job": "pump", "attr": ["30"]},
+                    {"time": "2024-05-01T09:00:00", "job": "lamp", "attr": ["28800"]}]
+
+def post(routes, cmd):
+    return get(routes, "/command", "POST", json.dumps(cmd).encode())
+
+def test_command(routes, submitted, virtualClock):
+    cmd = {"command": "pump_on", "duration": 10, "id": 1}
+    assert post(routes, cmd) == (202, {"status": "accepted", "id": 1})
+    assert post(routes, cmd) == (202, {"status": "duplicate", "id": 1})
+    assert submitted == [cmd, cmd]
+    virtualClock.advance(5)
+    assert post(routes, {"command": "pump_on", "duration": 10}) == (
+        429, {"status": "rejected", "reason": "rate_limited"})
+
+@pytest.mark.parametrize("body, status", [
+    (b"{", 400),
+    (json.dumps({"command": "pump_on", "duration": -1}).encode(), 400),
+])
+def test_invalid_command(routes, body, status):
+    assert get(routes, "/command", "POST", body)[0] == status
+
+def test_command_needs_post(routes):
+    assert get(routes, "/command")[0] == 405
+
+def test_queue_full(loop, recent):
+    queue = commands.CommandQueue(loop, lambda name, attr: None)
+    queue.configure({"queue": 1}, ())
+    routes = api.routes(recent, None, queue.submit)
+    post(routes, {"command": "pump_on", "duration": 10})
+    assert post(routes, {"command": "lamp_on", "duration": 10})[0] == 503
@@ -0,0 +1,99 @@
+"""Queue of the remote commands: coalescing, rate limits and limits."""
+
+import asyncio
+
+import pytest
+
+import commands
+
+def pump(duration, **kwargs):
+    return dict({"command": "pump_on", "duration": duration}, **kwargs)
+
+@pytest.fixture
+def started():
+    return []
+
+@pytest.fixture
+def queue(loop, started):
+    q = commands.CommandQueue(loop, lambda name, attr: started.append((name, attr)))
+    q.configure({}, ("zone1",))
+    return q
+
+def drain(loop, queue):
+    task = loop.create_task(queue.run())
+    loop.run_until_complete(asyncio.sleep(0.1))
+    task.cancel()
+
+@pytest.mark.parametrize("cmd", [
+    None, {}, {"command": "heat"}, pump("x"), pump(0), pump(-5),
+    pump(10, zone="zone9"), pump(10, id=[1]),
+])
+def test_invalid(queue, cmd):
+    assert queue.submit(cmd)["reason"] == "invalid"
+    assert not queue.queue
+
+def test_duration_capped(queue, loop, started):
+    assert queue.submit(pump(10 ** 9))["status"] == "accepted"
+    assert queue.submit({"command": "lamp_on", "duration": 10 ** 9})["status"] == "accepted"
+    drain(loop, queue)
+    assert started == [("pump", [300]), ("lamp", [43200])]
+
+def test_zone(queue, loop, started):
+    queue.submit(pump(10, zone="zone1"))
+    drain(loop, queue)
+    assert started == [("pump", ["zone1", 10])]
+
+def test_coalesce_longer_wins(queue, loop, virtualClock, started):
+    assert queue.submit(pump(10))["status"] == "accepted"
+    virtualClock.advance(0.5)
+    assert queue.submit(pump(30))["status"] == "coalesced"
+    assert queue.submit(pump(20))["status"] == "coalesced"
+    # other actuators are not merged
+    assert queue.submit(pump(5, zone="zone1"))["status"] == "accepted"
+    drain(loop, queue)
+    assert started == [("pump", [30]), ("pump", ["zone1", 5])]
+
+def test_coalesce_window(queue, virtualClock):
+    queue.submit(pump(10))
+    virtualClock.advance(2)
+    assert queue.submit(pump(10))["status"] == "accepted"
+
+def test_duplicate_id(queue, virtualClock):
+    assert queue.submit(pump(10, id="a")) == {"status": "accepted", "id": "a"}
+    virtualClock.advance(5)
+    assert queue.submit(pump(10, id="a"))["status"] == "duplicate"
+
+def test_rejected_id_can_be_retried(queue, virtualClock):
+    queue.configure({"burst": 1}, ())
+    queue.submit(pump(10))
+    virtualClock.advance(5)
+    assert queue.submit(pump(10, id="b"))["reason"] == "rate_limited"
+    virtualClock.advance(60)
+    assert queue.submit(pump(10, id="b"))["status"] == "accepted"
+
+def test_rate_limit(queue, virtualClock):
+    statuses = []
+    for _ in range(5):
+        statuses.append(queue.submit(pump(10)).get("reason", "ok"))
+        virtualClock.advance(2)
+    assert statuses == ["ok", "ok", "ok", "rate_limited", "rate_limited"]
+    # one token every refill seconds
+    virtualClock.advance(60)
+    assert queue.submit(pump(10))["status"] == "accepted"
+    virtualClock.advance(2)
+    assert queue.submit(pump(10))["reason"] == "rate_limited"
+
+def test_rate_limit_survives_config_push(queue, virtualClock):
+    for _ in range(3):
+        queue.submit(pump(10))
+        virtualClock.advance(2)
+    queue.configure({}, ("zone1", "zone2"))
+    assert queue.submit(pump(10))["reason"] == "rate_limited"
+    # the new limits start with full buckets
+    queue.configure({"burst": 5}, ())
+    assert queue.submit(pump(10))["status"] == "accepted"
+
+def test_queue_full(queue):
+    queue.configure({"queue": 1}, ("zone1",))
+    assert queue.submit(pump(10))["status"] == "accepted"
+    assert queue.submit(pump(10, zone="zone1"))["reason"] == "queue_full"
@@ -0,0 +1,128 @@
+"""Validation of the configuration pushed by the server."""
+
+import json
+
+import pytest
+
+import config
+
+ACTIONS = ("pump", "lamp")
+
+def parse(**sections):
+    return config.parse(dict({"version": 1}, **sections), ACTIONS)
+
+def test_example_is_valid():
+    # the one in the module docstring
+    example = config.__doc__.split("i.e.:")[1].split("The optional")[0]
+    parsed = config.parse(json.loads(example), ACTIONS)
+    assert parsed.version == 3
+    assert parsed.zones["zone1"]["pin"] == "D17"
+    assert parsed.toDict()["commands"] == {"burst": 2, "refill": 300}
+
+@pytest.mark.parametrize("data", [None, [], "x"])
+def test_not_an_object(data):
+    with pytest.raises(config.ConfigError):
+        config.parse(data, ACTIONS)
+
+@pytest.mark.parametrize("version", [None, -1, "3", True])
+def test_invalid_version(version):
+    with pytest.raises(config.ConfigError):
+        config.parse({"version": version}, ACTIONS)
+
+@pytest.mark.parametrize("sampling", [5, [], {"foo": 1}, {"samples": 2},
+                                      {"interval": 5, "samples": 5}, {"interval": "60"}])
+def test_invalid_sampling(sampling):
+    with pytest.raises(config.ConfigError):
+        parse(sampling=sampling)
+
+def test_sampling_defaults():
+    assert parse(sampling={"interval": 120}).sampling == {"interval": 120, "samples": 5}
+
+@pytest.mark.parametrize("line", [
+    "0 8 * * * pump abc",
+    "0 8 * * * pump zone1",
+    "0 8 * * * pump zone2 30",
+    "0 8 * * * pump 0",
+    "0 8 * * * pump zone1 30 10",
+    "0 9 * * * lamp 1 2",
+    "0 9 * * * heater 30",
+    "61 8 * * * pump 30",
+    "0 8 * *",
+])
+def test_invalid_schedule(line):
+    with pytest.raises(config.ConfigError):
+        parse(schedule=[line], zones={"zone1": {"pin": "D17"}})
+
+def test_valid_schedule():
+    lines = ["0 8 * * * pump zone1 30", "0 8 * * * pump 30", "0 9 * * * lamp",
+             "# comment", ""]
+    assert parse(schedule=lines, zones={"zone1": {"pin": "D17"}}).schedule == tuple(lines)
+
+@pytest.mark.parametrize("zones", [
+    [],
+    {"1": {"pin": "D17"}},
+    {"zone1": {}},
+    {"zone1": {"pin": "GPIO17"}},
+    {"zone1": {"pin": "D40"}},
+    {"zone1": {"pin": "D23"}},
+    {"zone1": {"pin": "D22"}},
+    {"zone1": {"pin": "D17"}, "zone2": {"pin": "D17"}},
+    {"zone1": {"pin": "D17", "load": -1}},
+])
+def test_invalid_zones(zones):
+    with pytest.raises(config.ConfigError):
+        parse(zones=zones)
+
+@pytest.mark.parametrize("power", [{"budget": 0}, {"budget": "2"}, {"pump": -1}])
+def test_invalid_power(power):
+    with pytest.raises(config.ConfigError):
+        parse(power=power)
+
+@pytest.mark.parametrize("sensors", [
+    {"soil": {"interval": 0.0001}},
+    {"soil": {"interval": 0}},
+    {"soil": {"samples": 0}},
+    {"soil": {"type": "camera"}},
+    {"soil": {"color": "red"}},
+    {"soil": 5},
+])
+def test_invalid_sensors(sensors):
+    with pytest.raises(config.ConfigError):
+        parse(sensors=sensors)
+
+@pytest.mark.parametrize("commands", [
+    {"burst": 0}, {"refill": 0}, {"max_pump": 0}, {"coalesce": -1}, {"speed": 1},
+])
+def test_invalid_commands(commands):
+    with pytest.raises(config.ConfigError):
+        parse(commands=commands)
+
+@pytest.mark.parametrize("watering", [
+    {"mode": "flood"}, {"target": -1}, {"min_pulse": 20, "max_pulse": 10}, {"speed": 1},
+])
+def test_invalid_watering(watering):
+    with pytest.raises(config.ConfigError):
+        parse(watering=watering)
+
+@pytest.fixture
+def manager(tmp_path):
+    cron = tmp_path / "cron"
+    cron.write_text("0 8 * * * pump 30\n")
+    return config.ConfigManager(str(tmp_path / "config.json"), str(cron), ACTIONS)
+
+def test_apply(manager, tmp_path):
+    applied = []
+    manager.addListener(applied.append)
+    state = manager.apply(json.dumps({"version": 2, "schedule": ["0 9 * * * lamp 60"]}))
+    assert state == {"config_version": 2, "status": "applied"}
+    assert [c.version for c in applied] == [2]
+    assert config.load(str(tmp_path / "config.json"))["version"] == 2
+
+    assert manager.apply(json.dumps({"version": 2}))["status"] == "unchanged"
+
+@pytest.mark.parametrize("payload", ["{", json.dumps({"version": 5, "sampling": 5})])
+def test_apply_rejected(manager, payload):
+    state = manager.apply(payload)
+    assert state["status"] == "rejected"
+    assert state["config_version"] == 0
+    assert manager.current.schedule == ("0 8 * * * pump 30",)
@@ -0,0 +1,112 @@
+"""Pages of the LCD and the partial redraws."""
+
+import asyncio
+
+import pytest
+
+import dashboard
+from dashboard import Page
+
+class Display(object):
+    """2x16 LCD recording what was written where."""
+
+    columns = 16
+    lines = 2
+
+    def __init__(self):
+        self.rows = [[" "] * self.columns for _ in range(self.lines)]
+        self.writes = []
+        self.position = (0, 0)
+
+    def clear(self):
+        self.rows = [[" "] * self.columns for _ in range(self.lines)]
+
+    def cursor_position(self, column, row):
+        self.position = (column, row)
+
+    @property
+    def message(self):
+        return None
+
+    @message.setter
+    def message(self, text):
+        column, row = self.position
+        self.rows[row][column:column + len(text)] = text
+        self.writes.append((column, row, text))
+
+    def text(self):
+        return ["".join(row) for row in self.rows]
+
+@pytest.mark.parametrize("old, new, spans", [
+    (b"abcdefgh", b"abcdefgh", []),
+    (b"abcdefgh", b"aXcdefgh", [[1, 2]]),
+    # two unchanged characters in between are written anyway
+    (b"abcdefgh", b"aXcdXfgh", [[1, 5]]),
+    (b"abcdefgh", b"aXcdeXgh", [[1, 2], [5, 6]]),
+    (b"abcdefgh", b"XXXXXXXX", [[0, 8]]),
+])
+def test_changedSpans(old, new, spans):
+    assert dashboard.changedSpans(old, new) == spans
+
+def test_changedSpans_gap():
+    assert dashboard.changedSpans(b"abcdefgh", b"aXcdXfgh", gap=1) == [[1, 2], [4, 5]]
+
+PAGES = (
+    Page("climate", "Temp: {temp:.1f} C", "Humidity: {humid:.1f} %"),
+    Page("water", "Soil: {soil}", "Tank: {level}"),
+    Page("relays", "Pump: {pump}", "Lamp: {lamp}"),
+)
+
+@pytest.fixture
+def display():
+    return Display()
+
+@pytest.fixture
+def board(loop, display):
+    return dashboard.Dashboard(loop, display, PAGES, dashboard.ALERTS)
+
+def test_alert(board, display):
+    board.update(temp=21.5, humid=50.0, level="full")
+    board.draw()
+    assert display.text() == ["Temp: 21.5 C    ", "Humidity: 50.0 %"]
+    # shown instead of the rotation while the tank is empty
+    board.update(level="empty")
+    assert board.page().name == "tank"
+    board.next()
+    assert board.page().name == "tank"
+    board.draw()
+    assert display.text() == ["tank empty      ", "refill the tank "]
+    board.update(level="full")
+    assert board.page() is PAGES[1]
+
+def test_partial_redraw(board, display):
+    board.update(temp=21.5, humid=50.0)
+    board.draw()
+    del display.writes[:]
+    board.update(temp=21.7)
+    board.draw()
+    assert display.writes == [(9, 0, "7")]
+    # nothing changed
+    board.draw()
+    assert display.writes == [(9, 0, "7")]
+
+def test_empty_skipped(board):
+    # no soil sensor nor level switch
+    board.update(temp=21.5, pump="off")
+    board.next()
+    assert board.page() is PAGES[2]
+    board.next()
+    assert board.page() is PAGES[0]
+
+def test_rotation(loop, board, display):
+    board.update(temp=21.5, soil=500, pump="off")
+    task = loop.create_task(board.run())
+    loop.run_until_complete(asyncio.sleep(15))
+    assert display.text()[0] == "Soil: 500       "
+    board.press()
+    # bouncing
+    loop.call_later(0.1, board.press)
+    loop.run_until_complete(asyncio.sleep(1))
+    assert display.text()[0] == "Pump: off       "
+    task.cancel()
+    loop.run_until_complete(asyncio.sleep(0))
@@ -0,0 +1,142 @@
+"""Tracking of the MQTT deliveries by the PUBACKs."""
+
+import asyncio
+import concurrent.futures
+
+import pytest
+
+mqtt = pytest.importorskip("mqtt")
+
+CONFIG = {
+    "device_id": "test", "project_id": "p", "registry_id": "r",
+    "cloud_region": "us-central1", "private_key_file": None, "algorithm": "RS256",
+    "ca_certs": None, "mqtt_bridge_hostname": "localhost", "mqtt_bridge_port": 8883,
+    "mqtt_inflight": 5, "mqtt_retries": 1, "mqtt_expiry": 60,
+}
+
+class Info(object):
+
+    def __init__(self, mid, rc=0):
+        self.mid = mid
+        self.rc = rc
+
+class FakeClient(object):
+    """paho client acknowledging only when told to."""
+
+    clients = []
+
+    def __init__(self, client_id=None):
+        self.mid = 0
+        self.published = []
+        self.inflight = None
+        self.full = False
+        # acknowledge within publish, i.e. before it returned
+        self.ackEarly = False
+        FakeClient.clients.append(self)
+
+    def connect(self, host, port):
+        self.on_connect(self, None, None, 0)
+
+    def max_inflight_messages_set(self, inflight):
+        self.inflight = inflight
+
+    def publish(self, topic, payload, qos=0):
+        if self.full:
+            return Info(0, mqtt.mqtt.MQTT_ERR_QUEUE_SIZE)
+        self.mid += 1
+        self.published.append((self.mid, payload))
+        if self.ackEarly:
+            self.on_publish(self, None, self.mid)
+        return Info(self.mid)
+
+    def ack(self, mid):
+        self.on_publish(self, None, mid)
+
+    def __getattr__(self, name):
+        # the rest of the paho API is not needed
+        return lambda *args, **kwargs: None
+
+@pytest.fixture
+def client(loop, monkeypatch):
+    FakeClient.clients = []
+    monkeypatch.setattr(mqtt.mqtt, "Client", FakeClient)
+    monkeypatch.setattr(mqtt, "create_jwt", lambda *args: "token")
+    return mqtt.Mqtt(dict(CONFIG), loop)
+
+def settle(loop):
+    # the futures are resolved through call_soon_threadsafe
+    loop.run_until_complete(asyncio.sleep(0))
+
+def test_inflight_window(client):
+    assert client.client.inflight == 5
+
+def test_acked(loop, client, virtualClock, monkeypatch):
+    monkeypatch.setattr(mqtt.time, "monotonic", virtualClock.monotonic)
+    first = client.publish("temp", 22.5)
+    second = client.publish("humid", 50)
+    virtualClock.advance(0.25)
+    client.client.ack(2)
+    settle(loop)
+    assert second.done() and not first.done()
+    delivery = second.result()
+    assert (delivery.status, delivery.acked, delivery.latency) == ("acked", True, 0.25)
+    assert delivery.payload == '{"humid": 50}'
+    assert list(client.pending) == [1]
+
+def test_ack_before_publish_returned(loop, client):
+    client.client.ackEarly = True
+    future = client.publish("temp", 22.5)
+    settle(loop)
+    assert future.result().acked
+    assert client.pending == {} and client.early_acks == {}
+
+def test_dropped(loop, client):
+    client.client.full = True
+    future = client.publish("temp", 22.5)
+    settle(loop)
+    assert future.result().status == "dropped"
+    assert client.pending == {}
+
+def test_resent_on_new_client(loop, client):
+    future = client.publish("temp", 22.5)
+    # i.e. the JWT was refreshed; the new session doesn't know the message
+    client._Mqtt__init_and_connect()
+    new = FakeClient.clients[-1]
+    assert new.published == [(1, '{"temp": 22.5}')]
+    new.ack(1)
+    settle(loop)
+    delivery = future.result()
+    assert (delivery.status, delivery.attempts) == ("acked", 2)
+
+def test_retries_exhausted(loop, client):
+    future = client.publish("temp", 22.5)
+    client._Mqtt__init_and_connect()
+    client._Mqtt__init_and_connect()
+    settle(loop)
+    delivery = future.result()
+    assert (delivery.status, delivery.attempts) == ("retries_exhausted", 2)
+    assert client.pending == {}
+
+def test_expired(loop, client):
+    old = client.publish("temp", 22.5)
+    new = client.publish("temp", 23.0)
+    published = client.pending[1].started
+    client.pending[2].started = published + 30
+    client.expire(published + 61)
+    settle(loop)
+    assert old.result().status == "expired"
+    assert not new.done()
+    assert list(client.pending) == [2]
+    # the late PUBACK is forgotten after the expiry as well
+    client.client.ack(1)
+    client.expire(published + 200)
+    assert client.early_acks == {}
+
+def test_without_loop(monkeypatch):
+    monkeypatch.setattr(mqtt.mqtt, "Client", FakeClient)
+    monkeypatch.setattr(mqtt, "create_jwt", lambda *args: "token")
+    client = mqtt.Mqtt(dict(CONFIG))
+    future = client.publish("temp", 22.5)
+    assert isinstance(future, concurrent.futures.Future)
+    client.client.ack(1)
+    assert future.result(0).acked
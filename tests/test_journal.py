@@ -0,0 +1,92 @@
+"""Leases of the running jobs and resuming them after a restart."""
+
+import types
+from datetime import datetime, timedelta
+
+import pytest
+
+import autoplant
+import journal
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "state.json")
+
+def test_resume_same_boot(virtualClock, path):
+    first = journal.StateJournal(path)
+    first.startLease("lamp", ["600"], 600)
+    virtualClock.advance(100)
+    # the daemon is restarted
+    second = journal.StateJournal(path)
+    [(lease, remaining)] = second.pendingLeases()
+    assert (lease.job, lease.attr, remaining) == ("lamp", ["600"], 500)
+    # resumed only once
+    assert second.pendingLeases() == []
+
+def test_resume_after_reboot(virtualClock, path):
+    journal.StateJournal(path).startLease("pump", ["zone1", "60"], 60)
+    virtualClock.advance(20)
+    # the monotonic clock of the new boot is not comparable
+    virtualClock.boot = "other"
+    virtualClock.start += timedelta(seconds=virtualClock.elapsed)
+    virtualClock.elapsed = 0
+    [(lease, remaining)] = journal.StateJournal(path).pendingLeases()
+    assert remaining == 40
+
+def test_ended_and_expired_leases(virtualClock, path):
+    state = journal.StateJournal(path)
+    done = state.startLease("pump", ["30"], 30)
+    state.startLease("lamp", ["60"], 60)
+    state.endLease(done)
+    virtualClock.advance(60)
+    assert journal.StateJournal(path).pendingLeases() == []
+
+def test_cursor(virtualClock, path):
+    state = journal.StateJournal(path)
+    assert state.lastDispatched() is None
+    when = datetime(2024, 5, 1, 8, 0)
+    state.setDispatched(when)
+    assert journal.StateJournal(path).lastDispatched() == when.timestamp()
+
+@pytest.mark.parametrize("content", [
+    "{", "[1]", '{"leases": 5}', '{"leases": [{"job": "pump"}]}', '{"leases": [5]}',
+])
+def test_corrupted(virtualClock, path, content):
+    with open(path, "w") as f:
+        f.write(content)
+    state = journal.StateJournal(path)
+    assert state.pendingLeases() == []
+    assert state.lastDispatched() is None
+
+class Jobs(object):
+
+    def spawn(self, coro, name=None):
+        coro.close()
+
+def test_resume_missed_zone_jobs(virtualClock, path, monkeypatch):
+    started = []
+
+    async def runJob(stateJournal, devices, name, attr):
+        pass
+
+    def record(stateJournal, devices, name, attr):
+        started.append((name, attr))
+        return runJob(stateJournal, devices, name, attr)
+
+    monkeypatch.setattr(autoplant, "runJob", record)
+    state = journal.StateJournal(path)
+    state.setDispatched(datetime(2024, 5, 1, 7, 0))
+    state.startLease("pump", ["zone1", "3600"], 3600)
+    settings = types.SimpleNamespace(current=types.SimpleNamespace(schedule=(
+        "0 8 * * * pump zone1 600", "0 8 * * * pump zone2 600", "0 8 * * * lamp 600")))
+    # the daemon was down from 7:30 till 8:05
+    virtualClock.advance(35 * 60)
+    restarted = journal.StateJournal(path)
+    autoplant.resumeJobs(None, {"jobs": Jobs()}, restarted, settings)
+
+    # zone1 is resumed from the lease, the others started as missed
+    assert started == [
+        ("pump", ["zone1", 1500]),
+        ("lamp", [300]),
+        ("pump", ["zone2", 300]),
+    ]
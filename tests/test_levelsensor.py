@@ -0,0 +1,78 @@
+"""Debouncing of the water level switch."""
+
+import asyncio
+
+import pytest
+
+import levelsensor
+
+class Pin(object):
+    """Level switch delivering the edge events."""
+
+    def __init__(self, value=False):
+        self.value = value
+        self.callbacks = []
+
+    def addEdgeCallback(self, callback):
+        self.callbacks.append(callback)
+
+    def set(self, value):
+        self.value = value
+        for callback in self.callbacks:
+            callback()
+
+@pytest.fixture
+def pin():
+    return Pin()
+
+@pytest.fixture
+def monitor(loop, pin):
+    m = levelsensor.LevelMonitor(loop, pin, debounce=0.02)
+    m.start()
+    return m
+
+def run(loop, seconds):
+    loop.run_until_complete(asyncio.sleep(seconds))
+
+def test_change(loop, pin, monitor):
+    changes = []
+    monitor.addListener(changes.append)
+    pin.set(True)
+    run(loop, 0.05)
+    assert monitor.empty and changes == [True]
+    pin.set(False)
+    run(loop, 0.05)
+    assert not monitor.empty and changes == [True, False]
+
+def test_bounce_filtered(loop, pin, monitor):
+    changes = []
+    monitor.addListener(changes.append)
+    # back to full before the debounce time is over
+    pin.set(True)
+    loop.call_later(0.005, pin.set, False)
+    loop.call_later(0.01, pin.set, True)
+    loop.call_later(0.015, pin.set, False)
+    run(loop, 0.1)
+    assert not monitor.empty and changes == []
+
+def test_confirmed_after_debounce(loop, pin, monitor):
+    # the bouncing ends within the debounce time
+    pin.set(True)
+    loop.call_later(0.005, pin.set, False)
+    loop.call_later(0.01, pin.set, True)
+    run(loop, 0.015)
+    assert not monitor.empty
+    run(loop, 0.01)
+    assert monitor.empty
+
+def test_wait_empty(loop, pin, monitor):
+    assert loop.run_until_complete(monitor.waitEmpty(1)) is False
+    loop.call_later(5, pin.set, True)
+    started = loop.time()
+    assert loop.run_until_complete(monitor.waitEmpty(60)) is True
+    assert loop.time() - started == pytest.approx(5.02)
+
+def test_empty_at_start(loop):
+    monitor = levelsensor.LevelMonitor(loop, Pin(True))
+    assert monitor.empty
+    assert loop.run_until_complete(monitor.waitEmpty(1)) is True
@@ -0,0 +1,46 @@
+"""Rate limiting of the repeating log messages."""
+
+import logging
+
+import pytest
+
+import log
+
+def record(msg, *args, name="autoplant.sensors"):
+    return logging.LogRecord(name, logging.WARNING, __file__, 1, msg, args, None)
+
+@pytest.fixture
+def limit(virtualClock):
+    return log.RateLimitFilter(burst=3, period=60.0)
+
+def test_repeats_suppressed(virtualClock, limit):
+    passed = [limit.filter(record("dht read failed: %s", "checksum")) for i in range(10)]
+    assert passed == [True] * 3 + [False] * 7
+
+def test_suppressed_reported(virtualClock, limit):
+    for i in range(10):
+        limit.filter(record("dht read failed: %s", "checksum"))
+    virtualClock.advance(60)
+    r = record("dht read failed: %s", "checksum")
+    assert limit.filter(r)
+    assert r.getMessage() == "dht read failed: checksum (7 similar messages suppressed)"
+    # counted from the new period
+    r = record("dht read failed: %s", "checksum")
+    assert limit.filter(r)
+    assert r.getMessage() == "dht read failed: checksum"
+
+def test_nothing_suppressed(virtualClock, limit):
+    for i in range(3):
+        limit.filter(record("dht read failed: %s", "checksum"))
+    virtualClock.advance(60)
+    r = record("dht read failed: %s", "checksum")
+    assert limit.filter(r)
+    assert r.getMessage() == "dht read failed: checksum"
+
+def test_distinct_messages(virtualClock, limit):
+    # the same template with the different arguments
+    assert all(limit.filter(record("%s read failed", name))
+               for name in ("dht", "soil", "level") for i in range(3))
+    assert not limit.filter(record("%s read failed", "dht"))
+    # the same message by another logger
+    assert limit.filter(record("%s read failed", "dht", name="autoplant.mqtt"))
@@ -0,0 +1,46 @@
+"""Prometheus text format of the metrics."""
+
+import metrics
+
+def test_counter():
+    reads = metrics.Counter("test_reads_total", "Sensor reads.", ("sensor",))
+    reads.labels("dht").inc()
+    reads.labels("dht").inc(2)
+    reads.labels('so"il').inc()
+    assert reads.render() == [
+        "# HELP autoplant_test_reads_total Sensor reads.",
+        "# TYPE autoplant_test_reads_total counter",
+        'autoplant_test_reads_total{sensor="dht"} 3.0',
+        'autoplant_test_reads_total{sensor="so\\"il"} 1.0',
+    ]
+
+def test_gauge_function():
+    depth = metrics.Gauge("test_depth", "Queue depth.")
+    depth.set(5)
+    assert depth.render()[-1] == "autoplant_test_depth 5.0"
+    # computed while rendering
+    depth.setFunction(lambda: 7)
+    assert depth.render()[-1] == "autoplant_test_depth 7.0"
+
+def test_histogram():
+    latency = metrics.Histogram("test_seconds", "Latency.", ("job",), buckets=(1.0, 0.1))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        latency.labels("pump").observe(value)
+    assert latency.render()[2:] == [
+        'autoplant_test_seconds_bucket{job="pump",le="0.1"} 2',
+        'autoplant_test_seconds_bucket{job="pump",le="1.0"} 3',
+        'autoplant_test_seconds_bucket{job="pump",le="+Inf"} 4',
+        'autoplant_test_seconds_sum{job="pump"} 2.65',
+        'autoplant_test_seconds_count{job="pump"} 4',
+    ]
+
+def test_registry():
+    registry = metrics.Registry()
+    first = registry.register(metrics.Counter("test_total", "Test."))
+    # defined again elsewhere
+    assert registry.register(metrics.Counter("test_total", "Test.")) is first
+    first.inc()
+    assert registry.render() == (
+        "# HELP autoplant_test_total Test.\n"
+        "# TYPE autoplant_test_total counter\n"
+        "autoplant_test_total 1.0\n")
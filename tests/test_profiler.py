@@ -0,0 +1,51 @@
+"""Periodic profile snapshots."""
+
+import asyncio
+import json
+import os
+
+import pytest
+
+import profiler
+
+@pytest.fixture
+def profile(loop, tmp_path):
+    p = profiler.Profiler(loop, str(tmp_path), interval=600, keep=2)
+    yield p
+    # never leave the callbacks hooked
+    p.disable()
+
+async def busy():
+    while True:
+        sum(range(1000))
+        await asyncio.sleep(1)
+
+def test_pruned(loop, profile, tmp_path):
+    task = loop.create_task(busy())
+    profile.enable()
+    loop.run_until_complete(asyncio.sleep(1830))
+    # 7:40 is gone
+    assert sorted(os.listdir(str(tmp_path))) == ["20240501-075000", "20240501-080000"]
+    task.cancel()
+    loop.run_until_complete(asyncio.sleep(0))
+    profile.disable()
+    assert sorted(os.listdir(str(tmp_path))) == ["20240501-080000", "20240501-080030"]
+
+    path = tmp_path / "20240501-080000"
+    assert sorted(os.listdir(str(path))) == [
+        "coroutines.json", "profile.pstats", "tracemalloc.txt"]
+    with open(str(path / "coroutines.json")) as f:
+        # a step every second
+        assert json.load(f)["busy"]["steps"] == pytest.approx(600, abs=1)
+
+def test_disabled(loop, profile, tmp_path):
+    original = asyncio.Handle._run
+    profile.enable()
+    assert asyncio.Handle._run is not original
+    profile.toggle()
+    assert asyncio.Handle._run is original
+    assert not profile.enabled
+    # the snapshot of what was collected
+    assert len(os.listdir(str(tmp_path))) == 1
+    loop.run_until_complete(asyncio.sleep(3600))
+    assert len(os.listdir(str(tmp_path))) == 1
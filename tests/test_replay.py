@@ -0,0 +1,70 @@
+"""Recording the traces and comparing the replay with them."""
+
+import pytest
+
+import replay
+import tracing
+
+RECORDED = [
+    [12.004, "s", "dht", {"temp": 22, "humid": 50}],
+    [60.0, "c", '{"command": "pump_on", "duration": 10}'],
+    [60.0, "d", "pump", ["10"]],
+    [60.001, "r", "pump", 1],
+    [70.002, "r", "pump", 0],
+    [460.3, "l", 1],
+]
+
+@pytest.mark.parametrize("name", ["trace.jsonl", "trace.jsonl.gz"])
+def test_recorded(virtualClock, tmp_path, name):
+    path = str(tmp_path / name)
+    recorder = tracing.TraceRecorder(path, {"sampling": {"interval": 60}})
+    virtualClock.advance(12.004)
+    recorder.onSample("dht", {"temp": 22, "humid": 50})
+    virtualClock.advance(1.004)
+    recorder.onSample("dht", None, RuntimeError("checksum did not validate"))
+    virtualClock.advance(46.992)
+    recorder.onRelay("pump", True)
+    recorder.close()
+    # the last line cut when the daemon was killed
+    with tracing._open(path, "a") as f:
+        f.write('[61.0, "r", "pu')
+
+    header, records = tracing.read(path)
+    assert header["start"] == virtualClock.start.timestamp()
+    assert header["config"] == {"sampling": {"interval": 60}}
+    assert records == [[12.004, "s", "dht", {"temp": 22, "humid": 50}],
+                       [13.008, "s", "dht", None, "checksum did not validate"],
+                       [60.0, "r", "pump", 1]]
+
+def test_events():
+    assert replay.events(RECORDED) == RECORDED[2:5]
+
+def test_same():
+    expected = replay.events(RECORDED)
+    # within the tolerance
+    actual = [[t + 0.5] + record for t, *record in expected]
+    assert replay.compare(expected, actual) is None
+
+def test_relay_diverging():
+    expected = replay.events(RECORDED)
+    actual = [list(record) for record in expected]
+    actual[2] = [75.0, "r", "pump", 0]
+    assert replay.compare(expected, actual) == (
+        "event 2: recorded [70.002, 'r', 'pump', 0], replayed [75.0, 'r', 'pump', 0]")
+    actual[2] = [70.002, "r", "lamp", 0]
+    assert replay.compare(expected, actual).startswith("event 2:")
+
+def test_missing():
+    expected = replay.events(RECORDED)
+    # the pump never switched off
+    assert replay.compare(expected, expected[:2]) == "recorded 3 events, replayed 2"
+
+def test_device_failures():
+    device = replay.ReplayDevice([({"temp": 22, "humid": 50}, None),
+                                  (None, "checksum did not validate")])
+    assert (device.temperature, device.humidity) == (22, 50)
+    with pytest.raises(RuntimeError, match="checksum"):
+        device.temperature
+    # the last values once the trace is over
+    assert device.temperature == 22
+    assert (device.reads, device.failures) == (3, 1)
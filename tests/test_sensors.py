@@ -0,0 +1,88 @@
+"""Polling of the sensors by the engine."""
+
+import asyncio
+
+import pytest
+
+import sensors
+
+class Fake(sensors.Sensor):
+    """Sensor returning the values given, raising the exceptions."""
+
+    kind = "fake"
+    units = {"temp": "C"}
+
+    def __init__(self, name, values=(21.0,), **options):
+        sensors.Sensor.__init__(self, name, None, **options)
+        self.values = list(values)
+        self.reads = 0
+
+    def read(self):
+        value = self.values[self.reads % len(self.values)]
+        self.reads += 1
+        if isinstance(value, Exception):
+            raise value
+        return {"temp": value}
+
+@pytest.fixture
+def engine(loop):
+    return sensors.PollingEngine(loop)
+
+@pytest.fixture
+def received(engine):
+    readings = []
+    engine.addConsumer(readings.extend)
+    return readings
+
+@pytest.fixture
+def task(loop, engine, received):
+    # waits for the sensors configured by the test
+    t = loop.create_task(engine.run())
+    yield t
+    t.cancel()
+    run(loop, 0)
+
+def run(loop, seconds):
+    loop.run_until_complete(asyncio.sleep(seconds))
+
+def test_filtered(loop, engine, received, task):
+    engine.configure([Fake("dht", [20.0, 30.0, 21.0, 22.0, 23.0], samples=5,
+                           filter="trimmed_mean")])
+    run(loop, 10)
+    assert [(r.sensor, r.value) for r in received] == [("dht", 22.0)]
+
+@pytest.mark.parametrize("error", [OSError("checksum"), ValueError("bug")])
+def test_failed_read(loop, engine, received, task, error):
+    engine.configure([Fake("dht", [error, 21.0], samples=2)])
+    run(loop, 5)
+    assert [r.value for r in received] == [21.0]
+    # all the reads failing
+    engine.configure([Fake("dht", [error])])
+    run(loop, 5)
+    assert [r.value for r in received] == [21.0, None]
+    assert not task.done()
+
+def test_removed_during_round(loop, engine, received, task):
+    engine.configure([Fake("dht", samples=5, spacing=2)])
+    loop.call_later(3, engine.configure, [])
+    run(loop, 20)
+    assert received == []
+    assert not task.done()
+
+def test_listener_failure(loop, engine, received, task):
+    def listener(name, values, error):
+        raise RuntimeError("listener")
+
+    engine.addSampleListener(listener)
+    engine.configure([Fake("dht")])
+    run(loop, 5)
+    assert [r.value for r in received] == [21.0]
+    assert not task.done()
+
+def test_format_removed(engine):
+    engine.configure([sensors.LevelSensor("level", None)])
+    reading = sensors.Reading("level", "level", 1, "", 0)
+    assert engine.format(reading) == "empty"
+    # delivered before the sensor was removed
+    engine.configure([])
+    assert engine.format(reading) == 1
@@ -0,0 +1,65 @@
+"""Catching the blocked event loop.
+
+The watchdog is measuring the real time from its own thread so these are
+run on the real event loop, blocking it for a fraction of a second.
+"""
+
+import asyncio
+import logging
+import time
+
+import pytest
+
+import watchdog
+
+class Records(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+@pytest.fixture
+def warnings():
+    handler = Records()
+    watchdog.logger.addHandler(handler)
+    yield handler.messages
+    watchdog.logger.removeHandler(handler)
+
+@pytest.fixture
+def realLoop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+def stop(loop, dog):
+    dog.stop()
+    loop.run_until_complete(asyncio.sleep(0))
+    dog.thread.join()
+
+def blockingCall():
+    time.sleep(0.3)
+
+def test_stall(realLoop, warnings):
+    dog = watchdog.LoopWatchdog(realLoop, threshold=0.1, interval=0.01)
+    stalls = watchdog.STALLS.get()
+    dog.start()
+    realLoop.call_later(0.05, blockingCall)
+    realLoop.run_until_complete(asyncio.sleep(0.5))
+    stop(realLoop, dog)
+    assert watchdog.STALLS.get() == stalls + 1
+    message, = warnings
+    assert message.startswith("event loop blocked for 0.")
+    # captured while the loop was still blocked
+    assert "in blockingCall" in message
+
+def test_no_stall(realLoop, warnings):
+    dog = watchdog.LoopWatchdog(realLoop, threshold=0.1, interval=0.01)
+    stalls = watchdog.STALLS.get()
+    dog.start()
+    realLoop.run_until_complete(asyncio.sleep(0.3))
+    stop(realLoop, dog)
+    assert watchdog.STALLS.get() == stalls
+    assert warnings == []
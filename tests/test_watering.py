@@ -0,0 +1,78 @@
+"""Closed loop watering driven by the soil moisture."""
+
+import pytest
+
+import watering
+
+class Dispatcher(object):
+
+    def __init__(self):
+        self.pulses = []
+
+    async def water(self, zone, seconds):
+        self.pulses.append(seconds)
+        return seconds
+
+class Soil(object):
+    """Soil getting 10 units wetter with each second of watering."""
+
+    def __init__(self, moisture, dispatcher):
+        self.moisture = moisture
+        self.dispatcher = dispatcher
+
+    def moisture_read(self):
+        if self.moisture is None:
+            raise OSError("not connected")
+        return self.moisture + 10 * sum(self.dispatcher.pulses)
+
+@pytest.fixture
+def dispatcher():
+    return Dispatcher()
+
+def controller(dispatcher, moisture, **config):
+    c = watering.MoistureController(dispatcher, Soil(moisture, dispatcher))
+    c.configure(dict({"mode": "hysteresis", "target": 600, "hysteresis": 30,
+                      "max_pulse": 10, "soak": 60}, **config))
+    return c
+
+def test_fixed_mode_disabled(dispatcher):
+    assert not controller(dispatcher, 500, mode="fixed").enabled()
+    assert controller(dispatcher, 500).enabled()
+
+def test_moist_enough(loop, dispatcher):
+    c = controller(dispatcher, 580)
+    assert loop.run_until_complete(c.water(None, 30)) == 0
+    assert dispatcher.pulses == []
+
+def test_hysteresis(loop, dispatcher):
+    c = controller(dispatcher, 450)
+    # 150 units short; pulses of 10 s until reached
+    assert loop.run_until_complete(c.water(None, 60)) == 20
+    assert dispatcher.pulses == [10, 10]
+
+def test_job_time_is_the_limit(loop, dispatcher):
+    c = controller(dispatcher, 100)
+    assert loop.run_until_complete(c.water(None, 25)) == 25
+    assert dispatcher.pulses == [10, 10, 5]
+
+def test_pi_pulses(loop, dispatcher):
+    c = controller(dispatcher, 500, mode="pi", kp=0.05, ki=0.0, min_pulse=2)
+    loop.run_until_complete(c.water(None, 60))
+    # proportional to the distance, at least min_pulse
+    assert dispatcher.pulses == [5, 2.5, 2, 2]
+
+def test_daily_budget(loop, virtualClock, dispatcher):
+    c = controller(dispatcher, 0, daily_budget=25)
+    assert loop.run_until_complete(c.water(None, 60)) == 25
+    assert loop.run_until_complete(c.water(None, 60)) == 0
+    # the budget is per day
+    virtualClock.advance(86400)
+    assert loop.run_until_complete(c.water(None, 5)) == 5
+
+def test_fallback_without_sensor(loop, dispatcher):
+    c = controller(dispatcher, None, daily_budget=100)
+    assert loop.run_until_complete(c.water(None, 60)) == 60
+    # still within the daily budget
+    assert loop.run_until_complete(c.water(None, 60)) == 40
+    assert loop.run_until_complete(c.water(None, 60)) == 0
+    assert c.usedToday == 100
@@ -0,0 +1,80 @@
+"""Parsing of the requests by the local HTTP server."""
+
+import asyncio
+
+import pytest
+
+import webserver
+
+class Writer(object):
+    """Stream writer collecting the response."""
+
+    def __init__(self):
+        self.data = b""
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+@pytest.fixture
+def requests():
+    return []
+
+@pytest.fixture
+def routes(requests):
+    def echo(request):
+        requests.append(request)
+        return (200, "text/plain", "ok\n")
+
+    def post(request):
+        return (405, "text/plain", "use POST\n")
+
+    def fail(request):
+        raise RuntimeError("bug")
+
+    return {"/echo": echo, "/post": post, "/fail": fail}
+
+def serve(loop, routes, data):
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    writer = Writer()
+    loop.run_until_complete(webserver._handler(routes, None)(reader, writer))
+    assert writer.closed
+    head, _, body = writer.data.partition(b"\r\n\r\n")
+    return head.decode("latin-1").split("\r\n")[0], body
+
+def test_request(loop, routes, requests):
+    status, body = serve(loop, routes, b"post /echo?channel=temp&seconds=60&seconds=120 HTTP/1.0\r\n"
+                                       b"Content-Type: application/json\r\n"
+                                       b"Content-Length: 4\r\n\r\n{}\r\n")
+    assert (status, body) == ("HTTP/1.0 200 OK", b"ok\n")
+    request, = requests
+    assert request.method == "POST"
+    assert request.path == "/echo"
+    # the last one of the repeated parameters
+    assert request.query == {"channel": "temp", "seconds": "120"}
+    assert request.headers == {"content-type": "application/json", "content-length": "4"}
+    assert request.body == b"{}\r\n"
+
+@pytest.mark.parametrize("data, status", [
+    (b"GET /missing HTTP/1.0\r\n\r\n", "HTTP/1.0 404 Not Found"),
+    (b"GET /post HTTP/1.0\r\n\r\n", "HTTP/1.0 405 Method Not Allowed"),
+    (b"GET /fail HTTP/1.0\r\n\r\n", "HTTP/1.0 500 Internal Server Error"),
+    (b"garbage\r\n\r\n", "HTTP/1.0 400 Bad Request"),
+    (b"POST /echo HTTP/1.0\r\nContent-Length: 100000\r\n\r\n", "HTTP/1.0 413 Payload Too Large"),
+])
+def test_error(loop, routes, requests, data, status):
+    assert serve(loop, routes, data)[0] == status
+    assert requests == []
+
+def test_truncated_body(loop, routes, requests):
+    # the client went away; nothing to answer
+    assert serve(loop, routes, b"POST /echo HTTP/1.0\r\nContent-Length: 10\r\n\r\n{}") == ("", b"")
+    assert requests == []
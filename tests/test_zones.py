@@ -0,0 +1,92 @@
+"""Zone runs sharing the pump within the power budget."""
+
+import asyncio
+
+import pytest
+
+import zones
+
+class Relay(object):
+
+    def __init__(self):
+        self.value = True
+
+class Level(object):
+    """Tank which is never running dry unless told to."""
+
+    def __init__(self, empty=False):
+        self.empty = empty
+        self.listeners = []
+
+    def addListener(self, listener):
+        self.listeners.append(listener)
+
+    async def waitEmpty(self, timeout=None):
+        await asyncio.sleep(timeout)
+        return False
+
+@pytest.fixture
+def pump():
+    return Relay()
+
+@pytest.fixture
+def valves():
+    return {}
+
+def dispatcher(loop, pump, valves, level=None):
+    def createRelay(pin):
+        valves[pin] = Relay()
+        return valves[pin]
+
+    d = zones.ZoneDispatcher(loop, pump, level or Level(), createRelay)
+    d.configure({name: {"pin": pin, "load": 0.5}
+                 for name, pin in (("a", "D5"), ("b", "D6"), ("c", "D12"))},
+                {"budget": 2.0, "pump": 1.0})
+    return d
+
+def water(loop, d, runs):
+    """Start the runs at once; return when each of those ended."""
+    started = loop.time()
+    ended = {}
+
+    async def run(zone, seconds):
+        await d.water(zone, seconds)
+        ended[zone] = loop.time() - started
+
+    loop.run_until_complete(asyncio.gather(*(run(zone, s) for zone, s in runs)))
+    return ended
+
+def test_budget_longest_first(loop, pump, valves):
+    d = dispatcher(loop, pump, valves)
+    peak = []
+    loop.call_later(1, lambda: peak.append(d.load()))
+    # the pump and two valves fit the budget; c and b go first
+    ended = water(loop, d, [("a", 10), ("b", 20), ("c", 30)])
+    assert ended == {"c": 30, "b": 20, "a": 30}
+    assert peak == [2.0]
+    assert pump.value is True
+    assert all(valve.value is True for valve in valves.values())
+
+def test_same_zone_never_overlaps(loop, pump, valves):
+    d = dispatcher(loop, pump, valves)
+    ended = water(loop, d, [("a", 10), ("a", 10)])
+    assert ended == {"a": 20}
+
+def test_single_run_over_budget(loop, pump, valves):
+    d = dispatcher(loop, pump, valves)
+    d.configure({"big": {"pin": "D5", "load": 5.0}}, {"budget": 2.0, "pump": 1.0})
+    assert water(loop, d, [("big", 10)]) == {"big": 10}
+
+def test_default_zone(loop, pump, valves):
+    d = zones.ZoneDispatcher(loop, pump, Level(), None)
+    assert loop.run_until_complete(d.water(None, 15)) == 15
+    assert pump.value is True
+
+def test_unknown_zone(loop, pump, valves):
+    d = dispatcher(loop, pump, valves)
+    assert loop.run_until_complete(d.water("z", 15)) == 0
+
+def test_empty_tank(loop, pump, valves):
+    d = dispatcher(loop, pump, valves, Level(empty=True))
+    assert loop.run_until_complete(d.water("a", 15)) == 0
+    assert pump.value is True
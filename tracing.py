@@ -0,0 +1,108 @@
+"""Recording of what the daemon sees and does.
+
+The trace keeps, with the time relative to its start, each sensor sample
+(including the failed ones), the commands from the server or the local
+API, the configuration pushed by the server, the jobs started by the
+scheduler, the relay transitions and the water level changes. It can be
+replayed later on the virtual clock (see replay.py) to reproduce a problem
+seen on the device.
+
+The file starts with the JSON header (start time and configuration)
+followed by a JSON array per line:
+
+    [12.004, "s", "dht", {"temp": 22, "humid": 50}]     sample
+    [13.008, "s", "dht", null, "checksum did not validate"]
+    [60.0, "c", "{\"command\": \"pump_on\", \"duration\": 10}"]
+    [60.0, "d", "pump", ["10"]]                         job dispatched
+    [60.001, "r", "pump", 1]                            relay switched on
+    [90.0, "u", "{\"version\": 4, \"schedule\": [...]}"]  configuration
+    [460.3, "l", 1]                                     tank is empty
+
+and is compressed with gzip if its name ends with .gz.
+"""
+
+import gzip
+import json
+import threading
+
+import clock
+import log
+
+logger = log.getLogger("trace")
+
+SAMPLE = "s"
+COMMAND = "c"
+DISPATCH = "d"
+RELAY = "r"
+LEVEL = "l"
+CONFIG = "u"
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+class TraceRecorder(object):
+    """
+    :param config: the configuration dict stored in the header
+    """
+
+    def __init__(self, path, config):
+        self.path = path
+        self.start = clock.now().timestamp()
+        # commands are recorded on the MQTT thread
+        self.lock = threading.Lock()
+        self.file = _open(path, "w")
+        self.file.write(json.dumps({"version": 1, "start": self.start, "config": config}) + "\n")
+        self.records = 0
+
+    def _write(self, *record):
+        line = json.dumps([round(clock.now().timestamp() - self.start, 3)] + list(record),
+                          separators=(",", ":"))
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(line + "\n")
+            self.records += 1
+
+    def onSample(self, sensor, values, error=None):
+        if values is None:
+            self._write(SAMPLE, sensor, None, str(error))
+        else:
+            self._write(SAMPLE, sensor, values)
+
+    def onCommand(self, payload):
+        self._write(COMMAND, payload)
+
+    def onConfig(self, payload):
+        self._write(CONFIG, payload)
+
+    def onDispatch(self, job, attr):
+        self._write(DISPATCH, job, attr)
+
+    def onRelay(self, name, on):
+        self._write(RELAY, name, 1 if on else 0)
+
+    def onLevel(self, empty):
+        self._write(LEVEL, 1 if empty else 0)
+
+    def close(self):
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.close()
+            self.file = None
+        logger.info("recorded %s events to %s", self.records, self.path)
+
+def read(path):
+    """Return the header and the list of records of the trace."""
+    with _open(path, "r") as f:
+        header = json.loads(f.readline())
+        records = []
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # the last line can be cut if the daemon was killed
+                break
+    return header, records
@@ -0,0 +1,87 @@
+"""Watchdog of the event loop.
+
+Everything (measurements, schedule and the pump level checks) is running
+on a single event loop so any blocking call is delaying all the rest. The
+watchdog is measuring how late the loop is waking up a heartbeat task and,
+from a separate thread, catches the loop being stuck for longer than the
+threshold. Once it happens the stack of the loop thread is captured, so
+that the offending call can be found, and logged together with the lag.
+"""
+
+import asyncio
+import sys
+import threading
+import time
+import traceback
+
+import log
+import metrics
+
+logger = log.getLogger("watchdog")
+
+LAG = metrics.histogram(
+    "loop_lag_seconds", "How late the event loop woke up the heartbeat.",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+STALLS = metrics.counter("loop_stalls_total", "Event loop blocked for longer than threshold.")
+
+class LoopWatchdog(object):
+    """
+    :param threshold: lag in seconds considered as the loop being blocked
+    :param interval: how often the heartbeat is scheduled
+    """
+
+    def __init__(self, loop, threshold=0.5, interval=0.1):
+        self.loop = loop
+        self.threshold = threshold
+        self.interval = interval
+        self.beat = time.monotonic()
+        self.stack = None
+        self.running = False
+        self.task = None
+        self.thread = None
+        self.loopThread = None
+
+    def start(self):
+        self.running = True
+        self.task = self.loop.create_task(self._heartbeat())
+        self.thread = threading.Thread(target=self._monitor, name="watchdog", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.task:
+            self.task.cancel()
+
+    async def _heartbeat(self):
+        self.loopThread = threading.get_ident()
+        while self.running:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.beat = now
+            lag = max(0.0, now - expected)
+            LAG.observe(lag)
+            if lag > self.threshold:
+                stack, self.stack = self.stack, None
+                logger.warning("event loop blocked for %.3f s%s", lag,
+                    "; blocking call:\n" + stack if stack else "")
+
+    def _monitor(self):
+        # checking a few times per threshold so we catch the blocking
+        # call while it is still on the stack
+        period = self.threshold / 4.0
+        reported = None
+        while self.running:
+            time.sleep(period)
+            beat = self.beat
+            if time.monotonic() - beat < self.threshold + self.interval:
+                continue
+            # report each stall only once
+            if reported == beat or self.loopThread is None:
+                continue
+            reported = beat
+            frame = sys._current_frames().get(self.loopThread)
+            if frame is None:
+                continue
+            STALLS.inc()
+            self.stack = "".join(traceback.format_stack(frame))
@@ -0,0 +1,155 @@
+"""Closed loop watering driven by the soil moisture.
+
+In the default "fixed" mode the pump runs for the time given by the job.
+In the closed loop modes the time of the job is the upper limit and the
+pump runs in short pulses only until the soil moisture reaches the target:
+
+    hysteresis - water only if the moisture dropped below
+                 `target - hysteresis`; then pulses of `max_pulse` seconds
+                 until the target is reached
+    pi         - the same start condition but the pulse length is computed
+                 by PI controller from the distance to the target
+
+After each pulse the controller waits `soak` seconds for the water to get
+to the sensor before reading it again; that is also limiting how fast the
+pump can be switched. The pump time of all the closed loop jobs can be
+capped with `daily_budget` seconds. The configuration goes to the
+"watering" section, i.e.:
+
+    "watering": {"mode": "pi", "target": 600, "hysteresis": 30, "max_pulse": 10,
+                 "min_pulse": 2, "soak": 60, "kp": 0.05, "ki": 0.01, "daily_budget": 300}
+"""
+
+import asyncio
+
+import clock
+import log
+import metrics
+
+logger = log.getLogger("watering")
+
+MODES = ("fixed", "hysteresis", "pi")
+
+DEFAULT_WATERING = {
+    "mode": "fixed",
+    "target": 600,
+    "hysteresis": 30,
+    "max_pulse": 10,
+    "min_pulse": 2,
+    "soak": 60,
+    "kp": 0.05,
+    "ki": 0.01,
+    "daily_budget": None,
+}
+
+SOIL = metrics.gauge("soil_moisture", "Last soil moisture reading.")
+PUMP_TIME = metrics.counter(
+    "watering_pump_seconds_total", "Pump time of the closed loop watering.")
+SAVED = metrics.counter(
+    "watering_saved_seconds_total", "Pump time saved compared to the fixed schedule.")
+SKIPPED = metrics.counter(
+    "watering_skipped_total", "Jobs skipped as the soil was moist enough.")
+
+def readMoisture(soil):
+    # returns None if the sensor is not connected or failed
+    if soil is None:
+        return None
+    try:
+        value = soil.moisture_read()
+    except (OSError, RuntimeError) as e:
+        logger.warning("soil moisture read failed: %s", e)
+        return None
+    SOIL.set(value)
+    return value
+
+class MoistureController(object):
+
+    def __init__(self, dispatcher, soil):
+        self.dispatcher = dispatcher
+        self.soil = soil
+        self.config = dict(DEFAULT_WATERING)
+        self.day = None
+        self.usedToday = 0.0
+        self.saved = 0.0
+
+    def configure(self, config):
+        self.config = dict(DEFAULT_WATERING)
+        self.config.update(config)
+
+    def enabled(self):
+        return self.config["mode"] != "fixed" and self.soil is not None
+
+    def _budgetLeft(self):
+        today = clock.now().date()
+        if today != self.day:
+            self.day = today
+            self.usedToday = 0.0
+        if self.config["daily_budget"] is None:
+            return float("inf")
+        return max(0.0, self.config["daily_budget"] - self.usedToday)
+
+    def _pulse(self, error, integral):
+        cfg = self.config
+        if cfg["mode"] == "hysteresis":
+            return cfg["max_pulse"]
+        pulse = cfg["kp"] * error + cfg["ki"] * integral
+        return min(cfg["max_pulse"], max(cfg["min_pulse"], pulse))
+
+    async def water(self, zone, seconds):
+        """Water the zone for at most the given number of seconds.
+        Returns the number of seconds the pump was running."""
+        cfg = self.config
+        moisture = readMoisture(self.soil)
+        if moisture is None:
+            # better to water than to let the plants dry out, but
+            # still within the daily budget
+            seconds = min(seconds, self._budgetLeft())
+            if seconds <= 0:
+                logger.warning("no soil moisture reading and daily pump budget used up")
+                return 0
+            logger.warning("no soil moisture reading; watering for %s seconds", seconds)
+            watered = await self.dispatcher.water(zone, seconds)
+            self.usedToday += watered
+            PUMP_TIME.inc(watered)
+            return watered
+
+        if moisture >= cfg["target"] - cfg["hysteresis"]:
+            logger.info("soil moisture %s is fine; skipping watering", moisture)
+            SKIPPED.inc()
+            self._report(seconds, 0)
+            return 0
+
+        used = 0.0
+        integral = 0.0
+        while used < seconds:
+            error = cfg["target"] - moisture
+            if error <= 0:
+                break
+            integral += error
+            pulse = min(self._pulse(error, integral), seconds - used, self._budgetLeft())
+            if pulse < cfg["min_pulse"] and pulse < seconds - used:
+                logger.warning("daily pump budget used up")
+                break
+            watered = await self.dispatcher.water(zone, pulse)
+            used += watered
+            self.usedToday += watered
+            if watered < pulse:
+                # the tank is empty
+                break
+            # give the water time to get to the sensor
+            await asyncio.sleep(cfg["soak"])
+            moisture = readMoisture(self.soil)
+            if moisture is None:
+                break
+            logger.debug("soil moisture %s after %.0f s of watering", moisture, used)
+
+        self._report(seconds, used)
+        return used
+
+    def _report(self, scheduled, used):
+        saved = max(0.0, scheduled - used)
+        self.saved += saved
+        PUMP_TIME.inc(used)
+        SAVED.inc(saved)
+        logger.info("watered for %.0f s of %s s scheduled; saved %.0f s (%.0f s in total)",
+            used, scheduled, saved, self.saved)
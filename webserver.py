@@ -0,0 +1,120 @@
+"""Minimal asyncio HTTP/1.0 server used for the local endpoints.
+
+It is running on the daemon event loop so the handlers must never block;
+they are given the request and return `(status, content type, body)`
+(or a coroutine returning it).
+"""
+
+import asyncio
+from urllib.parse import urlsplit, parse_qs
+
+import log
+
+logger = log.getLogger("http")
+
+# we are serving small requests only
+MAX_BODY = 64 * 1024
+REQUEST_TIMEOUT = 5
+
+REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large",
+           429: "Too Many Requests", 500: "Internal Server Error",
+           503: "Service Unavailable"}
+
+class Request(object):
+
+    def __init__(self, method, target, headers, body):
+        url = urlsplit(target)
+        self.method = method
+        self.path = url.path
+        self.query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        self.headers = headers
+        self.body = body
+
+async def _readRequest(reader):
+    line = await reader.readline()
+    try:
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        return None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY:
+        raise ValueError("request too large")
+    body = await reader.readexactly(length) if length else b""
+    return Request(method.upper(), target, headers, body)
+
+def _response(status, contentType, body):
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    head = "HTTP/1.0 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: close\r\n\r\n".format(
+        status, REASONS.get(status, ""), contentType, len(body))
+    return head.encode("latin-1") + body
+
+def _handler(routes, limit):
+    active = [0]
+
+    async def handle(reader, writer):
+        # refuse instead of queueing the clients; the request is read
+        # anyway as closing the socket with unread data resets it
+        if limit and active[0] >= limit:
+            try:
+                await asyncio.wait_for(_readRequest(reader), REQUEST_TIMEOUT)
+                writer.write(_response(503, "text/plain", "too many clients\n"))
+                await writer.drain()
+            except (ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                    ConnectionError):
+                pass
+            finally:
+                writer.close()
+            return
+        active[0] += 1
+        try:
+            try:
+                request = await asyncio.wait_for(_readRequest(reader), REQUEST_TIMEOUT)
+            except ValueError:
+                writer.write(_response(413, "text/plain", "request too large\n"))
+                return
+            if request is None:
+                writer.write(_response(400, "text/plain", "bad request\n"))
+                return
+
+            route = routes.get(request.path)
+            if route is None:
+                writer.write(_response(404, "text/plain", "not found\n"))
+                return
+            try:
+                result = route(request)
+                if asyncio.iscoroutine(result):
+                    result = await result
+            except Exception as e:
+                logger.error("error handling %s: %s", request.path, e)
+                result = (500, "text/plain", "internal error\n")
+            writer.write(_response(*result))
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            active[0] -= 1
+            writer.close()
+
+    return handle
+
+async def start(routes, host=None, port=None, path=None, limit=None):
+    """Start serving the routes (a dict of path and handler) on the given
+    TCP address or the Unix socket path.
+    :param limit: maximum number of clients served at the same time
+    """
+    if path:
+        server = await asyncio.start_unix_server(_handler(routes, limit), path=path)
+        logger.info("serving %s on %s", sorted(routes), path)
+    else:
+        server = await asyncio.start_server(_handler(routes, limit), host, port)
+        logger.info("serving %s on %s:%s", sorted(routes), host, port)
+    return server
@@ -0,0 +1,187 @@
+"""Watering of multiple zones sharing one pump and one power supply.
+
+Each zone has its own valve (relay) and the load it puts on the supply
+while open. The pump is running whenever at least one valve is open. The
+runs are queued and started as soon as the supply can handle them; the
+longest run (by its duration) that fits within the power budget goes first
+so that all the zones are watered in the shortest total time. Runs of the same
+zone are never overlapping.
+
+The zones are declared in the configuration, i.e.:
+
+    "zones": {"zone1": {"pin": "D17", "load": 0.3}, "zone2": {"pin": "D27", "load": 0.3}},
+    "power": {"budget": 2.0, "pump": 1.2}
+
+Without any zones the pump is used alone as the default zone (`None`).
+"""
+
+import asyncio
+
+import clock
+import log
+import metrics
+
+logger = log.getLogger("actuators")
+
+RELAY_ON = metrics.gauge("relay_on", "1 if the relay is switched on.", ("relay",))
+RELAY_ON_TIME = metrics.counter(
+    "relay_on_seconds_total", "Time the relay was switched on.", ("relay",))
+QUEUED = metrics.gauge("zone_runs_queued", "Zone runs waiting for the power budget.")
+LOAD = metrics.gauge("power_load", "Current load of the running pump and valves.")
+
+class Zone(object):
+
+    def __init__(self, name, valve, load):
+        self.name = name
+        self.valve = valve
+        self.load = load
+
+class ZoneRun(object):
+
+    def __init__(self, zone, seconds, done):
+        self.zone = zone
+        self.seconds = seconds
+        self.done = done
+        self.task = None
+
+class ZoneDispatcher(object):
+    """
+    :param createRelay: function returning the relay for the given pin name
+    """
+
+    def __init__(self, loop, pump, levelMonitor, createRelay):
+        self.loop = loop
+        self.pump = pump
+        self.levelMonitor = levelMonitor
+        self.createRelay = createRelay
+        self.zones = {None: Zone(None, None, 0.0)}
+        self.relays = {}
+        self.budget = None
+        self.pumpLoad = 0.0
+        self.queue = []
+        self.running = {}
+        self.pumpStarted = None
+        self.dispatching = None
+        levelMonitor.addListener(self._onLevel)
+        QUEUED.setFunction(lambda: len(self.queue))
+        LOAD.setFunction(self.load)
+
+    def configure(self, zones, power):
+        configured = {None: self.zones[None]}
+        for name, zone in zones.items():
+            relay = self.relays.get(zone["pin"])
+            if relay is None:
+                try:
+                    relay = self.createRelay(zone["pin"])
+                except Exception as e:
+                    logger.error("can not set up valve of %s on %s: %s", name, zone["pin"], e)
+                    continue
+                self.relays[zone["pin"]] = relay
+            configured[name] = Zone(name, relay, zone.get("load", 0.0))
+        self.zones = configured
+        self.budget = power.get("budget")
+        self.pumpLoad = power.get("pump", 0.0)
+        logger.info("zones: %s, power budget: %s", sorted(z for z in configured if z), self.budget)
+
+    def load(self):
+        if not self.running:
+            return 0.0
+        return self.pumpLoad + sum(run.zone.load for run in self.running.values())
+
+    async def water(self, zoneName, seconds):
+        """Water the zone for the given number of seconds once the power
+        budget allows it. Returns the number of seconds it was watered."""
+        zone = self.zones.get(zoneName)
+        if zone is None:
+            logger.error("unknown zone: %s", zoneName)
+            return 0
+        run = ZoneRun(zone, seconds, self.loop.create_future())
+        self.queue.append(run)
+        # the jobs scheduled at the same time are all queued within the
+        # same loop iteration; let them all come before deciding the order
+        if self.dispatching is None:
+            self.dispatching = self.loop.call_soon(self._dispatch)
+        try:
+            return await run.done
+        except asyncio.CancelledError:
+            if run in self.queue:
+                self.queue.remove(run)
+            elif run.task:
+                run.task.cancel()
+            raise
+
+    def _fits(self, zone):
+        # we always allow a single run; otherwise a zone exceeding
+        # the budget alone would never be watered
+        if self.budget is None or not self.running:
+            return True
+        return self.load() + zone.load <= self.budget
+
+    def _dispatch(self):
+        self.dispatching = None
+        if self.levelMonitor.empty:
+            for run in self.queue:
+                logger.warning("water level is too low; can not start pump")
+                run.done.set_result(0)
+            self.queue = []
+            return
+        # longest first gives the shortest total time
+        for run in sorted(self.queue, key=lambda r: -r.seconds):
+            if run.zone.name in self.running or not self._fits(run.zone):
+                continue
+            self.queue.remove(run)
+            self.running[run.zone.name] = run
+            run.task = self.loop.create_task(self._run(run))
+
+    async def _run(self, run):
+        zone = run.zone
+        logger.info("will try to start pump for %s seconds (zone %s)", run.seconds, zone.name)
+        started = clock.monotonic()
+        cancelled = False
+        try:
+            # open the valve before starting the pump
+            if zone.valve:
+                zone.valve.value = False
+                RELAY_ON.labels(zone.name).set(1)
+            self._pumpOn()
+            # the level monitor wakes us up as soon as the tank runs dry
+            if await self.levelMonitor.waitEmpty(run.seconds):
+                logger.warning("water level is too low; stopping pump")
+        except asyncio.CancelledError:
+            # the daemon is stopping; don't start anything else
+            cancelled = True
+            raise
+        except Exception as e:
+            logger.error("some error occured: %s", e)
+        finally:
+            del self.running[zone.name]
+            if not self.running:
+                self._pumpOff()
+            if zone.valve:
+                zone.valve.value = True
+                RELAY_ON.labels(zone.name).set(0)
+                RELAY_ON_TIME.labels(zone.name).inc(clock.monotonic() - started)
+            if not run.done.done():
+                run.done.set_result(clock.monotonic() - started)
+            if not cancelled:
+                self._dispatch()
+
+    def _pumpOn(self):
+        if self.pumpStarted is None:
+            self.pump.value = False
+            self.pumpStarted = clock.monotonic()
+            RELAY_ON.labels("pump").set(1)
+
+    def _pumpOff(self):
+        # make sure that the pump is off at the end
+        logger.info("stopping pump...")
+        self.pump.value = True
+        if self.pumpStarted is not None:
+            RELAY_ON.labels("pump").set(0)
+            RELAY_ON_TIME.labels("pump").inc(clock.monotonic() - self.pumpStarted)
+            self.pumpStarted = None
+
+    def _onLevel(self, empty):
+        # the running ones are stopped by themselves; drop the queued
+        if empty:
+            self._dispatch()